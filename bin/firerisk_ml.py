@@ -1,4 +1,4 @@
-from src import RiskAssesmentML
+from src import RiskAssesmentML, ColumnStore
 
 
 def main():
@@ -36,7 +36,11 @@ def main():
 
     fire_data_path = "/Users/ishaan/Documents/GitHub/risk_assesment_sum22/data/WFIGS_-_Wildland_Fire_Locations_Full_History.csv"
 
-    fire_risk_ml = RiskAssesmentML(fire_data_path, coordinate_file, data_path, rule_list, features)
+    # Feature data is written to the store on the first run and memory-mapped from it afterwards
+    feature_store = ColumnStore(data_path + "/store/")
+
+    fire_risk_ml = RiskAssesmentML(fire_data_path, coordinate_file, data_path, rule_list, features,
+                                   feature_store=feature_store)
     fire_risk_ml.run_ml_train()
 
 
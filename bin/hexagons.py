@@ -0,0 +1,36 @@
+import argparse
+
+from src import ColumnStore, HexAggregator
+
+
+def main():
+    """
+    Aggregates the fire risk of every pixel into H3 hexagons and writes a GeoJson file for every resolution
+
+    Usage:
+    python -m bin.hexagons
+    python -m bin.hexagons --resolutions 9 10 11 12 --value max
+
+    The fire risk is read from the "fire_risk" stage of the column store written by run_firerisk, the multi-resolution
+    cell table is saved to its "hexagons" stage
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Aggregate the fire risk into H3 hexagons")
+    parser.add_argument("--store-path", default="data/store/", help="Folder of the column store")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[10, 11, 12], help="H3 resolutions")
+    parser.add_argument("--value", default="mean", choices=["sum", "mean", "max", "count"],
+                        help="Aggregate written as the risk of every hexagon")
+    parser.add_argument("--output", default="coords{resolution}.json", help="Output file name, {resolution} is replaced")
+    args = parser.parse_args()
+
+    data = ColumnStore(args.store_path).read_columns("fire_risk")
+    aggregator = HexAggregator(resolutions=args.resolutions)
+    hex_table = aggregator.run(data["x"], data["y"], data["fire_risk"], output_pattern=args.output, value=args.value)
+    # Multi-resolution cell table, queried by the server
+    hex_table.save(ColumnStore(args.store_path), "hexagons")
+    for resolution in hex_table.resolutions:
+        print(f"Resolution {resolution}: {len(hex_table.level(resolution))} hexagons")
+
+
+if __name__ == "__main__":
+    main()
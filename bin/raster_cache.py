@@ -0,0 +1,39 @@
+import argparse
+import datetime
+
+from src import RasterCache
+
+
+def main():
+    """
+    Inspects or prunes the cache of derived rasters (merged, DEM processed, reprojected and clipped files)
+
+    Usage:
+    python -m bin.raster_cache list
+    python -m bin.raster_cache prune --max-gb 5
+    python -m bin.raster_cache clear
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Inspect or prune the derived raster cache")
+    parser.add_argument("command", choices=["list", "prune", "clear"])
+    parser.add_argument("--cache-path", default="data/cache/", help="Folder of the raster cache")
+    parser.add_argument("--max-gb", type=float, default=20, help="Size to prune the cache to in GB")
+    args = parser.parse_args()
+
+    cache = RasterCache(args.cache_path)
+    if args.command == "list":
+        for entry in cache.entries():
+            last_used = datetime.datetime.fromtimestamp(entry["last_used"]).strftime("%Y-%m-%d %H:%M")
+            operation = entry["description"].get("operation", "")
+            print(f"{entry['key'][:12]}  {entry['size'] / 1024 ** 2:10.1f} MB  {last_used}  {operation}")
+        print(f"Total: {cache.size() / 1024 ** 3:.2f} GB")
+    elif args.command == "prune":
+        deleted = cache.prune(int(args.max_gb * 1024 ** 3))
+        print(f"Deleted {deleted} entries, cache is {cache.size() / 1024 ** 3:.2f} GB")
+    elif args.command == "clear":
+        deleted = cache.prune(0)
+        print(f"Deleted {deleted} entries")
+
+
+if __name__ == "__main__":
+    main()
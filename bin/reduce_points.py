@@ -0,0 +1,42 @@
+import argparse
+
+from src import ColumnStore, RegionReducer
+
+
+def main():
+    """
+    Splits the fire risk into a grid of regions and writes the highest risk points of every region with the sum of its
+    region to a csv file
+
+    Usage:
+    python -m bin.reduce_points
+    python -m bin.reduce_points --cells 20 --top-k 5 --threshold 4.9 --raster fire_risk.tif
+
+    The fire risk is read from the "fire_risk" stage of the column store written by run_firerisk, or from a raster
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Reduce the fire risk to the highest risk points of every region")
+    parser.add_argument("--store-path", default="data/store/", help="Folder of the column store")
+    parser.add_argument("--raster", default=None, help="Read the fire risk from this raster instead of the store")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10], help="Number of regions along x and y")
+    parser.add_argument("--top-k", type=int, default=None, help="Points kept per region, all points if not set")
+    parser.add_argument("--threshold", type=float, default=4.9, help="Only keep points with a higher risk")
+    parser.add_argument("--output", default="output.csv", help="Output csv file of the kept points")
+    parser.add_argument("--regions-output", default=None, help="Output csv file of the region sums and counts")
+    args = parser.parse_args()
+
+    cells = args.cells[0] if len(args.cells) == 1 else tuple(args.cells[:2])
+    reducer = RegionReducer(cells=cells, top_k=args.top_k, threshold=args.threshold)
+    if args.raster is not None:
+        regions, points = reducer.reduce_raster(args.raster)
+    else:
+        regions, points = reducer.reduce_frame(ColumnStore(args.store_path).read_columns("fire_risk"))
+
+    print(f"{len(points)} points in {len(regions)} regions")
+    points.to_csv(args.output, index=False)
+    if args.regions_output is not None:
+        regions.to_csv(args.regions_output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import sys
+
+from src import run_firerisk_tiles
+
+
+def main():
+    """
+    Runs the Fire Risk Assessment on a large area by splitting the coordinate file into tiles which are processed in
+    parallel and mosaicked into one output
+
+    Note:
+    Change n_x and n_y to change the number of tiles, and workers to change the number of processes (None uses all CPUs)
+
+    The output will be a GeoTiff file and a GeoJson file with Fire Risk located in this folder, the exit status is
+    non-zero if a tile failed
+    :return: None
+    """
+    file_name = "collins_co_coordinates.json"
+    coordinate_file = f"data/{file_name}"
+
+    sys.exit(run_firerisk_tiles(coordinate_file, n_x=3, n_y=3, workers=None))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,11 +30,12 @@ def json_out():
             ]
           }
         })
-hexagons = h3.polyfill_geojson(geoJson, 10)
-json_out()
-hexagons = h3.polyfill_geojson(geoJson, 11)
-json_out()
-hexagons = h3.polyfill_geojson(geoJson, 12)
+# Polyfill once at the finest resolution, coarser hexagons are the parents of the finest ones
+finest_hexagons = h3.polyfill_geojson(geoJson, 12)
+for resolution in [10, 11]:
+    hexagons = {h3.h3_to_parent(hexagon, resolution) for hexagon in finest_hexagons}
+    json_out()
+hexagons = finest_hexagons
 json_out()
 
 with open("out.json", "w") as outfile:
@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+import h3
+import numpy as np
+
+from src.data.hex_aggregation import HexAggregator
+
+
+@lru_cache(maxsize=2 ** 16)
+def cell_boundary(cell_id):
+    """
+    Boundary of an H3 cell, cached since cell geometry never changes
+    :param cell_id: H3 cell (str)
+    :return: Closed ring of [longitude, latitude] vertices (tuple)
+    """
+    return h3.h3_to_geo_boundary(cell_id, geo_json=True)
+
+
+def cell_boundaries(cell_ids):
+    """
+    Boundaries of H3 cells, every distinct cell is computed (or read from the cache) once per request
+    - h3 has no vectorized boundary function (h3.unstable.vect only covers indexing, parents and distances), so cells
+      are computed one by one and repeated cells across requests are served by the cache of cell_boundary
+    :param cell_ids: H3 cells (list of str)
+    :return: Boundary of every distinct cell (dict: cell -> list of [longitude, latitude])
+    """
+    return {cell_id: [list(vertex) for vertex in cell_boundary(cell_id)] for cell_id in dict.fromkeys(cell_ids)}
+
+
+def index_coords(x_coords, y_coords, resolution):
+    """
+    H3 cells of coordinates, indexed in one batched call
+    - x is the latitude and y the longitude, as in the /point and /id routes
+    :param x_coords: Latitude of every point (np array)
+    :param y_coords: Longitude of every point (np array)
+    :param resolution: H3 resolution (int)
+    :return: H3 cell of every point (list of str)
+    """
+    cells = HexAggregator.index_points(y_coords, x_coords, resolution)
+    return [h3.h3_to_string(cell) for cell in cells.tolist()]
+
+
+def parse_coords(body):
+    """
+    Reads coordinates and a resolution from a batch request body, either {"coords": [[x, y], ...], "res": r} or
+    {"x": [...], "y": [...], "res": r}
+    - Raises a ValueError, answered with 400 by the routes, unless every coordinate is a finite latitude (x) and
+      longitude (y) number, given as [x, y] pairs or as two flat lists of the same length
+    :param body: Json request body (dict)
+    :return: Latitudes, longitudes (np arrays) and resolution (int)
+    """
+    if not isinstance(body, dict) or "res" not in body or ("coords" not in body and ("x" not in body or
+                                                                                     "y" not in body)):
+        raise ValueError("Expected a json object with res and coords or x and y")
+    resolution = body["res"]
+    if isinstance(resolution, bool) or not isinstance(resolution, (int, float, str)):
+        raise ValueError(f"Resolution {resolution} is not a number")
+    resolution = float(resolution)
+    if not resolution.is_integer() or not 0 <= resolution <= 15:
+        raise ValueError(f"Resolution {body['res']} is not an integer between 0 and 15")
+    if "coords" in body:
+        coords = as_coords(body["coords"], "coords")
+        if coords.size == 0:
+            coords = coords.reshape(0, 2)
+        if coords.ndim != 2 or coords.shape[1] != 2:
+            raise ValueError("coords is not a list of [x, y] pairs")
+        x_coords, y_coords = coords[:, 0], coords[:, 1]
+    else:
+        x_coords, y_coords = as_coords(body["x"], "x"), as_coords(body["y"], "y")
+        if x_coords.ndim != 1 or y_coords.ndim != 1:
+            raise ValueError("x and y are not flat lists of numbers")
+        if x_coords.shape != y_coords.shape:
+            raise ValueError("x and y have different lengths")
+    if not (np.isfinite(x_coords).all() and np.isfinite(y_coords).all()):
+        raise ValueError("Coordinates are not finite numbers")
+    if np.any(np.abs(x_coords) > 90) or np.any(np.abs(y_coords) > 180):
+        raise ValueError("Coordinates out of range, x is the latitude and y the longitude")
+    return x_coords, y_coords, int(resolution)
+
+
+def as_coords(values, name):
+    """
+    Converts a json list of coordinates to floats
+    - Strings, booleans and null are refused, np.asarray would parse "1.5" and read null as NaN
+    :param values: Json list (list)
+    :param name: Name of the list in the request, for errors (str)
+    :return: Coordinates (np array)
+    """
+    if not isinstance(values, list):
+        raise ValueError(f"{name} is not a list")
+    coords = np.asarray(values, dtype=object)
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in coords.ravel().tolist()):
+        raise ValueError(f"{name} holds values that are not numbers")
+    return coords.astype(np.float64)
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from src.data.raster_cache import RasterCache
+from src.rules import RULE_LIST
+
+# Stages of a risk run, in order, reported as the progress of a job
+STAGES = ["downloading", "loading", "clipping", "resampling", "features", "risk", "output", "publishing"]
+# Seconds between heartbeats of a queued or running job, and without a heartbeat before it is considered lost
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue is full
+    """
+
+
+def write_status(job_path, status, **fields):
+    """
+    Atomically writes the status file of a job
+    :param job_path: Folder of the job (str)
+    :param status: Status of the job ["queued", "running", "done", "failed"] (str)
+    :param fields: Other fields of the status (dict)
+    :return: None
+    """
+    status_file = os.path.join(job_path, "status.json")
+    tmp_file = status_file + f".{uuid.uuid4().hex}.tmp"
+    with open(tmp_file, "w") as fp:
+        json.dump({"status": status, "updated": time.time(), **fields}, fp)
+    os.replace(tmp_file, status_file)
+
+
+def read_status(job_path):
+    """
+    Reads the status file of a job
+    :param job_path: Folder of the job (str)
+    :return: Status of the job, None if it does not exist (dict)
+    """
+    try:
+        with open(os.path.join(job_path, "status.json")) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def touch_heartbeat(job_path):
+    """
+    Records that the job is still queued or running
+    :param job_path: Folder of the job (str)
+    :return: None
+    """
+    heartbeat_file = os.path.join(job_path, "heartbeat")
+    try:
+        os.utime(heartbeat_file)
+    except FileNotFoundError:
+        open(heartbeat_file, "a").close()
+
+
+def heartbeat_age(job_path):
+    """
+    Seconds since the last heartbeat of a job
+    :param job_path: Folder of the job (str)
+    :return: Age of the heartbeat, None if the job never had one (float)
+    """
+    try:
+        return time.time() - os.stat(os.path.join(job_path, "heartbeat")).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def claim_job(job_path):
+    """
+    Claims a job for this process, at most one process holds the claim of a job
+    :param job_path: Folder of the job (str)
+    :return: Whether the claim was acquired (bool)
+    """
+    try:
+        fd = os.open(os.path.join(job_path, "claim"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as fp:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid(), "claimed": time.time()}, fp)
+    touch_heartbeat(job_path)
+    return True
+
+
+def release_job(job_path):
+    """
+    Releases the claim of a job, so it can be run again
+    - The claim is moved away first, when several processes release a lost job only one of them succeeds
+    :param job_path: Folder of the job (str)
+    :return: Whether this process released the claim (bool)
+    """
+    released_file = os.path.join(job_path, f"claim.{uuid.uuid4().hex}.released")
+    try:
+        os.replace(os.path.join(job_path, "claim"), released_file)
+    except FileNotFoundError:
+        return False
+    os.remove(released_file)
+    return True
+
+
+def run_job(job_path, features, data_path):
+    """
+    Runs the risk assessment of a job, used as the process pool task
+    - Mirrors run_firerisk stage by stage, writing the current stage to the status file of the job
+    - Outputs (fire_risk.tif, firerisk.geojson and the column store with the H3 table) are written to the job folder
+    :param job_path: Folder of the job holding aoi.json (str)
+    :param features: All features used for Risk Assessment Model, empty to use the Ambee API for the weather
+                (dict: name of feature -> tuple (path to raster, merged_file_name)
+    :param data_path: Path to all data files, for the shared raster cache (str)
+    :return: None
+    """
+    # Imported in the worker, the server itself starts without GDAL
+    from src.data import MakeData, DownloadData, ColumnStore, HexAggregator
+
+    started = time.time()
+    finished = threading.Event()
+
+    def heartbeat():
+        while not finished.wait(HEARTBEAT_INTERVAL):
+            touch_heartbeat(job_path)
+
+    def stage(name):
+        write_status(job_path, "running", stage=name, stage_index=STAGES.index(name), stages=STAGES, started=started)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        features = dict(features)
+        get_weather = len(features) == 0
+        coordinate_file = os.path.join(job_path, "aoi.json")
+        # Downloads go to the folder of the job, so jobs for overlapping areas never write the same files
+        temp_path = os.path.join(job_path, "temp") + "/"
+        os.makedirs(temp_path, exist_ok=True)
+        stage("downloading")
+        DownloadData(features, MakeData.read_shapes(coordinate_file), filepath=temp_path).download_data()
+
+        stage("loading")
+        store = ColumnStore(os.path.join(job_path, "store"))
+        data = MakeData(coordinate_file, job_path, RULE_LIST, feature_set=features, download_files=False,
+                        get_weather=get_weather, raster_cache=RasterCache(os.path.join(data_path, "cache")),
+                        store=store, create_csv=False)
+        stage("clipping")
+        data.clip_files()
+        stage("resampling")
+        data.resample_data()
+        stage("features")
+        data.create_clip_pd()
+        data.calc_nd_data()
+        stage("risk")
+        data.classify_data()
+        data.calc_fire_risk()
+        stage("output")
+        data.create_fire_risk_tif(os.path.join(job_path, "fire_risk.tif"), cog=True)
+        data.create_fire_risk_geojson(os.path.join(job_path, "firerisk.geojson"))
+        stage("publishing")
+        fire_risk = store.read_columns("fire_risk")
+        HexAggregator().aggregate(fire_risk["x"], fire_risk["y"], fire_risk["fire_risk"]).save(store, "hexagons")
+        # Also removes the downloads in job_path/temp
+        data.del_temp_files()
+    except Exception as e:
+        write_status(job_path, "failed", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc(),
+                     started=started, finished=time.time())
+    else:
+        write_status(job_path, "done", stage_index=len(STAGES), stages=STAGES,
+                     outputs=["fire_risk.tif", "firerisk.geojson"], started=started, finished=time.time())
+    finally:
+        finished.set()
+        release_job(job_path)
+
+
+class JobQueue:
+    def __init__(self, jobs_path="data/jobs/", data_path="data", features=None, workers=2, max_queued=8,
+                 stale_after=STALE_AFTER):
+        """
+        Runs risk assessments for submitted areas on a bounded local process pool
+        - The id of a job is a hash of its area and the versions of its inputs (feature files, rule files and the day
+          for Ambee weather), so an identical submission returns the existing job, and the finished result instantly
+        - Status and progress of every job are kept in jobs_path/<id>/status.json. A job is claimed through an
+          exclusively created claim file in its folder, so server processes sharing jobs_path never run a job twice
+        - The owner of a queued or running job touches its heartbeat file, a job without a heartbeat for stale_after
+          seconds was lost (e.g. the server restarted) and is marked as failed, so it can be submitted again
+        - At most workers jobs run at once and at most max_queued wait in every server process, further submissions
+          raise QueueFull
+
+        :param jobs_path: Folder of the job folders (str)
+        :param data_path: Path to all data files (str)
+        :param features: All features used for Risk Assessment Model, empty to use the Ambee API for the weather
+                    (dict: name of feature -> tuple (path to raster, merged_file_name)
+        :param workers: Number of worker processes (int)
+        :param max_queued: Maximum number of jobs waiting for a worker (int)
+        :param stale_after: Seconds without a heartbeat before a queued or running job is considered lost (float)
+        """
+        self.jobs_path = jobs_path
+        self.data_path = data_path
+        self.features = dict(features or {})
+        self.workers = workers
+        self.max_queued = max_queued
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.executor = None
+        self.heartbeat_thread = None
+        os.makedirs(jobs_path, exist_ok=True)
+        # Jobs lost when a server stopped are failed on startup instead of being reported as running forever
+        for job_id in os.listdir(jobs_path):
+            if os.path.isdir(os.path.join(jobs_path, job_id)):
+                self.status(job_id)
+
+    def input_versions(self):
+        """
+        Versions of the inputs of a run
+        :return: Identity of every feature and rule file, and the day if the weather comes from Ambee (dict)
+        """
+        return RasterCache.input_versions(self.features, RULE_LIST, weather=not self.features)
+
+    @staticmethod
+    def read_aoi(aoi):
+        """
+        Gets the polygon of an area from GeoJson
+        :param aoi: Polygon or MultiPolygon geometry, a Feature or a FeatureCollection with one feature (dict)
+        :return: Polygon geometry (dict)
+        """
+        if isinstance(aoi, dict) and aoi.get("type") == "FeatureCollection":
+            if len(aoi.get("features", [])) != 1:
+                raise ValueError("A FeatureCollection area needs exactly one feature")
+            aoi = aoi["features"][0]
+        if isinstance(aoi, dict) and aoi.get("type") == "Feature":
+            aoi = aoi.get("geometry")
+        if not isinstance(aoi, dict) or aoi.get("type") not in ("Polygon", "MultiPolygon") or \
+                not aoi.get("coordinates"):
+            raise ValueError("The area must be a GeoJson Polygon or MultiPolygon")
+        return {"type": aoi["type"], "coordinates": aoi["coordinates"]}
+
+    def job_id(self, aoi):
+        """
+        Id of the job of an area with the current inputs
+        :param aoi: Polygon geometry (dict)
+        :return: Job id (str)
+        """
+        description = {"aoi": aoi, "inputs": self.input_versions()}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+    def submit(self, aoi):
+        """
+        Submits the risk assessment of an area, or returns the existing job of an identical submission
+        - Failed and lost jobs are run again when resubmitted
+        :param aoi: Area as GeoJson (dict)
+        :return: Job id (str) and status (dict)
+        """
+        aoi = self.read_aoi(aoi)
+        job_id = self.job_id(aoi)
+        job_path = os.path.join(self.jobs_path, job_id)
+        with self.lock:
+            self.__forget_finished()
+            status = self.status(job_id)
+            if status and status["status"] in ("queued", "running", "done"):
+                return job_id, status
+            if len(self.futures) >= self.workers + self.max_queued:
+                raise QueueFull(f"{len(self.futures)} jobs are queued or running, try again later")
+
+            os.makedirs(job_path, exist_ok=True)
+            if not claim_job(job_path):
+                # Another server process claimed the job since its status was read
+                return job_id, self.status(job_id)
+            with open(os.path.join(job_path, "aoi.json"), "w") as fp:
+                json.dump(aoi, fp)
+            write_status(job_path, "queued", submitted=time.time())
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+                self.heartbeat_thread.start()
+            self.futures[job_id] = self.executor.submit(run_job, job_path, self.features, self.data_path)
+        return job_id, read_status(job_path)
+
+    def status(self, job_id):
+        """
+        Gets the status and progress of a job, marking it as failed if it was lost
+        :param job_id: Job id (str)
+        :return: Status of the job, None if it does not exist (dict)
+        """
+        if not job_id or not all(char in "0123456789abcdef" for char in job_id):
+            return None
+        job_path = os.path.join(self.jobs_path, job_id)
+        status = read_status(job_path)
+        if status is None or status["status"] not in ("queued", "running"):
+            return status
+        age = heartbeat_age(job_path)
+        if age is not None and age <= self.stale_after:
+            return dict(status, heartbeat=round(age, 1))
+        release_job(job_path)
+        error = f"Job lost, no heartbeat for {self.stale_after} seconds (the server or worker stopped)"
+        write_status(job_path, "failed", error=error, lost=status)
+        return read_status(job_path)
+
+    def output_path(self, job_id, output_name):
+        """
+        Path to an output file of a finished job
+        :param job_id: Job id (str)
+        :param output_name: Name of the output file (str)
+        :return: Path to the output, None if the job is not done or has no such output (str)
+        """
+        status = self.status(job_id)
+        if not status or status["status"] != "done" or output_name not in status.get("outputs", []):
+            return None
+        return os.path.join(self.jobs_path, job_id, output_name)
+
+    def __heartbeat(self):
+        """
+        Touches the heartbeat of the jobs of this process, including jobs still waiting for a worker
+        :return: None
+        """
+        while True:
+            with self.lock:
+                job_ids = [job_id for job_id, future in self.futures.items() if not future.done()]
+            for job_id in job_ids:
+                touch_heartbeat(os.path.join(self.jobs_path, job_id))
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def __forget_finished(self):
+        """
+        Drops finished jobs from self.futures, so they no longer count towards the queue limit
+        :return: None
+        """
+        for job_id in [job_id for job_id, future in self.futures.items() if future.done()]:
+            future = self.futures.pop(job_id)
+            if future.exception() is not None:
+                # The worker process died before it could write the status
+                job_path = os.path.join(self.jobs_path, job_id)
+                write_status(job_path, "failed", error=repr(future.exception()))
+                release_job(job_path)
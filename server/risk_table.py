@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+import h3
+import h3.api.numpy_int as h3_int
+import numpy as np
+
+from src.data.column_store import ColumnStore
+from src.data.hex_aggregation import cell_parents
+
+
+class RiskTable:
+    def __init__(self, store_path="data/store/", stage="hexagons", value="mean", check_interval=1.0):
+        """
+        Fire risk of every H3 cell, answering lookups with a binary search over the sorted cell table written by
+        HexTable.save
+        - The cell and value columns are memory-mapped, so all server worker processes share one copy in the page cache
+        - Cells missing from the table fall back to the value of their closest parent in the table
+        - The table is reloaded without restarting when a new run is published (the sidecar of the stage changes),
+          checked at most every check_interval seconds
+
+        :param store_path: Folder of the column store (str)
+        :param stage: Name of the stage holding the cell table (str)
+        :param value: Aggregate used as the risk of a cell ["sum", "mean", "max", "count"] (str)
+        :param check_interval: Minimum number of seconds between checks for a new table (float)
+        """
+        self.store = ColumnStore(store_path)
+        self.stage = stage
+        self.value = value
+        self.check_interval = check_interval
+        self.meta_file = os.path.join(store_path, stage + ".json")
+        self.lock = threading.Lock()
+        self.version = None
+        self.last_check = 0.0
+        # Swapped as one tuple so a lookup never sees the cells of one table with the values of another
+        self.table = (np.array([], dtype=np.uint64), np.array([], dtype=np.float64))
+        self.reload()
+
+    def reload(self):
+        """
+        Loads the cell table if it was published since the last load
+        :return: Whether a new table was loaded (bool)
+        """
+        try:
+            version = os.stat(self.meta_file).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            self.last_check = time.monotonic()
+            if version == self.version:
+                return False
+            # A stage being published can have its new columns in place before its new sidecar, the table is only
+            # swapped once the columns match the sidecar, else the old table is kept until the next check
+            try:
+                rows = self.store.read_meta(self.stage)["rows"]
+                columns = self.store.read_columns(self.stage, columns=["cell", self.value], mmap=True)
+            except (FileNotFoundError, KeyError, ValueError) as e:
+                print(f"Warning: risk table {self.stage} is being published, keeping the loaded table ({e})")
+                return False
+            if len(columns["cell"]) != rows or len(columns[self.value]) != rows:
+                print(f"Warning: risk table {self.stage} is being published, keeping the loaded table")
+                return False
+            self.table = (columns["cell"], columns[self.value])
+            self.version = version
+        print(f"Loaded risk table {self.stage} with {len(columns['cell'])} cells")
+        return True
+
+    def check_reload(self):
+        """
+        Reloads the cell table if check_interval passed since the last check and a new table was published
+        :return: None
+        """
+        if time.monotonic() - self.last_check >= self.check_interval:
+            self.reload()
+
+    @staticmethod
+    def parse_cells(cell_ids):
+        """
+        Converts H3 cell ids to integers
+        :param cell_ids: H3 cells as hex strings or integers (list)
+        :return: H3 cells, 0 for invalid ids (np array, uint64)
+        """
+        cells = np.zeros(len(cell_ids), dtype=np.uint64)
+        for idx, cell_id in enumerate(cell_ids):
+            try:
+                cell = int(cell_id, 16) if isinstance(cell_id, str) else int(cell_id)
+            except (TypeError, ValueError):
+                continue
+            if 0 < cell < 2 ** 64 and h3.h3_is_valid(h3.h3_to_string(cell)):
+                cells[idx] = cell
+        return cells
+
+    def lookup(self, cells):
+        """
+        Finds the risk of H3 cells, falling back to the closest parent in the table
+        :param cells: H3 cells, 0 for invalid ids (np array, uint64)
+        :return: Risk of every cell, NaN if neither the cell nor a parent is in the table (np array) and the resolution
+                 the risk was found at, -1 if not found (np array)
+        """
+        self.check_reload()
+        table_cells, table_values = self.table
+        cells = np.asarray(cells, dtype=np.uint64)
+        risk = np.full(len(cells), np.nan)
+        found_resolution = np.full(len(cells), -1, dtype=np.int8)
+        valid = cells != 0
+        # The resolution is stored in bits 52-55 of the H3 index
+        resolutions = np.zeros(len(cells), dtype=np.int64)
+        resolutions[valid] = (cells[valid] >> np.uint64(52)) & np.uint64(0xF)
+
+        missing = np.flatnonzero(valid)
+        for resolution in range(int(resolutions.max(initial=0)), -1, -1):
+            # Cells coarser than this resolution are only searched from their own resolution down
+            candidates = missing[resolutions[missing] >= resolution]
+            if len(candidates) == 0 or len(table_cells) == 0:
+                continue
+            parents = cell_parents(cells[candidates], resolution)
+            positions = np.minimum(np.searchsorted(table_cells, parents), len(table_cells) - 1)
+            hit = table_cells[positions] == parents
+            risk[candidates[hit]] = table_values[positions[hit]]
+            found_resolution[candidates[hit]] = resolution
+            missing = np.setdiff1d(missing, candidates[hit], assume_unique=True)
+            if len(missing) == 0:
+                break
+        return risk, found_resolution
+
+    def lookup_cell(self, cell):
+        """
+        Finds the risk of one H3 cell, falling back to the closest parent in the table
+        - Scalar version of lookup without the array set up, used for single cell requests
+        :param cell: H3 cell (int)
+        :return: Risk of the cell, None if neither the cell nor a parent is in the table (float) and the resolution the
+                 risk was found at, -1 if not found (int)
+        """
+        self.check_reload()
+        table_cells, table_values = self.table
+        if len(table_cells) == 0:
+            return None, -1
+        cell_resolution = h3_int.h3_get_resolution(cell)
+        for resolution in range(cell_resolution, -1, -1):
+            parent = np.uint64(cell if resolution == cell_resolution else h3_int.h3_to_parent(cell, resolution))
+            position = int(table_cells.searchsorted(parent))
+            if position < len(table_cells) and table_cells[position] == parent:
+                return float(table_values[position]), resolution
+        return None, -1
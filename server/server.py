@@ -1,25 +1,181 @@
-from flask import Flask
+import os
+
+from flask import Flask, Response, jsonify, request, send_file
 import h3
 
+from server.geometry import cell_boundary, cell_boundaries, index_coords, parse_coords
+from server.jobs import JobQueue, QueueFull
+from server.risk_table import RiskTable
+from server.tiles import TileRenderer
 
 app = Flask(__name__)
 
+# Per H3 cell fire risk published by run_firerisk, shared by all workers through memory-mapping
+risk_table = RiskTable(os.environ.get("RISK_STORE_PATH", "data/store/"))
+
+# Map tiles of the fire risk raster published by run_firerisk
+tile_renderer = TileRenderer(os.environ.get("FIRE_RISK_TIF", "fire_risk.tif"))
+
+# Risk runs for submitted areas, on a bounded pool of worker processes
+job_queue = JobQueue(os.environ.get("RISK_JOBS_PATH", "data/jobs/"), workers=int(os.environ.get("RISK_JOB_WORKERS", 2)),
+                     max_queued=int(os.environ.get("RISK_JOB_QUEUE", 8)))
+
+# H3 geometry never changes, the fire risk changes when a new run is published. Only GET routes are cached, caches
+# do not store POST responses and conditional requests only apply to GET and HEAD
+GEOMETRY_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RISK_CACHE_CONTROL = "public, max-age=60"
+
+
+def cached_response(response, cache_control):
+    """
+    Adds Cache-Control and ETag headers, answering with 304 Not Modified if the client has the same version
+    :param response: Response body or Flask response (str / Response)
+    :param cache_control: Value of the Cache-Control header (str)
+    :return: Response (Response)
+    """
+    response = app.make_response(response)
+    response.headers["Cache-Control"] = cache_control
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def json_body():
+    """
+    Reads the json body of a batch request
+    :return: Json body, None if the body is not json (dict)
+    """
+    return request.get_json(silent=True)
+
+
 @app.route("/", endpoint="default")
 def active():
     return "Active"
 
 @app.route('/point/<x>/<y>/<res>')
 def coord(x,y,res):
-    return str(h3.h3_to_geo_boundary(h3.geo_to_h3(float(x), float(y), float(res)),True))
+    boundary = cell_boundary(h3.geo_to_h3(float(x), float(y), int(float(res))))
+    return cached_response(str(boundary), GEOMETRY_CACHE_CONTROL)
 
 @app.route('/id/<x>/<y>/<res>')
 def identifier(x,y,res):
-    return h3.geo_to_h3(float(x), float(y), float(res))
+    return cached_response(h3.geo_to_h3(float(x), float(y), int(float(res))), GEOMETRY_CACHE_CONTROL)
 
 @app.route('/value/<string>')
 def value(string):
-    return str(5)
+    cells = risk_table.parse_cells([string])
+    if cells[0] == 0:
+        return f"Invalid H3 id {string}", 400
+    risk, _ = risk_table.lookup_cell(int(cells[0]))
+    if risk is None:
+        return f"No fire risk for {string}", 404
+    return cached_response(str(risk), RISK_CACHE_CONTROL)
 
-if __name__ == "__main__":
+@app.route('/points', methods=['POST'])
+def points():
+    """
+    Batch /point: {"coords": [[x, y], ...], "res": r} or {"x": [...], "y": [...], "res": r}
+    Returns {"ids": [...], "boundaries": {id: [[lng, lat], ...]}}
+    """
+    try:
+        x_coords, y_coords, resolution = parse_coords(json_body())
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    cell_ids = index_coords(x_coords, y_coords, resolution)
+    return jsonify(ids=cell_ids, boundaries=cell_boundaries(cell_ids))
+
+@app.route('/ids', methods=['POST'])
+def identifiers():
+    """
+    Batch /id: {"coords": [[x, y], ...], "res": r} or {"x": [...], "y": [...], "res": r}
+    Returns {"ids": [...]}
+    """
+    try:
+        x_coords, y_coords, resolution = parse_coords(json_body())
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(ids=index_coords(x_coords, y_coords, resolution))
+
+@app.route('/boundaries', methods=['POST'])
+def boundaries():
+    """
+    Boundaries of cells: {"ids": [...]}
+    Returns {"boundaries": {id: [[lng, lat], ...]}}
+    """
+    body = json_body()
+    cell_ids = body.get("ids") if isinstance(body, dict) else None
+    if not isinstance(cell_ids, list) or not all(isinstance(cell_id, str) for cell_id in cell_ids):
+        return jsonify(error="Expected a json object with a list of H3 ids"), 400
+    invalid = [cell_id for cell_id in cell_ids if not h3.h3_is_valid(cell_id)]
+    if invalid:
+        return jsonify(error=f"Invalid H3 ids {invalid[:10]}"), 400
+    return jsonify(boundaries=cell_boundaries(cell_ids))
+
+@app.route('/values', methods=['POST'])
+def values():
+    """
+    Batch /value: {"ids": [...]}
+    Returns {"values": [...]} with null for invalid ids and cells without a risk
+    """
+    body = json_body()
+    cell_ids = body.get("ids") if isinstance(body, dict) else None
+    if not isinstance(cell_ids, list):
+        return jsonify(error="Expected a json object with a list of H3 ids"), 400
+    risk, _ = risk_table.lookup(risk_table.parse_cells(cell_ids))
+    risk_values = [None if value != value else value for value in risk.tolist()]
+    return jsonify(values=risk_values)
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.png')
+def tile(z, x, y):
+    """
+    XYZ map tile of the fire risk raster, colored with YlOrRd from 0 to 9
+    """
+    try:
+        png, version = tile_renderer.get_tile(z, x, y)
+    except ValueError as e:
+        return str(e), 404
+    response = Response(png, mimetype="image/png")
+    response.set_etag(f"{version}-{z}-{x}-{y}")
+    response.headers["Cache-Control"] = RISK_CACHE_CONTROL
+    return response.make_conditional(request)
 
-    app.run(ssl_context=("cert.pem", "key.pem"))
+@app.route('/job', methods=['POST'])
+def submit_job():
+    """
+    Starts a risk run: {"aoi": Polygon geometry, Feature or FeatureCollection with one feature}
+    Returns {"id": ..., "status": {...}}, 202 while the job runs and 200 if an identical job is already done
+    """
+    body = json_body()
+    try:
+        job_id, status = job_queue.submit(body.get("aoi") if isinstance(body, dict) else None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except QueueFull as e:
+        response = jsonify(error=str(e))
+        response.status_code = 503
+        response.headers["Retry-After"] = "60"
+        return response
+    return jsonify(id=job_id, status=status), 200 if status["status"] == "done" else 202
+
+@app.route('/job/<job_id>')
+def job(job_id):
+    """
+    Status of a risk run, with the current stage while it runs and the outputs when it is done
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error=f"No job {job_id}"), 404
+    return jsonify(id=job_id, status=status)
+
+@app.route('/job/<job_id>/<output_name>')
+def job_output(job_id, output_name):
+    """
+    Output file of a finished risk run, fire_risk.tif or firerisk.geojson
+    """
+    output_path = job_queue.output_path(job_id, output_name)
+    if output_path is None:
+        return jsonify(error=f"No output {output_name} for job {job_id}"), 404
+    return send_file(os.path.abspath(output_path), conditional=True)
+
+if __name__ == "__main__":
+    server_path = os.path.dirname(os.path.abspath(__file__))
+    app.run(ssl_context=(os.path.join(server_path, "cert.pem"), os.path.join(server_path, "key.pem")))
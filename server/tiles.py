@@ -0,0 +1,177 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from matplotlib import colormaps
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+# Half the width of the Web Mercator (EPSG:3857) world in meters
+WEB_MERCATOR_HALF_WIDTH = 20037508.342789244
+
+
+class TileRenderer:
+    def __init__(self, raster_path="fire_risk.tif", tile_size=256, vmin=0, vmax=9, cmap="YlOrRd",
+                 max_cache_bytes=256 * 1024 ** 2, check_interval=1.0):
+        """
+        Renders XYZ (Web Mercator) PNG map tiles of the fire risk raster
+        - Only the window of the raster under the tile is read, from the coarsest overview that still has at least the
+          resolution of the tile, so zoomed out tiles of a Cloud-Optimized GeoTiff read a few small blocks
+        - Colors are looked up for all pixels at once in a 256 color table of cmap between vmin and vmax (the scale
+          used by MakeData.show_fire_risk), nodata is transparent
+        - Rendered tiles are kept in a least recently used cache of at most max_cache_bytes, which is cleared when a
+          new raster is published (its modification time changes), checked at most every check_interval seconds
+
+        :param raster_path: Path to the fire risk raster (str)
+        :param tile_size: Width and height of the tiles in pixels (int)
+        :param vmin: Risk shown with the first color (float)
+        :param vmax: Risk shown with the last color (float)
+        :param cmap: Name of the matplotlib colormap (str)
+        :param max_cache_bytes: Maximum size of the rendered tiles in the cache (int)
+        :param check_interval: Minimum number of seconds between checks for a new raster (float)
+        """
+        self.raster_path = raster_path
+        self.tile_size = tile_size
+        self.vmin, self.vmax = vmin, vmax
+        self.colors = colormaps[cmap](np.linspace(0, 1, 256), bytes=True)
+        self.max_cache_bytes = max_cache_bytes
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.version = None
+        self.last_check = 0.0
+        self.empty_tile = self.__encode(np.zeros((tile_size, tile_size, 4), dtype=np.uint8))
+
+    def check_version(self):
+        """
+        Finds the version of the raster, clearing the tile cache if a new raster was published
+        :return: Modification time of the raster, None if it does not exist (int)
+        """
+        if time.monotonic() - self.last_check < self.check_interval:
+            return self.version
+        try:
+            version = os.stat(self.raster_path).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        with self.lock:
+            self.last_check = time.monotonic()
+            if version != self.version:
+                self.cache.clear()
+                self.cache_bytes = 0
+                self.version = version
+        return version
+
+    def get_tile(self, z, x, y):
+        """
+        Gets a rendered tile from the cache, or renders it
+        :param z: Zoom level (int)
+        :param x: Tile column (int)
+        :param y: Tile row, 0 at the top (int)
+        :return: PNG image (bytes) and version of the raster it was rendered from (int)
+        """
+        if not (0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {z}/{x}/{y} does not exist")
+        version = self.check_version()
+        if version is None:
+            return self.empty_tile, version
+        key = (version, z, x, y)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key], version
+
+        tile = self.render(z, x, y)
+        with self.lock:
+            if version == self.version and key not in self.cache:
+                self.cache[key] = tile
+                self.cache_bytes += len(tile)
+                while self.cache_bytes > self.max_cache_bytes and self.cache:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_bytes -= len(evicted)
+        return tile, version
+
+    def tile_bounds(self, z, x, y):
+        """
+        Web Mercator bounds of an XYZ tile
+        :param z: Zoom level (int)
+        :param x: Tile column (int)
+        :param y: Tile row, 0 at the top (int)
+        :return: left, bottom, right, top in meters (tuple)
+        """
+        tile_width = 2 * WEB_MERCATOR_HALF_WIDTH / 2 ** z
+        left = -WEB_MERCATOR_HALF_WIDTH + x * tile_width
+        top = WEB_MERCATOR_HALF_WIDTH - y * tile_width
+        return left, top - tile_width, left + tile_width, top
+
+    def render(self, z, x, y):
+        """
+        Renders a tile from the raster
+        :param z: Zoom level (int)
+        :param x: Tile column (int)
+        :param y: Tile row, 0 at the top (int)
+        :return: PNG image (bytes)
+        """
+        bounds = self.tile_bounds(z, x, y)
+        with rasterio.open(self.raster_path) as src:
+            src_bounds = transform_bounds("EPSG:3857", src.crs, *bounds)
+            if (src_bounds[0] >= src.bounds.right or src_bounds[2] <= src.bounds.left or
+                    src_bounds[1] >= src.bounds.top or src_bounds[3] <= src.bounds.bottom):
+                return self.empty_tile
+            overview_level = self.__overview_level(src, src_bounds)
+
+        with rasterio.open(self.raster_path, overview_level=overview_level) as src:
+            nodata, scale, offset = src.nodata, src.scales[0], src.offsets[0]
+            tile_transform = rasterio.transform.from_bounds(*bounds, self.tile_size, self.tile_size)
+            with WarpedVRT(src, crs="EPSG:3857", transform=tile_transform, width=self.tile_size,
+                           height=self.tile_size, resampling=Resampling.nearest, src_nodata=nodata,
+                           nodata=nodata) as vrt:
+                data = vrt.read(1, masked=True)
+        risk = data.astype(np.float32).filled(np.nan) * scale + offset
+        return self.__encode(self.colorize(risk))
+
+    def __overview_level(self, src, src_bounds):
+        """
+        Finds the coarsest overview with at least the resolution of the tile
+        :param src: Fire risk raster (Rasterio dataset)
+        :param src_bounds: Bounds of the tile in the crs of the raster (tuple)
+        :return: Overview level, None for the full resolution (int)
+        """
+        tile_pixels = (src_bounds[2] - src_bounds[0]) / abs(src.res[0])
+        decimation = tile_pixels / self.tile_size
+        overview_level = None
+        for level, factor in enumerate(src.overviews(1)):
+            if factor <= decimation:
+                overview_level = level
+        return overview_level
+
+    def colorize(self, risk):
+        """
+        Maps risk values to colors in one lookup
+        :param risk: Fire risk, NaN where there is no data (np array (height, width))
+        :return: RGBA image, transparent where there is no data (np array (height, width, 4), uint8)
+        """
+        with np.errstate(invalid='ignore'):
+            scaled = (risk - self.vmin) / (self.vmax - self.vmin) * 255
+            color_idx = np.clip(np.nan_to_num(scaled, nan=0), 0, 255).astype(np.uint8)
+        rgba = self.colors[color_idx]
+        rgba[np.isnan(risk), 3] = 0
+        return rgba
+
+    @staticmethod
+    def __encode(rgba):
+        """
+        Encodes an RGBA image as PNG
+        :param rgba: RGBA image (np array (height, width, 4), uint8)
+        :return: PNG image (bytes)
+        """
+        buffer = io.BytesIO()
+        Image.fromarray(rgba).save(buffer, format="PNG", optimize=False)
+        return buffer.getvalue()
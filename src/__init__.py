@@ -1,3 +1,27 @@
-from .data import TifData, MakeData, DownloadData, AmbeeData
-from .firerisk_ml import RiskAssesmentML
-from .run_risk_assesment import run_firerisk
+import importlib
+
+# Re-exports are imported on first use, see src/data/__init__.py
+_EXPORTS = {
+    "TifData": ".data",
+    "MakeData": ".data",
+    "DownloadData": ".data",
+    "AmbeeData": ".data",
+    "RasterCache": ".data",
+    "ColumnStore": ".data",
+    "HexAggregator": ".data",
+    "HexTable": ".data",
+    "RegionReducer": ".data",
+    "RiskAssesmentML": ".firerisk_ml",
+    "run_firerisk": ".run_risk_assesment",
+    "run_firerisk_tiles": ".run_risk_tiles",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,4 +1,31 @@
-from .tif_data import TifData
-from .process_data import MakeData
-from .get_data import DownloadData
-from .ambee_data import AmbeeData
\ No newline at end of file
+import importlib
+
+# Re-exports are imported on first use, so light modules (column_store, hex_aggregation, ...) can be used without
+# GDAL and the rest of the raster processing stack, e.g. by the server
+_EXPORTS = {
+    "TifData": ".tif_data",
+    "MakeData": ".process_data",
+    "DownloadData": ".get_data",
+    "AmbeeData": ".ambee_data",
+    "WeatherGrid": ".weather_grid",
+    "RasterCache": ".raster_cache",
+    "Reclassifier": ".reclassifier",
+    "RiskKernel": ".risk_kernel",
+    "DEFAULT_WEIGHTS": ".risk_kernel",
+    "GeoJsonWriter": ".geojson_writer",
+    "CogWriter": ".cog_writer",
+    "ColumnStore": ".column_store",
+    "HexAggregator": ".hex_aggregation",
+    "HexTable": ".hex_aggregation",
+    "RegionReducer": ".region_reduction",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,16 +1,306 @@
 import requests as r
+from requests.adapters import HTTPAdapter
 from KEYS import AMBEE_KEY
-from time import sleep
+from time import sleep, time, monotonic
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import json
+import os
+import random
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+AMBEE_URL = "https://api.ambeedata.com"
+# Status codes worth retrying: rate limited or a temporary server error
+RETRY_STATUS = (429, 500, 502, 503, 504)
+WEATHER_FEATURES = ["temp", "vapr", "wind", "prec"]
+
+
+class RateLimiter:
+    def __init__(self, rate=10.0, burst=1):
+        """
+        Thread safe token bucket limiting the request rate of all threads sharing it
+        :param rate: Maximum average number of requests per second (float)
+        :param burst: Number of requests that can be sent at once after an idle period (int)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a request may be sent
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class AmbeeCache:
+    def __init__(self, cache_path="data/ambee_cache.sqlite", precision=2, latest_ttl=30, max_entries=100000,
+                 access_batch=256):
+        """
+        Persistent SQLite cache for Ambee API responses
+        - Keys are the endpoint, the latitude and longitude rounded to precision decimals, and the date for history
+        - History responses never expire, "latest" responses expire after latest_ttl minutes
+        - The least recently used entries are evicted when the cache holds more than max_entries responses, down to
+          90% of max_entries so eviction runs once per batch of inserts
+        - Hits are not written one by one: access times are kept in memory and written with the next insert, or once
+          access_batch hits are pending. Access times not yet written when the process exits are lost, which only
+          changes the order of eviction
+
+        :param cache_path: Path to the SQLite cache file (str)
+        :param precision: Number of decimals lat / lon are rounded to, 2 decimals is roughly 1 km (int)
+        :param latest_ttl: Minutes before a "latest" response expires (float)
+        :param max_entries: Maximum number of cached responses (int)
+        :param access_batch: Number of pending access times written at once (int)
+        """
+        self.cache_path = cache_path
+        self.precision = precision
+        self.ttl = {"weather_latest": latest_ttl * 60, "weather_history": None, "soil_latest": latest_ttl * 60,
+                    "ndvi_latest": latest_ttl * 60, "watervapor_latest": latest_ttl * 60}
+        self.max_entries = max_entries
+        self.access_batch = access_batch
+        self.pending_access = {}
+
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, "
+                          "response TEXT, created REAL, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        # Entries counted once, then kept up to date by set. Other processes sharing the file are only seen when the
+        # count reaches max_entries and the entries are counted again before evicting
+        self.n_entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def make_key(self, endpoint, lat, lon, date=None):
+        """
+        Creates the cache key for a request
+        :param endpoint: Name of the Ambee endpoint (str)
+        :param lat: Latitude Coordinate
+        :param lon: Longitude Coordinate
+        :param date: [OPTIONAL] Date range of history requests (str)
+        :return: Cache key (str)
+        """
+        key = f"{endpoint}:{round(float(lat), self.precision):.{self.precision}f}:" \
+              f"{round(float(lon), self.precision):.{self.precision}f}"
+        if date:
+            key += f":{date}"
+        return key
+
+    def get(self, endpoint, key):
+        """
+        Gets a cached response if it exists and has not expired
+        :param endpoint: Name of the Ambee endpoint (str)
+        :param key: Cache key from make_key (str)
+        :return: Cached json response or None (dict)
+        """
+        now = time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            ttl = self.ttl.get(endpoint)
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self.misses[endpoint] += 1
+                return None
+            self.pending_access[key] = now
+            if len(self.pending_access) >= self.access_batch:
+                self.__write_access()
+                self.conn.commit()
+            self.hits[endpoint] += 1
+        return json.loads(row[0])
+
+    def set(self, endpoint, key, response):
+        """
+        Stores a response and evicts the least recently used responses if the cache is full
+        :param endpoint: Name of the Ambee endpoint (str)
+        :param key: Cache key from make_key (str)
+        :param response: Json response (dict)
+        :return: None
+        """
+        now = time()
+        with self.lock:
+            self.__write_access()
+            inserted = self.conn.execute("INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                         (key, endpoint, json.dumps(response), now, now)).rowcount
+            if inserted:
+                self.n_entries += 1
+            else:
+                self.conn.execute("UPDATE responses SET endpoint = ?, response = ?, created = ?, accessed = ? "
+                                  "WHERE key = ?", (endpoint, json.dumps(response), now, now, key))
+            if self.n_entries > self.max_entries:
+                self.__evict()
+            self.conn.commit()
+
+    def flush(self):
+        """
+        Writes the pending access times
+        :return: None
+        """
+        with self.lock:
+            self.__write_access()
+            self.conn.commit()
+
+    def __write_access(self):
+        """
+        Writes the pending access times in one statement, the caller holds self.lock and commits
+        :return: None
+        """
+        if self.pending_access:
+            self.conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                  [(accessed, key) for key, accessed in self.pending_access.items()])
+            self.pending_access.clear()
+
+    def __evict(self):
+        """
+        Deletes the least recently used responses down to 90% of max_entries, the caller holds self.lock and commits
+        :return: None
+        """
+        self.n_entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if self.n_entries <= self.max_entries:
+            return
+        n_evicted = self.n_entries - int(self.max_entries * 0.9)
+        self.conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                          (n_evicted,))
+        self.n_entries -= n_evicted
+
+    def get_stats(self):
+        """
+        Gets the hit and miss counters of the cache
+        :return: Hits, misses and hit rate in total and per endpoint (dict)
+        """
+        endpoints = sorted(set(self.hits) | set(self.misses))
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "endpoints": {endpoint: {"hits": self.hits[endpoint], "misses": self.misses[endpoint]}
+                              for endpoint in endpoints}}
+
+    def clear(self):
+        """
+        Deletes all cached responses
+        :return: None
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.pending_access.clear()
+            self.n_entries = 0
 
 
 class AmbeeData:
-    def __init__(self):
+    def __init__(self, use_cache=True, cache_path="data/ambee_cache.sqlite", cache_precision=2, latest_ttl=30,
+                 max_cache_entries=100000, base_url=AMBEE_URL, api_key=AMBEE_KEY, max_workers=8, rate_limit=10.0,
+                 retries=4, backoff=0.5, timeout=30):
         """
         A class for accessing and using the features of the AMBEE API
         - Currently the weather functionality is used, but others can be added to feature in the Fire Risk Assessment
+        - Responses are cached on disk (see AmbeeCache) so re-runs of the same area do not hit the API again
+        - Requests share one pooled HTTP session and a rate limiter, connection errors, 429 and 5xx responses are
+          retried with exponential backoff (honoring Retry-After)
+        - base_url can point to a local stub server for testing
+
+        :param use_cache: Whether to cache responses on disk (bool)
+        :param cache_path: Path to the SQLite cache file (str)
+        :param cache_precision: Number of decimals lat / lon are rounded to for the cache key (int)
+        :param latest_ttl: Minutes before a cached "latest" response expires (float)
+        :param max_cache_entries: Maximum number of cached responses (int)
+        :param base_url: Url of the Ambee API (str)
+        :param api_key: Ambee API key (str)
+        :param max_workers: Number of concurrent requests of bulk queries, and of pooled connections (int)
+        :param rate_limit: Maximum number of requests per second, None for no limit (float)
+        :param retries: Number of retries of a failed request (int)
+        :param backoff: Seconds before the first retry, doubled for every further retry (float)
+        :param timeout: Seconds before a request times out (float)
         """
-        self.headers = {"x-api-key": AMBEE_KEY, "Accept": "application/json"}
+        self.headers = {"x-api-key": api_key, "Accept": "application/json"}
+        self.base_url = base_url.rstrip("/")
+        self.cache_precision = cache_precision
+        self.cache = None
+        if use_cache:
+            self.cache = AmbeeCache(cache_path, precision=cache_precision, latest_ttl=latest_ttl,
+                                    max_entries=max_cache_entries)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit, burst=max_workers) if rate_limit else None
+        self.session = r.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __request(self, url):
+        """
+        Sends a GET request through the pooled session, rate limited and retried with exponential backoff
+        :param url: Url to request (str)
+        :return: Response of the last attempt (Response)
+        """
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+            except r.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+                response = None
+            if response is not None and (response.status_code not in RETRY_STATUS or attempt == self.retries):
+                return response
+            delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            if response is not None and response.headers.get("Retry-After", "").isdigit():
+                delay = max(delay, int(response.headers["Retry-After"]))
+            sleep(delay)
+
+    def __get_json(self, endpoint, url, lat, lon, date=None):
+        """
+        Gets the json response of a url, using the cache if enabled
+        - Only successful responses are cached
+        :param endpoint: Name of the Ambee endpoint, used for the cache key and ttl (str)
+        :param url: Url to request (str)
+        :param lat: Latitude Coordinate
+        :param lon: Longitude Coordinate
+        :param date: [OPTIONAL] Date range of history requests (str)
+        :return: Json response (dict)
+        """
+        key = None
+        if self.cache:
+            key = self.cache.make_key(endpoint, lat, lon, date)
+            cached = self.cache.get(endpoint, key)
+            if cached is not None:
+                return cached
+        response = self.__request(url)
+        response_json = response.json()
+        if self.cache and response.ok:
+            self.cache.set(endpoint, key, response_json)
+        return response_json
+
+    def get_cache_stats(self):
+        """
+        Gets the hit and miss counters of the response cache
+        :return: Cache stats, None if caching is disabled (dict)
+        """
+        if self.cache:
+            return self.cache.get_stats()
+        return None
 
     def get_weather_lat_lon(self, lat, lon):
         """
@@ -20,12 +310,8 @@ class AmbeeData:
         :param lon: Longitude Coordinate
         :return: Dict of data (dict)
         """
-        url = f'https://api.ambeedata.com/weather/latest/by-lat-lng?lat={lat}&lng={lon}'
-        try:
-            ambee_weather = r.get(url, headers=self.headers).json()
-        except:
-            sleep(1)
-            ambee_weather = r.get(url, headers=self.headers).json()
+        url = f'{self.base_url}/weather/latest/by-lat-lng?lat={lat}&lng={lon}'
+        ambee_weather = self.__get_json("weather_latest", url, lat, lon)
         ambee_weather = ambee_weather['data']
         temp, humidity, wind_speed, precip = ambee_weather['apparentTemperature'], ambee_weather['humidity'], \
                                              ambee_weather['windSpeed'], ambee_weather['dewPoint']
@@ -45,21 +331,52 @@ class AmbeeData:
         if not end:
             end_date = start_date + datetime.timedelta(days=1)
             end = end_date.strftime('%Y-%m-%d')
+        date = f"{start}_{end}"
         start = start + " 00:00:00"
         end = end + " 00:00:00"
-        try:
-            url = f'https://api.ambeedata.com/weather/history/daily/by-lat-lng?lat={lat}&lng={lon}&from={start}&to={end}'
-        except:
-            sleep(1)
-            url = f'https://api.ambeedata.com/weather/history/daily/by-lat-lng?lat={lat}&lng={lon}&from={start}&to={end}'
+        url = f'{self.base_url}/weather/history/daily/by-lat-lng?lat={lat}&lng={lon}&from={start}&to={end}'
 
-        ambee_weather_hist = r.get(url, headers=self.headers).json()
+        ambee_weather_hist = self.__get_json("weather_history", url, lat, lon, date)
         ambee_weather_hist = ambee_weather_hist['data']['history'][0]
         temp, humidity, wind_speed, precip = ambee_weather_hist['apparentTemperature'], ambee_weather_hist['humidity'], \
                                              ambee_weather_hist['windSpeed'], ambee_weather_hist['dewPoint']
 
         return {"temp": temp, "vapr": humidity, "wind": wind_speed, "prec": precip}
 
+    def get_weather_history_bulk(self, lats, lons, dates):
+        """
+        Gets the weather of one day for many points
+        - Points are rounded to the cell of the cache (cache_precision decimals), every distinct cell and day is
+          requested once, on max_workers threads, and its weather is copied to all points sharing it
+        - Failed requests are reported and give NaN weather
+        :param lats: Latitude of every point (array like)
+        :param lons: Longitude of every point (array like)
+        :param dates: Day of every point in format %Y-%m-%d (array like)
+        :return: Weather of every point, columns temp, vapr, wind and prec (df)
+        """
+        queries = pd.DataFrame({"lat": np.round(np.asarray(lats, dtype=np.float64), self.cache_precision),
+                                "lon": np.round(np.asarray(lons, dtype=np.float64), self.cache_precision),
+                                "date": np.asarray(dates, dtype=object)})
+        # Both number the distinct requests in order of first appearance
+        point_request = queries.groupby(["lat", "lon", "date"], sort=False, dropna=False).ngroup().to_numpy()
+        unique_requests = queries.drop_duplicates(ignore_index=True)
+
+        def fetch(request):
+            if not isinstance(request[2], str):
+                return {}
+            try:
+                return self.get_weather_history(request[0], request[1], request[2])
+            except Exception as e:
+                print(f"Error: weather history of {request} failed: {e}")
+                return {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(fetch, unique_requests.itertuples(index=False, name=None)))
+        weather = pd.DataFrame({feature: np.array([result.get(feature, np.nan) for result in results], dtype=np.float64)
+                                for feature in WEATHER_FEATURES})
+        print(f"Weather history: {len(unique_requests)} requests for {len(queries)} points")
+        return weather.iloc[point_request].reset_index(drop=True)
+
     def get_soil_lat_lon(self, lat, lon):
         """
         Gets the soil data given the latitude and longitude coordinates
@@ -67,8 +384,8 @@ class AmbeeData:
         :param lon: Longitude Coordinate
         :return: Dict of data (dict)
         """
-        url = f'https://api.ambeedata.com/soil/latest/by-lat-lng?lat={lat}&lng={lon}'
-        ambee_soil = r.get(url, headers=self.headers).json()
+        url = f'{self.base_url}/soil/latest/by-lat-lng?lat={lat}&lng={lon}'
+        ambee_soil = self.__get_json("soil_latest", url, lat, lon)
         return ambee_soil
 
     def get_current_ndvi(self, lat, lon):
@@ -78,8 +395,8 @@ class AmbeeData:
         :param lon: Longitude Coordinate
         :return: Dict of data (dict)
         """
-        url = f'https://api.ambeedata.com/ndvi/latest/by-lat-lng?lat={lat}&lng={lon}'
-        ambee_ndvi = r.get(url, headers=self.headers).json()
+        url = f'{self.base_url}/ndvi/latest/by-lat-lng?lat={lat}&lng={lon}'
+        ambee_ndvi = self.__get_json("ndvi_latest", url, lat, lon)
         return ambee_ndvi
 
     def get_current_watervapor(self, lat, lon):
@@ -89,6 +406,6 @@ class AmbeeData:
         :param lon: Longitude Coordinate
         :return: Dict of data (dict)
         """
-        url = f'https://api.ambeedata.com/waterVapor/latest/by-lat-lng?lat={lat}&lng={lon}'
-        ambee_wv = r.get(url, headers=self.headers).json()
+        url = f'{self.base_url}/waterVapor/latest/by-lat-lng?lat={lat}&lng={lon}'
+        ambee_wv = self.__get_json("watervapor_latest", url, lat, lon)
         return ambee_wv
@@ -0,0 +1,171 @@
+import os
+import uuid
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+
+# Range of the fire risk, the weighted sum of classes 0 to 9
+RISK_RANGE = (0, 9)
+
+
+class CogWriter:
+    def __init__(self, output_name, dtype="float32", nodata=-9999, value_range=RISK_RANGE, compress="deflate",
+                 blocksize=512, overview_resampling="average"):
+        """
+        Writes fire risk rasters as tiled, compressed Cloud-Optimized GeoTiffs with internal overviews, so viewers and
+        the tile service only read the blocks and overview level they need
+        - dtype float32 keeps the risk with nodata as the nodata value
+        - dtype uint8 quantizes value_range to 1-255 with 0 as nodata, the scale and offset to recover the risk are
+          saved in the band metadata (risk = value * scale + offset)
+        - Uses the GDAL COG driver, or a tiled GTiff with overviews copied in front of the data if it is not available
+
+        :param output_name: Path to the output file (str)
+        :param dtype: Output data type, float32 or uint8 (str)
+        :param nodata: Nodata value of the input data, and of float32 output (float)
+        :param value_range: Range of values mapped to 1-255 for uint8 output (tuple)
+        :param compress: Compression of the blocks (str)
+        :param blocksize: Size in pixels of the square blocks (int)
+        :param overview_resampling: Resampling method for the overviews (str)
+        """
+        if dtype not in ("float32", "uint8"):
+            raise ValueError(f"Unsupported COG dtype {dtype}, use float32 or uint8")
+        self.output_name = output_name
+        self.dtype = dtype
+        self.nodata = nodata
+        self.value_range = value_range
+        self.compress = compress
+        self.blocksize = blocksize
+        self.overview_resampling = overview_resampling
+
+    @property
+    def output_nodata(self):
+        """
+        Nodata value of the output
+        :return: 0 for uint8, else the input nodata value (float)
+        """
+        return 0 if self.dtype == "uint8" else self.nodata
+
+    @property
+    def scale_offset(self):
+        """
+        Scale and offset recovering the risk from uint8 values
+        :return: (scale, offset) (tuple)
+        """
+        if self.dtype != "uint8":
+            return 1.0, 0.0
+        scale = (self.value_range[1] - self.value_range[0]) / 254
+        return scale, self.value_range[0] - scale
+
+    def prepare(self, data):
+        """
+        Converts risk data to the output dtype, can be called per window
+        :param data: Fire risk data (np array)
+        :return: Data in the output dtype (np array)
+        """
+        data = np.asarray(data)
+        invalid = ~np.isfinite(data) | (data == self.nodata)
+        if self.dtype == "float32":
+            output = data.astype(np.float32)
+            output[invalid] = self.nodata
+            return output
+        low, high = self.value_range
+        with np.errstate(invalid='ignore'):
+            output = np.clip(np.rint((data - low) / (high - low) * 254) + 1, 1, 255)
+        output[invalid] = 0
+        return output.astype(np.uint8)
+
+    def profile(self, meta):
+        """
+        Creates the profile of an intermediate tiled GTiff holding prepared data
+        :param meta: Meta data of the fire risk grid, needs crs, transform, width and height (dict)
+        :return: Profile for rasterio.open (dict)
+        """
+        return {"driver": "GTiff", "count": 1, "dtype": self.dtype, "nodata": self.output_nodata, "crs": meta["crs"],
+                "transform": meta["transform"], "width": meta["width"], "height": meta["height"], "tiled": True,
+                "blockxsize": self.blocksize, "blockysize": self.blocksize}
+
+    def write(self, data, meta):
+        """
+        Writes a fire risk array as a COG
+        :param data: Fire risk data (np array (height, width))
+        :param meta: Meta data of the fire risk grid, needs crs, transform, width and height (dict)
+        :return: Path to the output file (str)
+        """
+        profile = self.profile({**meta, "height": data.shape[0], "width": data.shape[1]})
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dest:
+                dest.write(self.prepare(data), 1)
+                self.__set_scale_offset(dest)
+            with memfile.open() as src:
+                self.copy(src)
+        return self.output_name
+
+    def translate(self, file):
+        """
+        Converts a GTiff written with profile() (e.g. window by window) to a COG, the file is deleted
+        :param file: Path to the GTiff (str)
+        :return: Path to the output file (str)
+        """
+        with rasterio.open(file, "r+") as dest:
+            self.__set_scale_offset(dest)
+        with rasterio.open(file) as src:
+            self.copy(src)
+        os.remove(file)
+        return self.output_name
+
+    def copy(self, src):
+        """
+        Copies an opened raster to the output COG
+        - The COG is written next to the output and moved in place, so readers (e.g. the tile server) never see a
+          partially written file
+        :param src: Raster in the output dtype (Rasterio dataset)
+        :return: None
+        """
+        with rasterio.Env() as env:
+            has_cog_driver = "COG" in env.drivers()
+        output_tmp_path = self.output_name + f".{uuid.uuid4().hex}.tmp.tif"
+        if has_cog_driver:
+            rasterio.shutil.copy(src, output_tmp_path, driver="COG", COMPRESS=self.compress.upper(),
+                                 BLOCKSIZE=self.blocksize, OVERVIEW_RESAMPLING=self.overview_resampling.upper(),
+                                 PREDICTOR="YES")
+        else:
+            tmp_path = self.output_name + f".{uuid.uuid4().hex}.tmp.tif"
+            rasterio.shutil.copy(src, tmp_path, driver="GTiff", TILED="YES", BLOCKXSIZE=self.blocksize,
+                                 BLOCKYSIZE=self.blocksize)
+            with rasterio.open(tmp_path, "r+") as dest:
+                dest.build_overviews(self.overview_factors(src.width, src.height),
+                                     Resampling[self.overview_resampling])
+            with rasterio.open(tmp_path) as tmp_src:
+                rasterio.shutil.copy(tmp_src, output_tmp_path, driver="GTiff", TILED="YES",
+                                     BLOCKXSIZE=self.blocksize, BLOCKYSIZE=self.blocksize,
+                                     COMPRESS=self.compress.upper(), COPY_SRC_OVERVIEWS="YES")
+            os.remove(tmp_path)
+        os.replace(output_tmp_path, self.output_name)
+
+    def overview_factors(self, width, height):
+        """
+        Overview decimation factors, halving until the overview fits in one block
+        :param width: Width of the raster (int)
+        :param height: Height of the raster (int)
+        :return: List of factors (list)
+        """
+        factors = []
+        factor = 2
+        while max(width, height) / (factor / 2) > self.blocksize:
+            factors.append(factor)
+            factor *= 2
+        return factors
+
+    def __set_scale_offset(self, dest):
+        """
+        Saves the scale and offset of uint8 output in the band metadata
+        :param dest: Raster opened for writing (Rasterio dataset)
+        :return: None
+        """
+        if self.dtype == "uint8":
+            scale, offset = self.scale_offset
+            dest.scales = (scale,)
+            dest.offsets = (offset,)
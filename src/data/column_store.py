@@ -0,0 +1,224 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+FILE_FORMATS = ("npy", "parquet")
+
+
+class ColumnStore:
+    def __init__(self, store_path="data/store/", file_format="npy", compression="zstd"):
+        """
+        Columnar store for the intermediate data of every processing stage, replacing the csv outputs
+        - Columns keep their dtype (float features, compact int classes) and are written once per stage as binary data
+        - "npy" saves one .npy file per column in a folder per stage, which the loader memory-maps so only the columns
+          and rows that are used are read from disk
+        - "parquet" saves one compressed Parquet file per stage, requires pyarrow
+        - Every stage has a {stage}.json sidecar with its columns, number of rows and attributes (e.g. the grid)
+
+        :param store_path: Folder to store the stages (str)
+        :param file_format: Format of the column data ["npy", "parquet"] (str)
+        :param compression: Compression of Parquet files (str)
+        """
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unsupported file format {file_format}, use one of {FILE_FORMATS}")
+        if file_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("The parquet column store requires pyarrow, install it or use file_format='npy'")
+        self.store_path = store_path
+        self.file_format = file_format
+        self.compression = compression
+        os.makedirs(store_path, exist_ok=True)
+
+    def __meta_path(self, stage):
+        """
+        Path of the sidecar of a stage
+        :param stage: Name of the stage (str)
+        :return: Path to the sidecar (str)
+        """
+        return os.path.join(self.store_path, stage + ".json")
+
+    def __data_path(self, stage):
+        """
+        Path of the column data of a stage
+        :param stage: Name of the stage (str)
+        :return: Path to the Parquet file or npy folder (str)
+        """
+        if self.file_format == "parquet":
+            return os.path.join(self.store_path, stage + ".parquet")
+        return os.path.join(self.store_path, stage)
+
+    def exists(self, stage):
+        """
+        Checks whether a stage was written
+        :param stage: Name of the stage (str)
+        :return: Whether the stage exists (bool)
+        """
+        return os.path.exists(self.__meta_path(stage)) and os.path.exists(self.__data_path(stage))
+
+    def stages(self):
+        """
+        Lists all written stages
+        :return: Names of the stages (list)
+        """
+        return sorted(file[:-len(".json")] for file in os.listdir(self.store_path)
+                      if file.endswith(".json") and self.exists(file[:-len(".json")]))
+
+    def read_meta(self, stage):
+        """
+        Reads the sidecar of a stage
+        :param stage: Name of the stage (str)
+        :return: Columns, dtypes, number of rows and attributes of the stage (dict)
+        """
+        if not self.exists(stage):
+            raise FileNotFoundError(f"Stage {stage} does not exist in {self.store_path}")
+        with open(self.__meta_path(stage)) as fp:
+            return json.load(fp)
+
+    def write(self, stage, data, attrs=None):
+        """
+        Writes all columns of a stage, replacing the stage if it exists
+        :param stage: Name of the stage (str)
+        :param data: Data of the stage (df / dict of np arrays)
+        :param attrs: Attributes saved with the stage, must be json serializable (dict)
+        :return: None
+        """
+        columns = {name: np.asarray(data[name]) for name in data.keys()}
+        rows = self.__check_rows(columns)
+        data_path = self.__data_path(stage)
+        tmp_path = data_path + f".{uuid.uuid4().hex}.tmp"
+        if self.file_format == "parquet":
+            pd.DataFrame(columns, copy=False).to_parquet(tmp_path, compression=self.compression, index=False)
+        else:
+            os.makedirs(tmp_path)
+            for name, values in columns.items():
+                np.save(os.path.join(tmp_path, name + ".npy"), values)
+
+        # The old stage is moved away before the new one takes its place, so a reader never sees a partial stage.
+        # The sidecar is written last, it is the version of the stage: until it is replaced a reader can find the new
+        # columns (or none) with the old sidecar, readers polling for new versions check the rows (see RiskTable)
+        old_path = data_path + f".{uuid.uuid4().hex}.old"
+        if os.path.exists(data_path):
+            os.replace(data_path, old_path)
+        os.replace(tmp_path, data_path)
+        self.__write_meta(stage, columns, rows, attrs or {})
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        elif os.path.exists(old_path):
+            os.remove(old_path)
+
+    def write_columns(self, stage, data, drop=()):
+        """
+        Adds or replaces columns of an existing stage, with npy only the changed columns are written
+        :param stage: Name of the stage (str)
+        :param data: New columns (df / dict of np arrays)
+        :param drop: Names of columns to remove from the stage (list)
+        :return: None
+        """
+        meta = self.read_meta(stage)
+        new_columns = {name: np.asarray(data[name]) for name in data.keys()}
+        if self.__check_rows(new_columns) not in (None, meta["rows"]):
+            raise ValueError(f"New columns of stage {stage} do not have {meta['rows']} rows")
+        if self.file_format == "parquet":
+            columns = {name: values for name, values in self.read_columns(stage).items() if name not in drop}
+            columns.update(new_columns)
+            self.write(stage, columns, meta["attrs"])
+            return
+
+        data_path = self.__data_path(stage)
+        for name, values in new_columns.items():
+            tmp_file = os.path.join(data_path, f"{name}.{uuid.uuid4().hex}.tmp.npy")
+            np.save(tmp_file, values)
+            os.replace(tmp_file, os.path.join(data_path, name + ".npy"))
+        dtypes = {name: meta["dtypes"][name] for name in meta["columns"] if name not in drop}
+        dtypes.update({name: values.dtype.str for name, values in new_columns.items()})
+        self.__write_meta(stage, dtypes, meta["rows"], meta["attrs"])
+        for name in drop:
+            if name not in new_columns and os.path.exists(os.path.join(data_path, name + ".npy")):
+                os.remove(os.path.join(data_path, name + ".npy"))
+
+    def read_columns(self, stage, columns=None, mmap=True):
+        """
+        Reads columns of a stage as np arrays
+        :param stage: Name of the stage (str)
+        :param columns: [OPTIONAL] Names of the columns to read, defaults to all columns (list)
+        :param mmap: Whether to memory-map npy columns read only instead of loading them (bool)
+        :return: Column data (dict: name of column -> np array)
+        """
+        meta = self.read_meta(stage)
+        columns = meta["columns"] if columns is None else list(columns)
+        missing = [name for name in columns if name not in meta["columns"]]
+        if missing:
+            raise KeyError(f"Columns {missing} do not exist in stage {stage}")
+        if self.file_format == "parquet":
+            data = pd.read_parquet(self.__data_path(stage), columns=columns)
+            return {name: data[name].to_numpy() for name in columns}
+        return {name: np.load(os.path.join(self.__data_path(stage), name + ".npy"), mmap_mode="r" if mmap else None)
+                for name in columns}
+
+    def read(self, stage, columns=None, mmap=True):
+        """
+        Reads columns of a stage as a pandas df
+        - The df is built without copying, with one block per column, so memory-mapped columns stay on disk until
+          they are used. They are read only, assigning to them in place raises a ValueError
+        :param stage: Name of the stage (str)
+        :param columns: [OPTIONAL] Names of the columns to read, defaults to all columns (list)
+        :param mmap: Whether to memory-map npy columns instead of loading them (bool)
+        :return: Stage data (df)
+        """
+        return pd.DataFrame(self.read_columns(stage, columns, mmap), copy=False)
+
+    def read_attrs(self, stage):
+        """
+        Reads the attributes saved with a stage
+        :param stage: Name of the stage (str)
+        :return: Attributes of the stage (dict)
+        """
+        return self.read_meta(stage)["attrs"]
+
+    def delete(self, stage):
+        """
+        Deletes a stage
+        :param stage: Name of the stage (str)
+        :return: None
+        """
+        data_path = self.__data_path(stage)
+        if os.path.isdir(data_path):
+            shutil.rmtree(data_path)
+        elif os.path.exists(data_path):
+            os.remove(data_path)
+        if os.path.exists(self.__meta_path(stage)):
+            os.remove(self.__meta_path(stage))
+
+    @staticmethod
+    def __check_rows(columns):
+        """
+        Checks that all columns have the same length
+        :param columns: Column data (dict: name of column -> np array)
+        :return: Number of rows, None without columns (int)
+        """
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        return lengths.pop() if lengths else None
+
+    def __write_meta(self, stage, columns, rows, attrs):
+        """
+        Atomically writes the sidecar of a stage
+        :param stage: Name of the stage (str)
+        :param columns: Column data or dtypes, in column order (dict)
+        :param rows: Number of rows (int)
+        :param attrs: Attributes of the stage (dict)
+        :return: None
+        """
+        dtypes = {name: values if isinstance(values, str) else values.dtype.str for name, values in columns.items()}
+        meta = {"columns": list(dtypes), "dtypes": dtypes, "rows": rows or 0, "attrs": attrs}
+        tmp_file = self.__meta_path(stage) + f".{uuid.uuid4().hex}.tmp"
+        with open(tmp_file, "w") as fp:
+            json.dump(meta, fp, default=str)
+        os.replace(tmp_file, self.__meta_path(stage))
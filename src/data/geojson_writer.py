@@ -0,0 +1,103 @@
+import gzip
+
+import numpy as np
+
+
+class GeoJsonWriter:
+    def __init__(self, file, ndjson=False, precision=6, value_precision=4, compress=None, chunk_size=100000,
+                 property_name="fire_risk"):
+        """
+        Streams point features to a GeoJson file in chunks, straight from coordinate and value arrays
+        - Features are formatted from np array chunks, so no geojson objects or full size lists are created and memory
+          is bounded by chunk_size
+        - Writes a FeatureCollection, or one feature per line (newline delimited GeoJson) if ndjson is set, which can be
+          read by the front end line by line while it is written
+        - Non-finite values are never written, nodata and values below a threshold can be filtered
+
+        :param file: Path to the output file (str)
+        :param ndjson: Whether to write newline delimited features instead of a FeatureCollection (bool)
+        :param precision: Number of decimals of the coordinates (int)
+        :param value_precision: Number of decimals of the values, None to write the full value (int)
+        :param compress: Whether to gzip the output, defaults to whether file ends with .gz (bool)
+        :param chunk_size: Number of points formatted at once (int)
+        :param property_name: Name of the value property of every feature (str)
+        """
+        self.file = file
+        self.ndjson = ndjson
+        self.compress = file.endswith(".gz") if compress is None else compress
+        self.chunk_size = chunk_size
+        value_format = "%r" if value_precision is None else f"%.{value_precision}f"
+        self.feature_template = '{"type":"Feature","geometry":{"type":"Point","coordinates":[%%.%df,%%.%df]},' \
+                                '"properties":{"%s":%s}}' % (precision, precision, property_name, value_format)
+
+    def write_points(self, x_coords, y_coords, values, nodata=-9999, threshold=None):
+        """
+        Writes a point feature for every coordinate
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :param values: Value of every point (np array)
+        :param nodata: [OPTIONAL] Points with this value are not written (float)
+        :param threshold: [OPTIONAL] Points with a value below this are not written (float)
+        :return: Number of features written (int)
+        """
+        x_coords, y_coords, values = np.ravel(x_coords), np.ravel(y_coords), np.ravel(values)
+        chunks = ((x_coords[start:start + self.chunk_size], y_coords[start:start + self.chunk_size],
+                   values[start:start + self.chunk_size]) for start in range(0, len(values), self.chunk_size))
+        return self.__write(chunks, nodata, threshold)
+
+    def write_raster(self, data, transform, nodata=-9999, threshold=None):
+        """
+        Writes a point feature at the center of every pixel of a raster
+        - Pixel coordinates are computed per chunk of rows, so no full size coordinate arrays are created
+        :param data: Raster data (np array (height, width))
+        :param transform: Affine transform of the raster (Rasterio transformation object)
+        :param nodata: [OPTIONAL] Pixels with this value are not written (float)
+        :param threshold: [OPTIONAL] Pixels with a value below this are not written (float)
+        :return: Number of features written (int)
+        """
+        height, width = data.shape
+        chunk_rows = max(1, self.chunk_size // width)
+        col_centers = np.arange(width) + 0.5
+
+        def chunks():
+            for row_start in range(0, height, chunk_rows):
+                row_centers = np.arange(row_start, min(row_start + chunk_rows, height)) + 0.5
+                cols, rows = np.meshgrid(col_centers, row_centers)
+                x_coords = transform.a * cols + transform.b * rows + transform.c
+                y_coords = transform.d * cols + transform.e * rows + transform.f
+                yield x_coords.ravel(), y_coords.ravel(), data[row_start:row_start + len(row_centers)].ravel()
+
+        return self.__write(chunks(), nodata, threshold)
+
+    def __write(self, chunks, nodata, threshold):
+        """
+        Filters and formats chunks of points and writes them to the output file
+        :param chunks: Iterable of (x coords, y coords, values) np array chunks (iterable)
+        :param nodata: Points with this value are not written (float)
+        :param threshold: Points with a value below this are not written (float)
+        :return: Number of features written (int)
+        """
+        count = 0
+        open_file = gzip.open if self.compress else open
+        with open_file(self.file, "wt", encoding="utf8") as fp:
+            if not self.ndjson:
+                fp.write('{"type":"FeatureCollection","features":[')
+            for x_coords, y_coords, values in chunks:
+                keep = np.isfinite(values)
+                if nodata is not None:
+                    keep &= values != nodata
+                if threshold is not None:
+                    keep &= values >= threshold
+                if not keep.any():
+                    continue
+                template = self.feature_template
+                lines = [template % point for point in zip(x_coords[keep].tolist(), y_coords[keep].tolist(),
+                                                           values[keep].tolist())]
+                if self.ndjson:
+                    fp.write("\n".join(lines) + "\n")
+                else:
+                    fp.write((",\n" if count else "\n") + ",\n".join(lines))
+                count += len(lines)
+            if not self.ndjson:
+                fp.write("\n]}\n")
+        return count
@@ -0,0 +1,224 @@
+import json
+import warnings
+
+import h3
+import h3.api.numpy_int as h3_int
+import numpy as np
+import pandas as pd
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    try:
+        from h3.unstable import vect as h3_vect
+    except ImportError:
+        h3_vect = None
+
+AGGREGATIONS = ("sum", "mean", "max", "count")
+
+
+def cell_parents(cells, resolution):
+    """
+    Finds the parent of every H3 cell
+    :param cells: H3 cells (np array, uint64)
+    :param resolution: Resolution of the parents, at most the resolution of the cells (int)
+    :return: Parent of every cell (np array, uint64)
+    """
+    cells = np.ascontiguousarray(cells, dtype=np.uint64)
+    if h3_vect is not None:
+        return h3_vect.h3_to_parent(cells, resolution)
+    return np.fromiter((h3_int.h3_to_parent(cell, resolution) for cell in cells.tolist()), dtype=np.uint64,
+                       count=len(cells))
+
+
+class HexTable:
+    def __init__(self, table):
+        """
+        Multi-resolution table of aggregated H3 cells
+        - One row per cell with its resolution and sum, mean, max and count, sorted by cell id. H3 ids are unique
+          across resolutions, so any cell of any level is found with one binary search
+        - Coarser levels are rolled up from the finest level in the table by mapping cells to their parents and
+          combining their aggregates, points are never indexed again
+        - Roll-ups follow the H3 parent hierarchy, which does not nest exactly: near cell edges a point is counted in
+          the parent of its fine cell, which can differ from the coarse cell the point lies in
+
+        :param table: Columns cell, resolution, sum, mean, max and count (df / dict of np arrays)
+        """
+        table = pd.DataFrame({name: np.asarray(table[name]) for name in ["cell", "resolution"] + list(AGGREGATIONS)})
+        self.table = table.sort_values("cell", kind="stable", ignore_index=True)
+        self.cells = self.table["cell"].to_numpy(dtype=np.uint64)
+
+    @classmethod
+    def from_cells(cls, cells, values, resolutions):
+        """
+        Aggregates point values indexed at the finest resolution and rolls them up to every coarser resolution
+        :param cells: H3 cell of every point at max(resolutions) (np array, uint64)
+        :param values: Value of every point (np array)
+        :param resolutions: H3 resolutions of the table (list)
+        :return: Multi-resolution cell table (HexTable)
+        """
+        finest = pd.Series(np.asarray(values, dtype=np.float64), index=pd.Index(cells, name="cell")).groupby(level=0)
+        finest = finest.agg(["sum", "max", "count"])
+        levels = [cls.__roll_up(finest, resolution) for resolution in sorted(resolutions)]
+        return cls(pd.concat(levels, ignore_index=True))
+
+    @staticmethod
+    def __roll_up(finest, resolution):
+        """
+        Combines the aggregates of the finest cells into their parents
+        :param finest: Sum, max and count of the finest cells, indexed by cell (df)
+        :param resolution: Resolution of the parents (int)
+        :return: Columns cell, resolution, sum, mean, max and count of the parents (df)
+        """
+        cells = finest.index.to_numpy(dtype=np.uint64)
+        if len(cells) and h3_int.h3_get_resolution(int(cells[0])) != resolution:
+            parents = cell_parents(cells, resolution)
+            finest = finest.groupby(parents).agg({"sum": "sum", "max": "max", "count": "sum"})
+        level = finest.reset_index(drop=True)
+        level.insert(0, "cell", finest.index.to_numpy(dtype=np.uint64))
+        level.insert(1, "resolution", np.full(len(level), resolution, dtype=np.uint8))
+        level["mean"] = level["sum"] / level["count"]
+        return level
+
+    @property
+    def resolutions(self):
+        """
+        Resolutions in the table
+        :return: Sorted resolutions (list)
+        """
+        return sorted(int(resolution) for resolution in np.unique(self.table["resolution"]))
+
+    def level(self, resolution):
+        """
+        Gets the cells of one resolution
+        - Resolutions coarser than the finest level of the table are rolled up from it if they are not in the table
+        :param resolution: H3 resolution (int)
+        :return: Sum, mean, max and count of every cell, indexed by cell (df)
+        """
+        if resolution in self.resolutions:
+            level = self.table[self.table["resolution"] == resolution]
+        else:
+            finest_resolution = self.resolutions[-1]
+            if resolution > finest_resolution:
+                raise ValueError(f"Resolution {resolution} is finer than the finest level {finest_resolution}")
+            finest = self.table[self.table["resolution"] == finest_resolution].set_index("cell")
+            level = self.__roll_up(finest[["sum", "max", "count"]], resolution)
+        return level.set_index("cell")[list(AGGREGATIONS)]
+
+    def lookup(self, cells):
+        """
+        Finds cells of any resolution in the table with a binary search
+        :param cells: H3 cells (np array, uint64)
+        :return: Row position of every cell in self.table, -1 if the cell is not in the table (np array)
+        """
+        cells = np.asarray(cells, dtype=np.uint64)
+        positions = np.searchsorted(self.cells, cells)
+        found = positions < len(self.cells)
+        found[found] = self.cells[positions[found]] == cells[found]
+        return np.where(found, positions, -1)
+
+    def save(self, store, stage="hexagons", attrs=None):
+        """
+        Writes the table to a column store
+        :param store: Columnar store (ColumnStore)
+        :param stage: Name of the stage (str)
+        :param attrs: Attributes saved with the table (dict)
+        :return: None
+        """
+        store.write(stage, self.table, attrs={"resolutions": self.resolutions, **(attrs or {})})
+
+    @classmethod
+    def load(cls, store, stage="hexagons", mmap=True):
+        """
+        Reads a table written with save
+        :param store: Columnar store (ColumnStore)
+        :param stage: Name of the stage (str)
+        :param mmap: Whether to memory-map the columns (bool)
+        :return: Multi-resolution cell table (HexTable)
+        """
+        return cls(store.read_columns(stage, mmap=mmap))
+
+
+class HexAggregator:
+    def __init__(self, resolutions=(10, 11, 12)):
+        """
+        Aggregates point values (e.g. the fire risk of every pixel) into H3 hexagons at several resolutions
+        - All points are indexed in one batched call at the finest resolution and aggregated with a single groupby,
+          coarser resolutions are derived from the parents of the aggregated cells (see HexTable)
+        - Cells are kept as H3 integers (uint64), converted to hex strings only when writing output
+
+        :param resolutions: H3 resolutions to aggregate to (list)
+        """
+        self.resolutions = sorted(resolutions)
+
+    @staticmethod
+    def index_points(x_coords, y_coords, resolution):
+        """
+        Finds the H3 cell of every point
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :param resolution: H3 resolution (int)
+        :return: H3 cell of every point (np array, uint64)
+        """
+        x_coords = np.ascontiguousarray(x_coords, dtype=np.float64)
+        y_coords = np.ascontiguousarray(y_coords, dtype=np.float64)
+        if h3_vect is not None:
+            return h3_vect.geo_to_h3(y_coords, x_coords, resolution)
+        return np.fromiter((h3_int.geo_to_h3(y, x, resolution) for x, y in zip(x_coords, y_coords)),
+                           dtype=np.uint64, count=len(x_coords))
+
+    def aggregate(self, x_coords, y_coords, values, nodata=-9999):
+        """
+        Aggregates point values at every resolution
+        - Non-finite and nodata values are dropped before indexing
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :param values: Value of every point (np array)
+        :param nodata: [OPTIONAL] Points with this value are dropped (float)
+        :return: Multi-resolution cell table (HexTable)
+        """
+        x_coords, y_coords, values = np.ravel(x_coords), np.ravel(y_coords), np.ravel(values)
+        keep = np.isfinite(values)
+        if nodata is not None:
+            keep &= values != nodata
+        if not keep.all():
+            x_coords, y_coords, values = x_coords[keep], y_coords[keep], values[keep]
+        cells = self.index_points(x_coords, y_coords, self.resolutions[-1])
+        return HexTable.from_cells(cells, values, self.resolutions)
+
+    @staticmethod
+    def write_geojson(cell_table, output_name, value="mean", property_name="risk", precision=6):
+        """
+        Writes the cells of one resolution as GeoJson polygons, streamed feature by feature
+        :param cell_table: Aggregates of every cell, indexed by cell (df)
+        :param output_name: Path to the output file (str)
+        :param value: Aggregate written as the property of every cell (str)
+        :param property_name: Name of the property (str)
+        :param precision: Number of decimals of the coordinates (int)
+        :return: Number of features written (int)
+        """
+        cells, values = cell_table.index.to_numpy(), cell_table[value].to_numpy()
+        with open(output_name, "w", encoding="utf8") as fp:
+            fp.write('{"type":"FeatureCollection","features":[')
+            for idx, (cell, cell_value) in enumerate(zip(cells.tolist(), values.tolist())):
+                boundary = np.round(h3_int.h3_to_geo_boundary(cell, geo_json=True), precision).tolist()
+                feature = {"type": "Feature", "id": h3.h3_to_string(cell), "properties": {property_name: cell_value},
+                           "geometry": {"type": "Polygon", "coordinates": [boundary]}}
+                fp.write(("," if idx else "") + "\n" + json.dumps(feature, separators=(",", ":")))
+            fp.write("\n]}\n")
+        return len(cells)
+
+    def run(self, x_coords, y_coords, values, output_pattern="coords{resolution}.json", value="mean", nodata=-9999):
+        """
+        Aggregates point values and writes a GeoJson file for every resolution
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :param values: Value of every point (np array)
+        :param output_pattern: Output file name, formatted with the resolution (str)
+        :param value: Aggregate written as the risk of every cell (str)
+        :param nodata: [OPTIONAL] Points with this value are dropped (float)
+        :return: Multi-resolution cell table (HexTable)
+        """
+        hex_table = self.aggregate(x_coords, y_coords, values, nodata=nodata)
+        for resolution in self.resolutions:
+            self.write_geojson(hex_table.level(resolution), output_pattern.format(resolution=resolution), value=value)
+        return hex_table
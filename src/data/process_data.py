@@ -1,5 +1,8 @@
 import os
 import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 import fiona
 import matplotlib.pyplot as plt
@@ -7,26 +10,57 @@ import numpy as np
 import pandas as pd
 import rasterio
 import json
-import geojson
+from rasterio.enums import Resampling
+from rasterio.features import bounds, geometry_mask, geometry_window
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from rasterio.windows import transform as windows_transform
 
 from sklearn.linear_model import LinearRegression
 from tqdm import tqdm
 from .tif_data import TifData
 from .get_data import DownloadData
 from .ambee_data import AmbeeData
+from .weather_grid import WeatherGrid
+from .reclassifier import Reclassifier
+from .geojson_writer import GeoJsonWriter
+from .cog_writer import CogWriter
+from .risk_kernel import RiskKernel, DEFAULT_WEIGHTS, ND_BANDS
+from .raster_cache import RasterCache
 
 
 class MakeData:
-    def __init__(self, coordinate_file, data_path, rule_list, feature_set={}, download_files=True, create_csv=True):
+    def __init__(self, coordinate_file, data_path, rule_list, feature_set={}, download_files=True, create_csv=True,
+                 weather_resolution=0.05, weather_method="bilinear", get_weather=None, in_memory=False,
+                 spill_threshold=512 * 1024 ** 2, raster_cache=None, resampling="nearest", warp_threads=os.cpu_count(),
+                 workers=None, weights=None, store=None, lazy=False):
         """
         MakeData is used to create feature sets, conduct ML analysis, and export output as both csv and GeoTiff rasters.
+        - Intermediate data of every stage is written to store if given: "data" (features, with ND features once
+          calculated), "reclassified_data" (classified features) and "fire_risk" (x, y and fire_risk)
 
         :param coordinate_file: Path to GeoJson or Shape file for cropping rasters to polygon shape (str)
         :param data_path: Path to all data files (str)
         :param rule_list: Rules mapping final feature data to classified data (dict: name of feature -> path to rule file)
         :param feature_set: All features used for Risk Assessment Model
                     (dict: name of feature -> tuple (path to raster, merged_file_name)
-        :param create_csv: Whether to create output csv files (bool)
+        :param create_csv: Whether to create output csv files, runs writing to a store can turn them off (bool)
+        :param weather_resolution: Spacing in degrees of the lattice the Ambee weather is sampled on when feature_set is
+                    empty, None queries the weather for every pixel (float)
+        :param weather_method: Interpolation from the weather lattice to the pixels ["bilinear", "idw"] (str)
+        :param get_weather: Whether to get the weather from the Ambee API, defaults to True if feature_set is empty (bool)
+        :param in_memory: Whether to keep intermediate rasters in memory instead of temp files (bool)
+        :param spill_threshold: Intermediate rasters larger than this many bytes are still written to temp files (int)
+        :param raster_cache: [OPTIONAL] Cache of derived rasters reused across runs (RasterCache)
+        :param resampling: Resampling method used when reprojecting features, name of a rasterio Resampling (str)
+        :param warp_threads: Number of threads used when reprojecting features (int)
+        :param workers: Number of threads used to load, clip and resample the features concurrently, 1 processes them
+                    one at a time and None uses the ThreadPoolExecutor default (int)
+        :param weights: Weight of every classified feature in the fire risk, defaults to DEFAULT_WEIGHTS
+                    (dict: name of feature -> float)
+        :param store: [OPTIONAL] Columnar store for the intermediate data of every stage (ColumnStore)
+        :param lazy: Whether to only open the feature sources without merging or reprojecting them into arrays, set it
+                    for block processing so memory stays bounded by the block size (see TifData) (bool)
         """
         self.data_path = data_path
         self.temp_path = data_path + "/temp/"
@@ -36,55 +70,87 @@ class MakeData:
             pass
 
         self.coords_file = coordinate_file
-        self.shapes = self.__make_shape()
+        self.shapes = self.read_shapes(coordinate_file)
 
-        self.get_weather = False
-        if len(feature_set) == 0:
-            self.get_weather = True
+        if get_weather is None:
+            get_weather = len(feature_set) == 0
+        self.get_weather = get_weather
+        if self.get_weather:
             self.weather_data = {'temp': [], 'vapr': [], 'wind': [], 'prec': []}
             self.ambee = AmbeeData()
+        self.weather_resolution = weather_resolution
+        self.weather_method = weather_method
         if download_files:
             downloader = DownloadData(feature_set, self.shapes)
             downloader.download_data()
 
-        self.input_data = {}
-        for data_name in tqdm(feature_set.keys(), desc='Creating Data'):
-            feature_file = feature_set[data_name][0]
-            merge_name = feature_set[data_name][1]
-            self.input_data[data_name] = TifData(data_name, feature_file, merge_name=merge_name)
+        shape_bounds = np.array([bounds(shape) for shape in self.shapes])
+        aoi_bounds = (float(shape_bounds[:, 0].min()), float(shape_bounds[:, 1].min()),
+                      float(shape_bounds[:, 2].max()), float(shape_bounds[:, 3].max()))
+
+        self.workers = workers
+        tif_options = {"temp_path": self.temp_path, "in_memory": in_memory, "spill_threshold": spill_threshold,
+                       "cache": raster_cache, "bounds": aoi_bounds, "resampling": resampling,
+                       "warp_threads": warp_threads, "lazy": lazy, "merged_files": {}}
+        self.input_data = self.__load_features(feature_set, tif_options)
         self.data_classification = self.__make_reclassifier_from_rules(rule_list)
+        self.input_versions = RasterCache.input_versions(feature_set, rule_list, weather=self.get_weather)
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
 
         self.width, self.height = 0, 0
         self.transform = np.array([])
         self.meta = {}
 
         self.pd_data = None
+        self.raster_stack, self.band_names = np.array([]), []
         self.fire_np_arr = np.array([])
 
         self.create_csv = create_csv
+        self.store = store
 
-    def __make_shape(self):
+    @staticmethod
+    def read_shapes(coordinate_file):
         """
         Creates shape features based on the polygon geometry in the shape file
         - Shape file generated is used to clip (or crop) geographical areas of other tif files
+        :param coordinate_file: Path to GeoJson or Shape file (str)
         :return: List of shape geometry (GeoJson)
         """
-        filetype = self.coords_file.split(".")[-1]
+        filetype = coordinate_file.split(".")[-1]
         if filetype == "shp":
-            with fiona.open(self.coords_file, "r") as shapefile:
+            with fiona.open(coordinate_file, "r") as shapefile:
                 shapes = [feature["geometry"] for feature in shapefile]
                 return shapes
         elif filetype == "json":
-            geojson_file = open(self.coords_file)
-            shapes = json.load(geojson_file)
+            with open(coordinate_file) as geojson_file:
+                shapes = json.load(geojson_file)
             return [shapes]
 
-    def process_data(self):
+    def process_data(self, block_size=None, output_name="fire_risk.tif", use_pandas=True, cog=False,
+                     cog_dtype="float32"):
         """
         Processes data to create features and calculate fire risk
         - Calls other class methods
+        - If block_size is given, the data is processed window by window straight into output_name (see
+          process_data_blocks) and self.pd_data / self.fire_np_arr are not created
+        - If use_pandas is False, the risk is computed from a raster stack (see calc_fire_risk_raster) and self.pd_data
+          is not created
+        :param block_size: [OPTIONAL] Size in pixels of the square windows used for block processing (int)
+        :param output_name: Name for fire risk output file when block processing (str)
+        :param use_pandas: Whether to create the pandas df of all features (bool)
+        :param cog: Whether to write the block processed output as a Cloud-Optimized GeoTiff (bool)
+        :param cog_dtype: Data type of the COG output, float32 or uint8 (str)
         :return: None
         """
+        if block_size:
+            self.process_data_blocks(block_size, output_name, cog=cog, cog_dtype=cog_dtype)
+            return
+        if not use_pandas:
+            self.clip_files()
+            self.resample_data()
+            self.create_raster_stack()
+            self.calc_fire_risk_raster()
+            return
         # Clip files to shape coordinates
         self.clip_files()
         # Match all data to have the same size
@@ -101,78 +167,154 @@ class MakeData:
     def create_clip_pd(self):
         """
         Creates Pandas df object from all input data, matches data points to coordinates in real world
+        - Coordinates are the pixel centers of the matched raster, in row-major order to line up with get_data("match")
         - creates pandas df in self.pd_data
         - Creates data.csv if create_csv is True (bool)
+        - Writes the "data" stage to self.store
         :return: None
         """
-        risk_data = []
+        x_coords, y_coords = self.make_coordinate_grid(self.transform, self.width, self.height)
+        self.get_weather_layers()
 
-        for i in tqdm(range(self.height), desc='Creating Coordinates'):
-            for j in range(self.width):
-                coordinates = self.transform * (i, j)
-                risk_data.append(coordinates)
-                if self.get_weather:
-                    #self.get_weather_ambee(coordinates[1], coordinates[0])
-                    self.get_weather_ambee(coordinates[1], coordinates[0])
+        columns = ['x', 'y'] + list(self.input_data.keys())
+        if self.get_weather:
+            columns += list(self.weather_data.keys())
 
-        risk_data = np.array(risk_data)
-        columns = ['x', 'y']
+        # Column-major so every feature is written to (and later read from) one contiguous block
+        risk_data = np.empty((self.height * self.width, len(columns)), dtype=np.float64, order='F')
+        risk_data[:, 0] = x_coords
+        risk_data[:, 1] = y_coords
 
+        col = 2
         for feature_name in tqdm(self.input_data.keys(), desc='Creating Pandas DF'):
-            columns.append(feature_name)
-            data = self.input_data[feature_name].get_data(data_type="match")
-            data = np.reshape(data, (self.height*self.width, 1))
-            risk_data = np.hstack((risk_data, data))
+            risk_data[:, col] = self.input_data[feature_name].get_data(data_type="match").ravel()
+            col += 1
 
         if self.get_weather:
             for feature_name in tqdm(self.weather_data, desc='Convering Weather data to Pandas DF'):
-                columns.append(feature_name)
-                weather_data = self.weather_data[feature_name]
-                weather_data = np.transpose(np.array([weather_data]))
-                risk_data = np.hstack((risk_data, weather_data))
+                risk_data[:, col] = np.ravel(self.weather_data[feature_name])
+                col += 1
 
-        risk_pd = pd.DataFrame(risk_data, columns=columns)
-        risk_pd.fillna(-9999, inplace=True)
+        np.nan_to_num(risk_data, copy=False, nan=-9999)
+        risk_pd = pd.DataFrame(risk_data, columns=columns, copy=False)
         if self.create_csv:
             risk_pd.to_csv('data.csv')
+        if self.store:
+            self.store.write("data", risk_pd, attrs=self.stage_attrs())
         self.pd_data = risk_pd
 
+    def stage_attrs(self):
+        """
+        Describes the area, inputs and pixel grid of the data, saved with every stage in self.store
+        :return: Coordinate file, features, versions of the input files and transform, width, height and crs of the
+                 grid (dict)
+        """
+        return {"coordinate_file": self.coords_file, "features": sorted(self.input_data.keys()),
+                "inputs": self.input_versions,
+                "transform": list(self.transform)[:6], "width": self.width, "height": self.height,
+                "crs": str(self.meta.get("crs"))}
+
+    def get_weather_layers(self):
+        """
+        Gets the weather of every pixel from the Ambee API if get_weather is set
+        - Sampled on a lattice and interpolated (see WeatherGrid), or queried per pixel without a weather resolution
+        - Fills self.weather_data
+        :return: None
+        """
+        if not self.get_weather:
+            return
+        if self.weather_resolution:
+            weather_grid = WeatherGrid(self.ambee, self.transform, self.width, self.height,
+                                       resolution=self.weather_resolution, method=self.weather_method)
+            self.weather_data = weather_grid.get_weather_data()
+        else:
+            x_coords, y_coords = self.make_coordinate_grid(self.transform, self.width, self.height)
+            for x_coord, y_coord in tqdm(zip(x_coords, y_coords), total=len(x_coords), desc='Getting Weather Data'):
+                self.get_weather_ambee(y_coord, x_coord)
+
+    def create_raster_stack(self):
+        """
+        Creates an aligned float32 stack of all matched features (and weather) without creating a pandas df
+        - creates self.raster_stack (np array (bands, height, width)) and self.band_names
+        :return: None
+        """
+        self.get_weather_layers()
+        band_names = list(self.input_data.keys())
+        if self.get_weather:
+            band_names += list(self.weather_data.keys())
+
+        raster_stack = np.empty((len(band_names), self.height, self.width), dtype=np.float32)
+        for idx, feature_name in enumerate(self.input_data.keys()):
+            raster_stack[idx] = self.input_data[feature_name].get_data(data_type="match")
+        if self.get_weather:
+            for idx, feature_name in enumerate(self.weather_data, len(self.input_data)):
+                raster_stack[idx] = np.reshape(self.weather_data[feature_name], (self.height, self.width))
+        self.raster_stack, self.band_names = raster_stack, band_names
+
+    def calc_fire_risk_raster(self, chunk_rows=256):
+        """
+        Calculates fire risk from self.raster_stack with RiskKernel: ND features, classification and the weighted sum
+        in one chunked float32 pass, without pandas
+        - Creates self.fire_np_arr
+        :param chunk_rows: Number of rows processed at once (int)
+        :return: None
+        """
+        kernel = RiskKernel(self.data_classification, self.weights)
+        self.fire_np_arr = kernel.compute(self.raster_stack, self.band_names, chunk_rows=chunk_rows)
+
+    @staticmethod
+    def make_coordinate_grid(transform, width, height, col_off=0, row_off=0):
+        """
+        Computes the real world coordinates of every pixel center in a raster grid in one vectorized pass
+        - Coordinates are flattened in row-major order (same order as np.ravel on a (height, width) raster)
+        :param transform: Affine transform of the raster grid (Rasterio transformation object)
+        :param width: Number of columns in the grid (int)
+        :param height: Number of rows in the grid (int)
+        :param col_off: Column offset of the first pixel, used for windows of a larger grid (int)
+        :param row_off: Row offset of the first pixel, used for windows of a larger grid (int)
+        :return: Flattened x and y coordinate arrays (tuple of np arrays)
+        """
+        cols = np.arange(col_off, col_off + width, dtype=np.float64) + 0.5
+        rows = np.arange(row_off, row_off + height, dtype=np.float64) + 0.5
+        cols, rows = np.meshgrid(cols, rows)
+        x_coords = transform.a * cols + transform.b * rows + transform.c
+        y_coords = transform.d * cols + transform.e * rows + transform.f
+        return x_coords.ravel(), y_coords.ravel()
+
     def classify_data(self):
         """
         Classifies all features in self.pd_data, replaces data in place
+        - Classified columns use the compact dtype of their Reclassifier, nodata is classified as 0
         - Creates reclassified_data.csv if create_csv is True (bool)
+        - Writes the "reclassified_data" stage to self.store
         :return: None
         """
         for feature_name in tqdm(self.data_classification.keys(), desc='Classifying Data'):
-            feature_bins = self.data_classification[feature_name][0]
-            feature_dict = self.data_classification[feature_name][1]
             try:
                 np_feature = self.pd_data[feature_name].to_numpy()
             except KeyError as e:
                 print(f"{e}, {feature_name} does not exist in dataset, cannot classify data")
                 return None
-            classified_feature = np.digitize(np_feature, feature_bins, right=False)
-            if feature_dict:
-                for k in feature_dict.keys():
-                    classified_feature[classified_feature == k] = feature_dict[k]
+            classified_feature = self.data_classification[feature_name].apply(np_feature)
             self.pd_data.drop(columns=[feature_name], inplace=True)
             self.pd_data[feature_name] = classified_feature
         if self.create_csv:
             self.pd_data.to_csv('reclassified_data.csv')
+        if self.store:
+            self.store.write("reclassified_data", self.pd_data, attrs=self.stage_attrs())
 
     def calc_fire_risk(self):
         """
         Calculates fire risk using pandas dataframe
         - Creates fire_risk.csv if create_csv is True (bool)
+        - Writes the "fire_risk" stage (x, y and fire_risk) to self.store
         :return: None
         """
-        self.pd_data['fire_risk'] = 0.12 * self.pd_data['aspect'] + 0.0751 * self.pd_data['elevation'] + \
-                                    0.03 * self.pd_data['vapr'] + 0.251 * self.pd_data['ndvi'] + \
-                                    0.125 * self.pd_data['ndmi'] + 0.125 * self.pd_data['ndwi'] + \
-                                    0.024 * self.pd_data['prec'] + 0.0749 * self.pd_data['slope'] + \
-                                    0.154 * self.pd_data['temp'] + 0.021 * self.pd_data['wind']
+        self.pd_data['fire_risk'] = self.__weighted_risk(self.pd_data)
         if self.create_csv:
             self.pd_data.to_csv('fire_risk.csv')
+        if self.store:
+            self.store.write("fire_risk", self.pd_data[["x", "y", "fire_risk"]], attrs=self.stage_attrs())
         fire_np_arr = self.pd_data['fire_risk'].to_numpy()
         self.fire_np_arr = np.reshape(fire_np_arr, (self.height, self.width))
 
@@ -190,6 +332,86 @@ class MakeData:
         plt.imshow(self.fire_np_arr, cmap='YlOrRd', vmin=0, vmax=9)
         plt.show()
 
+    def make_target_grid(self):
+        """
+        Finds the output grid from the clip window of every feature without reading any data
+        - Same grid as clip_files: the clip window with the maximum density of data
+        - Sets self.width, self.height, self.transform and self.meta
+        :return: None
+        """
+        for feature in self.input_data.values():
+            window = geometry_window(feature.data, self.shapes)
+            width, height = int(window.width), int(window.height)
+            if width > self.width and height > self.height:
+                self.width, self.height = width, height
+                self.transform = feature.data.window_transform(window)
+                self.meta = feature.get_meta("input")
+        self.meta.update({"driver": "GTiff", "height": self.height, "width": self.width, "transform": self.transform})
+
+    def process_data_blocks(self, block_size=1024, output_name="fire_risk.tif", cog=False, cog_dtype="float32"):
+        """
+        Processes data to calculate fire risk one window of the output grid at a time, with memory bounded by the
+        block size instead of the size of the area
+        - Every feature is read through a WarpedVRT aligned to the output grid, so only the source data under the
+          current window is read and resampled. With lazy features the VRT warps straight from the source files,
+          otherwise the merged and reprojected arrays of every feature were already made when loading them
+        - ND features, classification and fire risk are computed per window with RiskKernel and written to output_name
+        - Pixels outside the shapes are written as nodata (-9999)
+        - With cog, the windows are written to a temporary tiled GTiff which is then converted (see CogWriter)
+        - Ambee weather is sampled on the weather_resolution lattice before the windows are processed, raises
+          ValueError without a weather resolution (one API call per pixel)
+        :param block_size: Size in pixels of the square windows (int)
+        :param output_name: Name for fire risk output file (str)
+        :param cog: Whether to write the output as a Cloud-Optimized GeoTiff (bool)
+        :param cog_dtype: Data type of the COG output, float32 or uint8 (str)
+        :return: None
+        """
+        if self.get_weather and not self.weather_resolution:
+            raise ValueError("Block processing with Ambee weather needs a weather_resolution, without it the weather "
+                             "of every pixel is requested from the API")
+        if not all(feature.lazy for feature in self.input_data.values()):
+            print("Warning: features were loaded into memory, create MakeData with lazy=True for bounded memory")
+        self.make_target_grid()
+        weather_grid = None
+        if self.get_weather:
+            weather_grid = WeatherGrid(self.ambee, self.transform, self.width, self.height,
+                                       resolution=self.weather_resolution, method=self.weather_method)
+            weather_grid.sample_weather()
+
+        kernel = RiskKernel(self.data_classification, self.weights)
+        cog_writer = CogWriter(output_name, dtype=cog_dtype) if cog else None
+        block_file = output_name + ".blocks.tif" if cog else output_name
+        output_meta = self.meta.copy()
+        output_meta.update({"count": 1, "dtype": "float32", "nodata": -9999, "tiled": True,
+                            "blockxsize": 256, "blockysize": 256})
+        if cog_writer:
+            output_meta = cog_writer.profile(self.meta)
+        windows = [Window(col_off, row_off, min(block_size, self.width - col_off), min(block_size, self.height - row_off))
+                   for row_off in range(0, self.height, block_size) for col_off in range(0, self.width, block_size)]
+
+        with ExitStack() as stack:
+            vrts = {name: stack.enter_context(WarpedVRT(feature.source, crs=self.meta["crs"], transform=self.transform,
+                                                        width=self.width, height=self.height,
+                                                        resampling=Resampling.bilinear))
+                    for name, feature in self.input_data.items()}
+            dest = stack.enter_context(rasterio.open(block_file, "w", **output_meta))
+            for window in tqdm(windows, desc='Processing Blocks'):
+                band_names = list(vrts.keys())
+                window_stack = [vrt.read(1, window=window) for vrt in vrts.values()]
+                if weather_grid:
+                    weather = weather_grid.get_weather_data(window.col_off, window.row_off, window.width,
+                                                            window.height)
+                    band_names += list(weather.keys())
+                    window_stack += list(weather.values())
+                fire_risk = kernel.compute(np.array(window_stack, dtype=np.float32), band_names)
+
+                inside = geometry_mask(self.shapes, out_shape=(window.height, window.width),
+                                       transform=windows_transform(window, self.transform), invert=True)
+                fire_risk[~inside] = -9999
+                dest.write(cog_writer.prepare(fire_risk) if cog_writer else fire_risk, 1, window=window)
+        if cog_writer:
+            cog_writer.translate(block_file)
+
     def clip_files(self):
         """
         Crops all files in features using shapes, creates feature.clip_data object
@@ -197,8 +419,8 @@ class MakeData:
         Finds self.width and self.height which resembles maximum density of data in clip file
         :return: None
         """
+        self.__map_features(lambda feature: feature.clip_file(self.shapes), self.input_data.values(), 'Clipping Data')
         for feature in self.input_data.values():
-            feature.clip_file(self.shapes)
             if feature.clip_data.width > self.width and feature.clip_data.height > self.height:
                 self.width = feature.clip_data.width
                 self.height = feature.clip_data.height
@@ -211,8 +433,51 @@ class MakeData:
         Resamples data to match data dimensions and transform of input data to self.width and self.height
         :return: None
         """
-        for feature in self.input_data.values():
-            feature.resample_data(self.width, self.height)
+        self.__map_features(lambda feature: feature.resample_data(self.width, self.height), self.input_data.values(),
+                            'Resampling Data')
+
+    def __map_features(self, function, features, desc):
+        """
+        Calls function on every feature, concurrently on self.workers threads unless self.workers is 1
+        - GDAL releases the GIL while reading, decompressing and warping, so the features are processed in parallel
+        :param function: Function called with each feature (function)
+        :param features: Features to process (iterable)
+        :param desc: Progress bar description (str)
+        :return: Results of function in the order of features (list)
+        """
+        features = list(features)
+        if self.workers == 1:
+            return [function(feature) for feature in tqdm(features, desc=desc)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(tqdm(executor.map(function, features), total=len(features), desc=desc))
+
+    def __load_features(self, feature_set, tif_options):
+        """
+        Creates the TifData object of every feature
+        - Features sharing a merged file (like the DEM products) are grouped so the merge happens exactly once: the
+          first feature of every group is made first, then the others reuse the merged file, or the merged raster of
+          tif_options["merged_files"] when it was kept in memory
+        :param feature_set: All features used for Risk Assessment Model
+                    (dict: name of feature -> tuple (path to raster, merged_file_name)
+        :param tif_options: Keyword arguments passed to every TifData (dict)
+        :return: dict mapping feature name to TifData object in the order of feature_set (dict)
+        """
+        groups = defaultdict(list)
+        for data_name, (feature_file, merge_name) in feature_set.items():
+            groups[merge_name if merge_name else data_name].append(data_name)
+        # Slope and aspect need the merged file on disk, so they create it for the group
+        for group in groups.values():
+            group.sort(key=lambda data_name: data_name not in ["slope", "aspect"])
+
+        def make_tif_data(data_name):
+            feature_file, merge_name = feature_set[data_name]
+            return data_name, TifData(data_name, feature_file, merge_name=merge_name, **tif_options)
+
+        first_features = [group[0] for group in groups.values()]
+        other_features = [data_name for group in groups.values() for data_name in group[1:]]
+        input_data = dict(self.__map_features(make_tif_data, first_features, 'Creating Data'))
+        input_data.update(self.__map_features(make_tif_data, other_features, 'Creating Shared Data'))
+        return {data_name: input_data[data_name] for data_name in feature_set}
 
     def del_temp_files(self):
         """
@@ -227,46 +492,65 @@ class MakeData:
     @staticmethod
     def __make_reclassifier_from_rules(rule_list):
         """
-        Creates data classification dictionary, mapping features to bins and classified
+        Creates data classification dictionary, compiling every rule file into a Reclassifier
+        - Overlapping, gapped or empty rule ranges are reported when the rules are loaded
         :param rule_list: dict mapping features to rule.txt files (dict)
-        :return: dict mapping features to bins, classification dictionary
+        :return: dict mapping features to Reclassifier objects (dict)
         """
         data_classifier = {}
         for feature_name in rule_list.keys():
-            classifier_rule_file = open(rule_list[feature_name], 'r')
-            classifier_rules = classifier_rule_file.readlines()
-            classifier_rules = [line.strip().replace(" ", "") for line in classifier_rules]
-            classifier_rules = [line.split("=") for line in classifier_rules]
-
-            classifier = dict()
-            for i in range(len(classifier_rules)):
-                classifier[i+1] = float(classifier_rules[i][1])
-
-            classifier_rules = [line[0].split("to") for line in classifier_rules]
-            bins = [float(classifier_rules[0][0])]
-            for line in classifier_rules:
-                bins.append(float(line[1]))
-            data_classifier[feature_name] = (bins, classifier)
+            data_classifier[feature_name] = Reclassifier.from_rule_file(rule_list[feature_name], name=feature_name)
         return data_classifier
 
+    def __weighted_risk(self, data):
+        """
+        Weighted sum of the classified features using self.weights
+        :param data: Classified feature data (df)
+        :return: Fire risk (pd Series)
+        """
+        return sum(weight * data[feature_name] for feature_name, weight in self.weights.items())
+
+    @staticmethod
+    def __nd_indices(data):
+        """
+        Calculates ndvi, ndmi, ndwi from the B3, B4, B5, and B6 layers
+        :param data: Landsat-8 band data (df)
+        :return: dict mapping nd feature name to data (dict)
+        """
+        return {nd_name: (data[band_a] - data[band_b]) / (data[band_a] + data[band_b])
+                for nd_name, (band_a, band_b) in ND_BANDS.items()}
+
     def calc_nd_data(self):
         """
         Calculates ndvi, ndmi, ndwi features from B3, B4, B5, and B6 layers
         - Changed self.pd_data in place
+        - Replaces the Landsat-8 bands of the "data" stage in self.store with the ND features
         :return: None
         """
-        self.pd_data["ndvi"] = (self.pd_data["B5"] - self.pd_data["B4"]) / (self.pd_data["B5"] + self.pd_data["B4"])
-        self.pd_data["ndmi"] = (self.pd_data["B5"] - self.pd_data["B6"]) / (self.pd_data["B5"] + self.pd_data["B6"])
-        self.pd_data["ndwi"] = (self.pd_data["B3"] - self.pd_data["B6"]) / (self.pd_data["B3"] + self.pd_data["B6"])
+        nd_names = list(ND_BANDS)
+        for nd_name, nd_data in self.__nd_indices(self.pd_data).items():
+            self.pd_data[nd_name] = nd_data
         self.pd_data.drop(columns=['B3', 'B4', 'B5', 'B6'], inplace=True)
         self.pd_data.fillna(-9999, inplace=True)
+        if self.store and self.store.exists("data"):
+            self.store.write_columns("data", self.pd_data[nd_names], drop=['B3', 'B4', 'B5', 'B6'])
 
-    def create_fire_risk_tif(self, output_name="fire_risk.tif"):
+    def create_fire_risk_tif(self, output_name="fire_risk.tif", cog=False, dtype="float32"):
         """
         Creates output TIF file for fire_risk
+        - With cog, writes a tiled, compressed Cloud-Optimized GeoTiff with overviews and pixels outside the shapes as
+          nodata (see CogWriter)
         :param output_name: Name for fire risk output file (str)
+        :param cog: Whether to write a Cloud-Optimized GeoTiff (bool)
+        :param dtype: Data type of the COG output, float32 or uint8 quantized risk (str)
         :return: None
         """
+        if cog:
+            fire_risk = np.array(self.fire_np_arr, dtype=np.float32)
+            inside = geometry_mask(self.shapes, out_shape=fire_risk.shape, transform=self.transform, invert=True)
+            fire_risk[~inside] = -9999
+            CogWriter(output_name, dtype=dtype).write(fire_risk, self.meta)
+            return
         output_meta = self.meta
         output_data = np.reshape(self.fire_np_arr, (1, np.shape(self.fire_np_arr)[0], np.shape(self.fire_np_arr)[1]))
         with rasterio.open(output_name, "w", **output_meta) as dest:
@@ -313,17 +597,24 @@ class MakeData:
         for feature in self.weather_data:
             self.weather_data[feature].append(weather_lat_lon[feature])
 
-    def create_fire_risk_geojson(self):
+    def create_fire_risk_geojson(self, output_name="firerisk.geojson", ndjson=False, precision=6, value_precision=4,
+                                 threshold=None, compress=None, chunk_size=100000):
         """
         Converts output fire_risk values to a GeoJson file, mapping values to a long lat coordinate
-        - Saves output as firerisk.geojson
-        :return: None
-        """
-        features = []
-        insert_features = lambda X: features.append(
-            geojson.Feature(geometry=geojson.Point((X["x"],
-                                                    X["y"])),
-                            properties=dict(fire_risk=X["fire_risk"])))
-        self.pd_data.apply(insert_features, axis=1)
-        with open('firerisk.geojson', 'w', encoding='utf8') as fp:
-            geojson.dump(geojson.FeatureCollection(features), fp, sort_keys=True, ensure_ascii=False)
+        - Features are streamed in chunks from the x, y and fire_risk columns (see GeoJsonWriter), or from
+          self.fire_np_arr if self.pd_data was not created
+        :param output_name: Name for fire risk GeoJson output file (str)
+        :param ndjson: Whether to write newline delimited features instead of a FeatureCollection (bool)
+        :param precision: Number of decimals of the coordinates (int)
+        :param value_precision: Number of decimals of the fire risk, None to write the full value (int)
+        :param threshold: [OPTIONAL] Points with a fire risk below this are not written (float)
+        :param compress: Whether to gzip the output, defaults to whether output_name ends with .gz (bool)
+        :param chunk_size: Number of points written at once (int)
+        :return: Number of features written (int)
+        """
+        writer = GeoJsonWriter(output_name, ndjson=ndjson, precision=precision, value_precision=value_precision,
+                               compress=compress, chunk_size=chunk_size)
+        if self.pd_data is None:
+            return writer.write_raster(self.fire_np_arr, self.transform, threshold=threshold)
+        return writer.write_points(self.pd_data["x"].values, self.pd_data["y"].values,
+                                   self.pd_data["fire_risk"].values, threshold=threshold)
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import rasterio
+
+
+class RasterCache:
+    def __init__(self, cache_path="data/cache/", max_bytes=20 * 1024 ** 3):
+        """
+        Persistent cache of derived rasters (merged, DEM processed, reprojected and clipped files) across runs
+        - Keys are a hash of the identity of the input files (path, size, mtime), the operation and its parameters,
+          so a changed input file never hits a stale entry
+        - Every entry is a GeoTiff {key}.tif with a {key}.json sidecar describing how it was made
+        - The least recently used entries are evicted once the cache is larger than max_bytes
+
+        :param cache_path: Folder to store cached rasters (str)
+        :param max_bytes: Maximum size of the cache in bytes (int)
+        """
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        os.makedirs(cache_path, exist_ok=True)
+
+    @staticmethod
+    def file_identity(file):
+        """
+        Identity of an input file used in cache keys
+        :param file: Path to the file (str)
+        :return: Absolute path, size and modification time of the file (list)
+        """
+        stat = os.stat(file)
+        return [os.path.abspath(file), stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def input_versions(feature_set, rule_list, weather=False):
+        """
+        Versions of the inputs of a risk run, saved with stored results to tell whether they can be reused
+        - Missing files are identified by their path only, so they never match a file created later
+        :param feature_set: Features of the run (dict: name of feature -> tuple (path to raster, merged_file_name)
+        :param rule_list: Rules of the run (dict: name of feature -> path to rule file)
+        :param weather: Whether the weather comes from the Ambee API, which changes every day (bool)
+        :return: Identity of every feature and rule file, and the day for Ambee weather (dict)
+        """
+        def version(file):
+            try:
+                return RasterCache.file_identity(file)
+            except FileNotFoundError:
+                return [os.path.abspath(file)]
+
+        features = {}
+        for name, (files, _) in sorted(feature_set.items()):
+            features[name] = [version(file) for file in ([files] if isinstance(files, str) else files)]
+        versions = {"features": features, "rules": {name: version(file) for name, file in sorted(rule_list.items())}}
+        if weather:
+            versions["weather_day"] = time.strftime("%Y-%m-%d", time.gmtime())
+        return versions
+
+    def make_key(self, operation, input_files, params=None):
+        """
+        Creates the cache key of a derived raster
+        :param operation: Name of the operation creating the raster (str)
+        :param input_files: Paths of the files the raster is created from (str / list)
+        :param params: Parameters of the operation, must be json serializable (dict)
+        :return: Cache key (str)
+        """
+        if isinstance(input_files, str):
+            input_files = [input_files]
+        description = {"operation": operation, "inputs": [self.file_identity(file) for file in input_files],
+                       "params": params or {}}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_path(self, key):
+        """
+        Path of the cached raster of a key
+        :param key: Cache key (str)
+        :return: Path to the cached raster (str)
+        """
+        return os.path.join(self.cache_path, key + ".tif")
+
+    def get(self, key):
+        """
+        Gets the path of a cached raster and marks it as recently used
+        :param key: Cache key (str)
+        :return: Path to the cached raster, None if it is not cached (str)
+        """
+        path = self.get_path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        # Only the access time is updated, the modification time is part of the key of rasters derived from this one
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        return path
+
+    def put_file(self, key, file, description=None, move=False):
+        """
+        Adds an existing raster file to the cache
+        :param key: Cache key (str)
+        :param file: Path to the raster file (str)
+        :param description: Information on how the raster was made, saved in the sidecar (dict)
+        :param move: Whether to move the file instead of copying it (bool)
+        :return: Path to the cached raster (str)
+        """
+        tmp_path = self.get_path(key) + f".{uuid.uuid4().hex}.tmp"
+        if move:
+            shutil.move(file, tmp_path)
+        else:
+            shutil.copyfile(file, tmp_path)
+        return self.__commit(key, tmp_path, description)
+
+    def put_raster(self, key, data, meta, description=None):
+        """
+        Writes raster data to the cache
+        :param key: Cache key (str)
+        :param data: Raster data (np array (bands, height, width))
+        :param meta: Meta data for the raster (dict)
+        :param description: Information on how the raster was made, saved in the sidecar (dict)
+        :return: Path to the cached raster (str)
+        """
+        tmp_path = self.get_path(key) + f".{uuid.uuid4().hex}.tmp"
+        with rasterio.open(tmp_path, "w", **meta) as dest:
+            dest.write(data)
+        return self.__commit(key, tmp_path, description)
+
+    def __commit(self, key, tmp_path, description):
+        """
+        Atomically moves a written raster to its cache path, so parallel runs never see partial files, then evicts
+        old entries
+        :param key: Cache key (str)
+        :param tmp_path: Path of the written raster (str)
+        :param description: Information on how the raster was made, saved in the sidecar (dict)
+        :return: Path to the cached raster (str)
+        """
+        path = self.get_path(key)
+        with open(path[:-len(".tif")] + ".json", "w") as fp:
+            json.dump({"created": time.time(), **(description or {})}, fp, default=str)
+        os.replace(tmp_path, path)
+        self.prune(self.max_bytes, keep=[key])
+        return path
+
+    def entries(self):
+        """
+        Lists all cached rasters, most recently used first
+        :return: List of dicts with the key, path, size, last used time and description of every entry (list)
+        """
+        entries = []
+        for file in os.listdir(self.cache_path):
+            if not file.endswith(".tif"):
+                continue
+            path = os.path.join(self.cache_path, file)
+            key = file[:-len(".tif")]
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            description = {}
+            sidecar = os.path.join(self.cache_path, key + ".json")
+            if os.path.exists(sidecar):
+                with open(sidecar) as fp:
+                    description = json.load(fp)
+            entries.append({"key": key, "path": path, "size": stat.st_size, "last_used": stat.st_atime,
+                            "description": description})
+        return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+    def size(self):
+        """
+        Total size of the cached rasters
+        :return: Size in bytes (int)
+        """
+        return sum(entry["size"] for entry in self.entries())
+
+    def prune(self, max_bytes=0, keep=()):
+        """
+        Deletes the least recently used entries until the cache is at most max_bytes
+        :param max_bytes: Size to prune the cache to in bytes, 0 empties the cache (int)
+        :param keep: Keys that are never deleted (list)
+        :return: Number of deleted entries (int)
+        """
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        deleted = 0
+        for entry in reversed(entries):
+            if total <= max_bytes:
+                break
+            if entry["key"] in keep:
+                continue
+            for path in [entry["path"], entry["path"][:-len(".tif")] + ".json"]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= entry["size"]
+            deleted += 1
+        return deleted
@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class Reclassifier:
+    def __init__(self, edges, values, nodata=-9999, nodata_value=0, name=""):
+        """
+        Reclassifies raw feature data into classes with a lookup table compiled from a rule file
+        - Data is binned with one np.searchsorted over the bin edges and mapped with one gather from the lookup table
+        - Bins are closed on the left, the last bin is also closed on the right (so 360 degrees aspect is classified)
+        - NaN, nodata and values outside the rule ranges are classified as nodata_value
+        - The output is the smallest integer dtype holding all classes, or float32 if a class is not an integer
+
+        :param edges: Increasing bin edges, one more than the number of classes (list)
+        :param values: Class value of every bin (list)
+        :param nodata: Nodata value of the input data (float)
+        :param nodata_value: Class given to nodata and out of range data (float)
+        :param name: Name of the feature, used in error messages (str)
+        """
+        self.name = name
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if len(self.edges) != len(self.values) + 1:
+            raise ValueError(f"{name}: {len(self.values)} classes need {len(self.values) + 1} bin edges")
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError(f"{name}: bin edges are not increasing: {self.edges.tolist()}")
+        self.nodata = nodata
+        self.nodata_value = nodata_value
+
+        self.dtype = self.__compact_dtype(np.append(self.values, nodata_value))
+        # Code 0 is below the first edge, code len(values) + 1 is above the last edge (or NaN)
+        self.lut = np.concatenate(([nodata_value], self.values, [nodata_value])).astype(self.dtype)
+        self.search_edges = self.edges.copy()
+        self.search_edges[-1] = np.nextafter(self.edges[-1], np.inf)
+        self.nodata_in_range = self.edges[0] <= nodata <= self.edges[-1]
+
+    @staticmethod
+    def __compact_dtype(values):
+        """
+        Finds the smallest dtype holding all class values
+        :param values: Class values (np array)
+        :return: Integer dtype if all values are integers, else float32 (np dtype)
+        """
+        if np.all(np.mod(values, 1) == 0):
+            return np.result_type(np.min_scalar_type(int(values.min())), np.min_scalar_type(int(values.max())))
+        return np.dtype(np.float32)
+
+    @classmethod
+    def from_rule_file(cls, rule_file, name="", strict=False, **kwargs):
+        """
+        Compiles a rule file with lines "lower to upper = value" into a Reclassifier
+        - Rules are checked for overlapping, gapped and empty ranges at load time. These are reported (or raise
+          ValueError if strict) and the bins keep the first lower edge followed by the upper edge of every rule
+        - Empty ranges (lower == upper) are dropped
+        :param rule_file: Path to the rule file (str)
+        :param name: Name of the feature (str)
+        :param strict: Whether to raise ValueError on overlapping, gapped or empty ranges (bool)
+        :param kwargs: Keyword arguments passed to Reclassifier
+        :return: Compiled reclassifier (Reclassifier)
+        """
+        with open(rule_file, 'r') as fp:
+            rules = cls.parse_rules(fp.readlines(), rule_file)
+        problems = cls.validate_rules(rules)
+        if problems:
+            message = f"{rule_file}: " + "; ".join(problems)
+            if strict:
+                raise ValueError(message)
+            print(f"Warning: {message}")
+
+        rules = [rule for rule in rules if rule[1] > rule[0]]
+        edges = [rules[0][0]] + [upper for _, upper, _ in rules]
+        values = [value for _, _, value in rules]
+        return cls(edges, values, name=name, **kwargs)
+
+    @staticmethod
+    def parse_rules(lines, rule_file=""):
+        """
+        Parses rule lines "lower to upper = value"
+        :param lines: Lines of the rule file (list)
+        :param rule_file: Path to the rule file, used in error messages (str)
+        :return: List of (lower, upper, value) rules (list)
+        """
+        rules = []
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip().replace(" ", "")
+            if not line:
+                continue
+            try:
+                bounds, value = line.split("=")
+                lower, upper = bounds.split("to")
+                rules.append((float(lower), float(upper), float(value)))
+            except ValueError:
+                raise ValueError(f"{rule_file}:{line_number}: cannot parse rule '{line}', "
+                                 f"expected 'lower to upper = value'")
+        if not rules:
+            raise ValueError(f"{rule_file}: no rules found")
+        return rules
+
+    @staticmethod
+    def validate_rules(rules):
+        """
+        Checks that the rule ranges are increasing, non-empty and contiguous
+        :param rules: List of (lower, upper, value) rules (list)
+        :return: List of problems found (list)
+        """
+        problems = []
+        for idx, (lower, upper, _) in enumerate(rules):
+            if upper < lower:
+                problems.append(f"rule {idx + 1} range {lower} to {upper} is reversed")
+            elif upper == lower:
+                problems.append(f"rule {idx + 1} range {lower} to {upper} is empty")
+            if idx == 0:
+                continue
+            previous_upper = rules[idx - 1][1]
+            if lower < previous_upper:
+                problems.append(f"rule {idx + 1} range {lower} to {upper} overlaps rule {idx} (ends at {previous_upper})")
+            elif lower > previous_upper:
+                problems.append(f"gap between {previous_upper} and {lower} before rule {idx + 1}")
+        return problems
+
+    def classify_codes(self, data):
+        """
+        Bins data into class codes, 0 and len(values) + 1 being nodata
+        :param data: Feature data (np array)
+        :return: Class codes (np array)
+        """
+        codes = np.searchsorted(self.search_edges, data, side='right')
+        if self.nodata_in_range:
+            codes[data == self.nodata] = 0
+        return codes
+
+    def apply(self, data):
+        """
+        Reclassifies feature data
+        :param data: Feature data (np array)
+        :return: Classified data in self.dtype (np array)
+        """
+        return self.lut[self.classify_codes(np.asarray(data))]
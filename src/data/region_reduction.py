@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import rasterio
+
+
+class RegionReducer:
+    def __init__(self, cells=10, top_k=10, threshold=None, nodata=-9999):
+        """
+        Splits the extent of fire risk points into a regular grid of regions, summarizing every region and keeping its
+        highest risk points
+        - Every point is assigned to its region with one vectorized binning pass, sums, counts and the top_k ranking
+          are then computed with groupby operations over all regions at once
+        - The grid spans the extent of all points, before points at or below threshold are dropped. Points on the
+          right and top edge belong to the last column and row
+
+        :param cells: Number of regions along x and y, or (columns, rows) (int / tuple)
+        :param top_k: Number of highest risk points kept per region, None to keep all points (int)
+        :param threshold: Only points with a risk above threshold are kept, None to keep all points (float)
+        :param nodata: Nodata value of the risk, these points are dropped (float)
+        """
+        self.columns, self.rows = (cells, cells) if np.isscalar(cells) else cells
+        self.top_k = top_k
+        self.threshold = threshold
+        self.nodata = nodata
+
+    def bin_points(self, x, y, bounds=None):
+        """
+        Assigns points to the regions of the grid
+        :param x: x coordinate of every point (np array)
+        :param y: y coordinate of every point (np array)
+        :param bounds: left, bottom, right, top of the grid, None for the extent of the points (tuple)
+        :return: Column and row of the region of every point, -1 outside of bounds (tuple of np arrays)
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        if bounds is None:
+            bounds = (x.min(), y.min(), x.max(), y.max()) if len(x) else (0.0, 0.0, 0.0, 0.0)
+        left, bottom, right, top = bounds
+        # An extent of 0 (one column of points) puts all points in the first region
+        width = (right - left) / self.columns or 1.0
+        height = (top - bottom) / self.rows or 1.0
+        outside = (x < left) | (x > right) | (y < bottom) | (y > top)
+        cell_x = np.minimum(((x - left) // width).astype(np.int64), self.columns - 1)
+        cell_y = np.minimum(((y - bottom) // height).astype(np.int64), self.rows - 1)
+        cell_x[outside] = -1
+        cell_y[outside] = -1
+        return cell_x, cell_y
+
+    def reduce(self, x, y, values, bounds=None):
+        """
+        Summarizes every region and keeps its highest risk points
+        :param x: x coordinate of every point (np array)
+        :param y: y coordinate of every point (np array)
+        :param values: Fire risk of every point (np array)
+        :param bounds: left, bottom, right, top of the grid, None for the extent of the points (tuple)
+        :return: Regions with columns cell_x, cell_y, sum, count, mean and max (df), and kept points with columns
+                 x, y, fire_risk, cell_x, cell_y, rank (0 is the highest risk of the region) and subSum, the sum of the
+                 region as in the old reducepoints.py output (df)
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values) & (values != self.nodata)
+        x, y, values = x[valid], y[valid], values[valid]
+        cell_x, cell_y = self.bin_points(x, y, bounds)
+
+        keep = cell_x >= 0
+        if self.threshold is not None:
+            keep &= values > self.threshold
+        points = pd.DataFrame({"x": x[keep], "y": y[keep], "fire_risk": values[keep], "cell_x": cell_x[keep],
+                               "cell_y": cell_y[keep]})
+
+        # Sorting by region and descending risk once gives every ranking with a cumulative count
+        points = points.sort_values(["cell_x", "cell_y", "fire_risk"], ascending=[True, True, False], kind="stable",
+                                    ignore_index=True)
+        groups = points.groupby(["cell_x", "cell_y"], sort=False)
+        points["rank"] = groups.cumcount()
+        regions = groups["fire_risk"].agg(["sum", "count", "mean", "max"]).reset_index()
+        points["subSum"] = groups["fire_risk"].transform("sum")
+        if self.top_k is not None:
+            points = points[points["rank"] < self.top_k].reset_index(drop=True)
+        return regions, points
+
+    def reduce_frame(self, data, value="fire_risk", bounds=None):
+        """
+        Reduces a point DataFrame, e.g. MakeData.pd_data after calc_fire_risk or the "fire_risk" stage of the store
+        :param data: Points with columns x, y and value (df / dict of np arrays)
+        :param value: Name of the risk column (str)
+        :param bounds: left, bottom, right, top of the grid, None for the extent of the points (tuple)
+        :return: Regions and kept points, see reduce (tuple of df)
+        """
+        return self.reduce(data["x"], data["y"], data[value], bounds)
+
+    def reduce_raster(self, file, band=1, bounds=None):
+        """
+        Reduces a fire risk raster, e.g. fire_risk.tif written by MakeData.create_fire_risk_tif
+        - Scale and offset of quantized (uint8) rasters are applied, nodata pixels are dropped before computing
+          coordinates
+        :param file: Path to the raster (str)
+        :param band: Band holding the fire risk (int)
+        :param bounds: left, bottom, right, top of the grid, None for the extent of the valid pixels (tuple)
+        :return: Regions and kept points, see reduce (tuple of df)
+        """
+        with rasterio.open(file) as src:
+            data = src.read(band, masked=True)
+            transform = src.transform
+            scale, offset = src.scales[band - 1], src.offsets[band - 1]
+        rows, cols = np.nonzero(~np.ma.getmaskarray(data))
+        values = data.data[rows, cols].astype(np.float64) * scale + offset
+        x = transform.a * (cols + 0.5) + transform.b * (rows + 0.5) + transform.c
+        y = transform.d * (cols + 0.5) + transform.e * (rows + 0.5) + transform.f
+        return self.reduce(x, y, values, bounds)
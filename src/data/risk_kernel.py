@@ -0,0 +1,80 @@
+import numpy as np
+
+# Weights of the classified features in the fire risk, from a research paper which analyzed historical fire data
+DEFAULT_WEIGHTS = {"aspect": 0.12, "elevation": 0.0751, "vapr": 0.03, "ndvi": 0.251, "ndmi": 0.125, "ndwi": 0.125,
+                   "prec": 0.024, "slope": 0.0749, "temp": 0.154, "wind": 0.021}
+
+# Normalized difference features computed from the Landsat-8 bands: name -> (band a, band b) for (a - b) / (a + b)
+ND_BANDS = {"ndvi": ("B5", "B4"), "ndmi": ("B5", "B6"), "ndwi": ("B3", "B6")}
+
+
+class RiskKernel:
+    def __init__(self, reclassifiers, weights=None):
+        """
+        Computes fire risk from an aligned stack of raw feature rasters in one chunked float32 pass
+        - Weights are folded into the lookup table of every Reclassifier, so each feature costs one binning and one
+          gather added in place into the output
+        - ND features are computed per chunk from the Landsat-8 bands, so no full size temporaries are created
+
+        :param reclassifiers: Reclassifier of every weighted feature (dict: name of feature -> Reclassifier)
+        :param weights: Weight of every feature in the risk, defaults to DEFAULT_WEIGHTS (dict: name -> float)
+        """
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        missing = [name for name in self.weights if name not in reclassifiers]
+        if missing:
+            raise ValueError(f"No classification rules for weighted features: {missing}")
+        self.reclassifiers = {name: reclassifiers[name] for name in self.weights}
+        self.weighted_luts = {name: (weight * self.reclassifiers[name].lut).astype(np.float32)
+                              for name, weight in self.weights.items()}
+
+    def compute(self, stack, band_names, out=None, chunk_rows=256):
+        """
+        Calculates the fire risk of a raster stack
+        :param stack: Raw feature rasters (np array (bands, height, width))
+        :param band_names: Name of every band in the stack (list)
+        :param out: [OPTIONAL] Output array to write the risk to (np array (height, width), float32)
+        :param chunk_rows: Number of rows processed at once (int)
+        :return: Fire risk (np array (height, width), float32)
+        """
+        bands = {name: idx for idx, name in enumerate(band_names)}
+        for name in self.weights:
+            if name not in bands and not (name in ND_BANDS and all(band in bands for band in ND_BANDS[name])):
+                raise ValueError(f"{name} is not in the raster stack and cannot be computed from it")
+
+        height, width = stack.shape[1:]
+        if out is None:
+            out = np.empty((height, width), dtype=np.float32)
+        nd_numerator = np.empty((chunk_rows, width), dtype=np.float32)
+        nd_denominator = np.empty((chunk_rows, width), dtype=np.float32)
+
+        for start in range(0, height, chunk_rows):
+            stop = min(start + chunk_rows, height)
+            out_chunk = out[start:stop]
+            out_chunk.fill(0)
+            for name, weighted_lut in self.weighted_luts.items():
+                if name in bands:
+                    values = stack[bands[name], start:stop]
+                else:
+                    band_a, band_b = ND_BANDS[name]
+                    values = self.normalized_difference(stack[bands[band_a], start:stop],
+                                                        stack[bands[band_b], start:stop],
+                                                        nd_numerator[:stop - start], nd_denominator[:stop - start])
+                codes = self.reclassifiers[name].classify_codes(values)
+                np.add(out_chunk, weighted_lut[codes], out=out_chunk)
+        return out
+
+    @staticmethod
+    def normalized_difference(band_a, band_b, numerator, denominator):
+        """
+        Calculates (a - b) / (a + b) into preallocated buffers
+        :param band_a: Band a (np array)
+        :param band_b: Band b (np array)
+        :param numerator: Buffer with the shape of the bands, holds the result (np array)
+        :param denominator: Buffer with the shape of the bands (np array)
+        :return: Normalized difference, NaN where a + b is 0 (np array)
+        """
+        np.subtract(band_a, band_b, out=numerator)
+        np.add(band_a, band_b, out=denominator)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(numerator, denominator, out=numerator)
+        return numerator
@@ -5,12 +5,77 @@ from rasterio.plot import show
 from rasterio.mask import mask
 from rasterio.crs import CRS
 from rasterio.enums import Resampling
-from osgeo import gdal
+from rasterio.dtypes import dtype_rev, typename_fwd
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
 import os
+import uuid
+
+
+def build_vrt(files, output_name):
+    """
+    Writes a mosaic VRT of rasters sharing a CRS, data type and band count, at the resolution of the first raster
+    - No pixel data is read, the VRT only references the files
+    - Where rasters overlap the first one is used, as with rasterio.merge.merge
+    :param files: Paths to the rasters (list)
+    :param output_name: Path of the VRT file (str)
+    :return: Path of the VRT file (str)
+    """
+    datasets = [rasterio.open(file) for file in files]
+    try:
+        first = datasets[0]
+        res_x, res_y = first.res
+        left = min(dataset.bounds.left for dataset in datasets)
+        top = max(dataset.bounds.top for dataset in datasets)
+        right = max(dataset.bounds.right for dataset in datasets)
+        bottom = min(dataset.bounds.bottom for dataset in datasets)
+        width, height = int(round((right - left) / res_x)), int(round((top - bottom) / res_y))
+        nodata = first.nodata
+
+        bands = []
+        for band in range(1, first.count + 1):
+            sources = []
+            # Later sources are drawn over earlier ones, so the first raster is written last
+            for file, dataset in reversed(list(zip(files, datasets))):
+                nodata_tag = f"<NODATA>{dataset.nodata!r}</NODATA>" if dataset.nodata is not None else ""
+                sources.append(
+                    f'<ComplexSource><SourceFilename relativeToVRT="0">{os.path.abspath(file)}</SourceFilename>'
+                    f'<SourceBand>{band}</SourceBand>'
+                    f'<SrcRect xOff="0" yOff="0" xSize="{dataset.width}" ySize="{dataset.height}"/>'
+                    f'<DstRect xOff="{(dataset.bounds.left - left) / res_x!r}" '
+                    f'yOff="{(top - dataset.bounds.top) / res_y!r}" '
+                    f'xSize="{(dataset.bounds.right - dataset.bounds.left) / res_x!r}" '
+                    f'ySize="{(dataset.bounds.top - dataset.bounds.bottom) / res_y!r}"/>'
+                    f'{nodata_tag}</ComplexSource>')
+            nodata_value = f"<NoDataValue>{nodata!r}</NoDataValue>" if nodata is not None else ""
+            bands.append(f'<VRTRasterBand dataType="{typename_fwd[dtype_rev[first.dtypes[band - 1]]]}" band="{band}">'
+                         f'{nodata_value}{"".join(sources)}</VRTRasterBand>')
+        srs = f"<SRS>{first.crs.to_wkt()}</SRS>" if first.crs else ""
+        geo_transform = ", ".join(repr(value) for value in (left, res_x, 0.0, top, 0.0, -res_y))
+        vrt = f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">{srs}' \
+              f'<GeoTransform>{geo_transform}</GeoTransform>{"".join(bands)}</VRTDataset>'
+    finally:
+        for dataset in datasets:
+            dataset.close()
+    # An unchanged VRT is not rewritten, its modification time is part of the cache keys of rasters made from it
+    if os.path.exists(output_name):
+        with open(output_name) as fp:
+            if fp.read() == vrt:
+                return output_name
+    # Features sharing a merge name can write the same VRT concurrently
+    tmp_name = output_name + f".{uuid.uuid4().hex}.tmp"
+    with open(tmp_name, "w") as fp:
+        fp.write(vrt)
+    os.replace(tmp_name, output_name)
+    return output_name
+
 
-# imported by 
 class TifData:
-    def __init__(self, data_name, file, merge_name=None, temp_path="data/temp/"):
+    def __init__(self, data_name, file, merge_name=None, temp_path="data/temp/", in_memory=False,
+                 spill_threshold=512 * 1024 ** 2, cache=None, bounds=None, warp_margin=0.05, resampling="nearest",
+                 warp_threads=os.cpu_count(), lazy=False, merged_files=None):
         """
         Class which interacts directly with the GeoTiff Data files
 
@@ -18,6 +83,21 @@ class TifData:
         :param file: Path to input data file (str / list)
         :param merge_name: Name of merged data file - if input file is list (str)
         :param temp_path: Path to store temporary files (str)
+        :param in_memory: Whether to keep merged, reprojected and clipped rasters in memory instead of temp files (bool)
+        :param spill_threshold: Rasters larger than this many bytes are still written to temp files (int)
+        :param cache: [OPTIONAL] Cache of derived rasters consulted before merging, DEM processing, reprojecting and
+                      clipping files, derived rasters go to the cache instead of temp files or memory (RasterCache)
+        :param bounds: [OPTIONAL] Bounds of the area (left, bottom, right, top) in ESPG 4326, only this area plus
+                       warp_margin is reprojected if the data is not in ESPG 4326 (tuple)
+        :param warp_margin: Margin in degrees added to bounds when reprojecting (float)
+        :param resampling: Resampling method used when reprojecting, name of a rasterio Resampling (str)
+        :param warp_threads: Number of threads used when reprojecting (int)
+        :param lazy: Whether to only open the sources, used by block processing: lists of files are mosaicked as a
+                     VRT instead of a merged array, and data not in ESPG 4326 is viewed through a WarpedVRT instead of
+                     being reprojected. self.source is the untransformed dataset to warp windows from (bool)
+        :param merged_files: [OPTIONAL] Merged rasters kept in memory, shared by the features of a run so the files of
+                     a merge_name are merged once and later features reuse the merged raster
+                     (dict: merge_name -> MemoryFile)
         """
         self.data_name = data_name
         self.file = file
@@ -34,7 +114,21 @@ class TifData:
         self.reclassified_data = np.array([])
         self.merge_name = merge_name
 
+        self.in_memory = in_memory
+        self.spill_threshold = spill_threshold
+        self.memory_files = []
+        self.cache = cache
+        self.bounds = tuple(bounds) if bounds is not None else None
+        self.warp_margin = warp_margin
+        self.resampling = resampling
+        self.warp_threads = warp_threads
+        self.lazy = lazy
+        self.merged_files = merged_files
+        self.source = None
+
         self.__make_data()
+        if self.source is None:
+            self.source = self.data
 
     def __make_data(self):
         """
@@ -54,22 +148,63 @@ class TifData:
         :return: None
         """
         if self.data_name in ["slope", "aspect"]:
-            new_file = "".join([self.temp_path, self.data_name, ".tif"])
-            gdal.DEMProcessing(new_file, self.file, self.data_name, computeEdges=True, scale=111120)
-            self.file = new_file[:]
+            self.file = self.__dem_processing()
         self.data = rasterio.open(self.file)
         crs = self.data.crs
         if crs != CRS.from_epsg(4326):
+            if self.lazy:
+                self.source = self.data
+                self.data = WarpedVRT(self.source, crs=CRS.from_epsg(4326), resampling=Resampling[self.resampling])
+                return
             self.__change_espg()
 
+    def __dem_processing(self):
+        """
+        Creates the slope or aspect file from the DEM file in self.file, using the cache if set
+        :return: Path to the slope or aspect file (str)
+        """
+        # Imported here, only DEM processing needs the GDAL python bindings
+        from osgeo import gdal
+
+        new_file = "".join([self.temp_path, self.data_name, ".tif"])
+        params = {"processing": self.data_name, "computeEdges": True, "scale": 111120}
+        if self.cache:
+            key = self.cache.make_key("dem_processing", self.file, params)
+            cached_file = self.cache.get(key)
+            if cached_file:
+                return cached_file
+        gdal.DEMProcessing(new_file, self.file, self.data_name, computeEdges=True, scale=111120)
+        if self.cache:
+            return self.cache.put_file(key, new_file, {"operation": "dem_processing", "input": self.file, **params},
+                                       move=True)
+        return new_file
+
     def __merge_tif_file(self):
         """
         Creates a new merged tif file from the list of tife file inputs, and gets data from new tif file
         - New merged tif file takes name from merge_name
         - New merged file will automatically be opened to self.data as a Rasterio object
+        - If lazy, the files are mosaicked as a VRT named after merge_name instead
+        - A merged raster kept in memory is added to self.merged_files, features with the same merge_name reuse it
         :return: None
         """
+        if self.lazy:
+            self.file = build_vrt(self.file, "".join([self.temp_path, self.merge_name, ".vrt"]))
+            self.file_type = "tif"
+            self.__make_data()
+            return
+        if self.merged_files is not None and self.merge_name in self.merged_files:
+            self.data = self.merged_files[self.merge_name].open()
+            if self.data.crs != CRS.from_epsg(4326):
+                self.__change_espg()
+            return
         output_name = "".join([self.temp_path, self.merge_name, ".tif"])
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key("merge", self.file)
+            cached_file = self.cache.get(cache_key)
+            if cached_file:
+                output_name = cached_file
         # If the merged file does not exist (some files like DEM can share the same merged tif file)
         if not os.path.exists(output_name):
             merge_files_list = []
@@ -81,8 +216,20 @@ class TifData:
             out_meta = tif_file.meta.copy()
             out_meta.update({"driver": "GTiff", "height": merged_data.shape[1], "width": merged_data.shape[2],
                             "transform": merged_transform, "crs": tif_file.crs})
-            with rasterio.open(output_name, "w", **out_meta) as dest:
-                dest.write(merged_data)
+            if cache_key:
+                output_name = self.cache.put_raster(cache_key, merged_data, out_meta,
+                                                    {"operation": "merge", "inputs": self.file})
+            # Slope and aspect are made by gdal from a file, so their merged file always goes to disk
+            elif self.data_name not in ["slope", "aspect"] and self.__keep_in_memory(merged_data.nbytes):
+                self.data = self.__write_raster(output_name, merged_data, out_meta)
+                if self.merged_files is not None:
+                    self.merged_files[self.merge_name] = self.memory_files[-1]
+                if self.data.crs != CRS.from_epsg(4326):
+                    self.__change_espg()
+                return
+            else:
+                with rasterio.open(output_name, "w", **out_meta) as dest:
+                    dest.write(merged_data)
         self.file = output_name
         self.file_type = "tif"
         self.__make_data()
@@ -90,14 +237,74 @@ class TifData:
     def __change_espg(self):
         """
         Changes ESPG projection to WGS84 (or ESPG 4326) if needed
-        - Changes current projection to world projection
-        - New TIF file will automatically be opened to self.data as a Rasterio object
+        - Changes current projection to world projection in-process with the GDAL warper on self.warp_threads threads
+        - If self.bounds is set, only the bounds plus self.warp_margin degrees are reprojected
+        - New raster will automatically be opened to self.data as a Rasterio object
         :return: None
         """
         new_file_name = "".join([self.temp_path, self.data_name, "_espg.tif"])
-        os.system('gdalwarp %s %s -t_srs "+proj=longlat +ellps=WGS84" -q' % (self.file, new_file_name))
-        self.file = new_file_name
-        self.data = rasterio.open(self.file)
+        dst_crs = CRS.from_epsg(4326)
+        source_file = self.__source_file()
+        cache_key = None
+        params = {"crs": "EPSG:4326", "bounds": self.bounds, "margin": self.warp_margin, "resampling": self.resampling}
+        if self.cache and source_file:
+            cache_key = self.cache.make_key("reproject", source_file, params)
+            cached_file = self.cache.get(cache_key)
+            if cached_file:
+                self.file = cached_file
+                self.data = rasterio.open(self.file)
+                return
+
+        src_bounds, src_width, src_height = self.__warp_source_extent(dst_crs)
+        transform, width, height = calculate_default_transform(self.data.crs, dst_crs, src_width, src_height,
+                                                               *src_bounds)
+        out_meta = self.data.meta.copy()
+        out_meta.update({"driver": "GTiff", "height": height, "width": width, "transform": transform,
+                         "crs": dst_crs})
+        nodata = self.data.nodata
+        reprojected = np.full((self.data.count, height, width), 0 if nodata is None else nodata,
+                              dtype=self.data.dtypes[0])
+        reproject(rasterio.band(self.data, list(range(1, self.data.count + 1))), reprojected,
+                  dst_transform=transform, dst_crs=dst_crs, dst_nodata=nodata,
+                  resampling=Resampling[self.resampling], num_threads=self.warp_threads)
+        if cache_key:
+            self.file = self.cache.put_raster(cache_key, reprojected, out_meta,
+                                              {"operation": "reproject", "input": source_file, **params})
+            self.data = rasterio.open(self.file)
+            return
+        self.data = self.__write_raster(new_file_name, reprojected, out_meta)
+        if self.__source_file():
+            self.file = self.data.name
+
+    def __warp_source_extent(self, dst_crs):
+        """
+        Finds the part of self.data covering self.bounds plus self.warp_margin degrees
+        :param dst_crs: CRS self.bounds are given in (Rasterio CRS)
+        :return: Bounds in the source CRS, width and height of the source area (tuple)
+        """
+        if not self.bounds:
+            return self.data.bounds, self.data.width, self.data.height
+        left, bottom, right, top = self.bounds
+        margin = self.warp_margin
+        src_bounds = transform_bounds(dst_crs, self.data.crs, left - margin, bottom - margin, right + margin,
+                                      top + margin)
+        window = from_bounds(*src_bounds, transform=self.data.transform)
+        col_start, row_start = max(int(np.floor(window.col_off)), 0), max(int(np.floor(window.row_off)), 0)
+        col_stop = min(int(np.ceil(window.col_off + window.width)), self.data.width)
+        row_stop = min(int(np.ceil(window.row_off + window.height)), self.data.height)
+        if col_stop <= col_start or row_stop <= row_start:
+            raise ValueError(f"{self.data_name}: bounds {self.bounds} do not overlap {self.data.name}")
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        return self.data.window_bounds(window), int(window.width), int(window.height)
+
+    def __source_file(self):
+        """
+        Path of the file self.data is read from
+        :return: Path to the file, None if self.data is kept in memory (str)
+        """
+        if os.path.isfile(self.data.name):
+            return self.data.name
+        return None
 
     def clip_file(self, shapes):
         """
@@ -106,15 +313,56 @@ class TifData:
         :param shapes: Polygon stored in shp file (GeoJson)
         :return: None
         """
+        source_file = self.__source_file()
+        cache_key = None
+        if self.cache and source_file:
+            cache_key = self.cache.make_key("clip", source_file, {"shapes": shapes})
+            cached_file = self.cache.get(cache_key)
+            if cached_file:
+                self.clip_file_name = cached_file
+                self.clip_data = rasterio.open(self.clip_file_name)
+                return
+
         clip_data, clip_trans = mask(self.data, shapes, crop=True)
         out_meta = self.data.meta.copy()
         out_meta.update({"driver": "GTiff", "height": clip_data.shape[1], "width": clip_data.shape[2],
                          "transform": clip_trans, "crs": self.data.crs})
+        if cache_key:
+            self.clip_file_name = self.cache.put_raster(cache_key, clip_data, out_meta,
+                                                        {"operation": "clip", "input": source_file})
+            self.clip_data = rasterio.open(self.clip_file_name)
+            return
         clip_file_name = "".join([self.temp_path, self.data_name, "_clip.tif"])
-        with rasterio.open(clip_file_name, "w", **out_meta) as dest:
-            dest.write(clip_data)
-        self.clip_file_name = clip_file_name
-        self.clip_data = rasterio.open(self.clip_file_name)
+        self.clip_data = self.__write_raster(clip_file_name, clip_data, out_meta)
+        if not self.__keep_in_memory(clip_data.nbytes):
+            self.clip_file_name = clip_file_name
+
+    def __keep_in_memory(self, nbytes):
+        """
+        Checks if a raster of a given size is kept in memory
+        :param nbytes: Size of raster data in bytes (int)
+        :return: True if the raster should be kept in memory (bool)
+        """
+        return self.in_memory and nbytes <= self.spill_threshold
+
+    def __write_raster(self, file_name, data, meta):
+        """
+        Writes raster data to an in-memory dataset if in_memory is set and the data is under the spill threshold,
+        otherwise to file_name
+        :param file_name: Path used if the raster is written to disk (str)
+        :param data: Raster data (np array (bands, height, width))
+        :param meta: Meta data for the raster (dict)
+        :return: Opened raster (Rasterio object)
+        """
+        if self.__keep_in_memory(data.nbytes):
+            memory_file = MemoryFile()
+            with memory_file.open(**meta) as dest:
+                dest.write(data)
+            self.memory_files.append(memory_file)
+            return memory_file.open()
+        with rasterio.open(file_name, "w", **meta) as dest:
+            dest.write(data)
+        return rasterio.open(file_name)
 
     def resample_data(self, new_width, new_height, clip=True):
         """
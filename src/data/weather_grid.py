@@ -0,0 +1,149 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from tqdm import tqdm
+
+
+class WeatherGrid:
+    def __init__(self, ambee, transform, width, height, resolution=0.05, method="bilinear"):
+        """
+        Samples weather data on a coarse lattice over the target raster grid and interpolates it to every pixel
+        - Weather changes slowly over a few km, so one API call per lattice node replaces one call per pixel
+        - The interpolated layers have the same (height, width) shape as the matched TifData features
+
+        :param ambee: AmbeeData object used to query the weather (AmbeeData)
+        :param transform: Affine transform of the target raster grid (Rasterio transformation object)
+        :param width: Number of columns in the target grid (int)
+        :param height: Number of rows in the target grid (int)
+        :param resolution: Spacing of the lattice in degrees, use the weather provider's native resolution if known (float)
+        :param method: Interpolation method ["bilinear", "idw"] (str)
+        """
+        if method not in ("bilinear", "idw"):
+            raise ValueError(f"Unknown weather interpolation method: {method}")
+        self.ambee = ambee
+        self.transform = transform
+        self.width, self.height = width, height
+        self.resolution = resolution
+        self.method = method
+
+        self.lattice_cols, self.lattice_rows = self.__make_lattice()
+        self.lattice_data = {}
+
+    def __make_lattice(self):
+        """
+        Places the lattice nodes evenly between the first and last pixel centers in each direction, with at most
+        self.resolution degrees between neighbouring nodes
+        :return: Lattice node positions in pixel coordinates along columns and rows (tuple of np arrays)
+        """
+        pixel_size_x = np.hypot(self.transform.a, self.transform.d)
+        pixel_size_y = np.hypot(self.transform.b, self.transform.e)
+        n_cols = int(np.ceil((self.width - 1) * pixel_size_x / self.resolution)) + 1
+        n_rows = int(np.ceil((self.height - 1) * pixel_size_y / self.resolution)) + 1
+        lattice_cols = np.linspace(0.5, self.width - 0.5, min(n_cols, self.width))
+        lattice_rows = np.linspace(0.5, self.height - 0.5, min(n_rows, self.height))
+        return lattice_cols, lattice_rows
+
+    def sample_weather(self):
+        """
+        Queries the weather at every lattice node
+        - Creates self.lattice_data (dict: name of weather feature -> np array of shape (lattice rows, lattice cols))
+        :return: None
+        """
+        cols, rows = np.meshgrid(self.lattice_cols, self.lattice_rows)
+        x_coords = self.transform.a * cols + self.transform.b * rows + self.transform.c
+        y_coords = self.transform.d * cols + self.transform.e * rows + self.transform.f
+
+        lattice_data = {}
+        for idx in tqdm(np.ndindex(cols.shape), total=cols.size, desc='Getting Weather Lattice'):
+            weather = self.ambee.get_weather_lat_lon(y_coords[idx], x_coords[idx])
+            for feature, value in weather.items():
+                if feature not in lattice_data:
+                    lattice_data[feature] = np.full(cols.shape, np.nan)
+                lattice_data[feature][idx] = value
+        self.lattice_data = lattice_data
+
+    def get_weather_data(self, col_off=0, row_off=0, width=None, height=None):
+        """
+        Interpolates the sampled lattice to every pixel of the target grid, sampling the lattice first if needed
+        - A window of the target grid can be interpolated on its own, used for block processing
+        :param col_off: Column offset of the window (int)
+        :param row_off: Row offset of the window (int)
+        :param width: Width of the window, defaults to the rest of the grid (int)
+        :param height: Height of the window, defaults to the rest of the grid (int)
+        :return: Weather rasters matching the target grid (dict: name of weather feature -> np array (height, width))
+        """
+        if not self.lattice_data:
+            self.sample_weather()
+        width = self.width - col_off if width is None else width
+        height = self.height - row_off if height is None else height
+        pixel_cols = np.arange(col_off, col_off + width) + 0.5
+        pixel_rows = np.arange(row_off, row_off + height) + 0.5
+        if self.method == "bilinear":
+            interpolate = self.__bilinear
+        else:
+            interpolate = self.__idw
+        return {feature: interpolate(values, pixel_cols, pixel_rows) for feature, values in self.lattice_data.items()}
+
+    @staticmethod
+    def __interp_weights(targets, nodes):
+        """
+        Finds the two neighbouring nodes of every target position and the linear weight of the upper node
+        :param targets: Positions to interpolate to (np array)
+        :param nodes: Sorted node positions (np array)
+        :return: Lower node index, upper node index, weight of upper node (tuple of np arrays)
+        """
+        upper = np.clip(np.searchsorted(nodes, targets), 1, max(len(nodes) - 1, 1))
+        lower = upper - 1
+        if len(nodes) == 1:
+            return np.zeros_like(lower), np.zeros_like(lower), np.zeros(len(targets))
+        weight = (targets - nodes[lower]) / (nodes[upper] - nodes[lower])
+        return lower, upper, np.clip(weight, 0, 1)
+
+    def __bilinear(self, values, pixel_cols, pixel_rows):
+        """
+        Bilinear interpolation of lattice values to the target grid
+        :param values: Lattice values (np array (lattice rows, lattice cols))
+        :param pixel_cols: Pixel center positions of the output columns (np array)
+        :param pixel_rows: Pixel center positions of the output rows (np array)
+        :return: Interpolated raster (np array (rows, cols))
+        """
+        col_0, col_1, col_w = self.__interp_weights(pixel_cols, self.lattice_cols)
+        row_0, row_1, row_w = self.__interp_weights(pixel_rows, self.lattice_rows)
+
+        top = values[row_0][:, col_0] * (1 - col_w) + values[row_0][:, col_1] * col_w
+        bottom = values[row_1][:, col_0] * (1 - col_w) + values[row_1][:, col_1] * col_w
+        return top * (1 - row_w)[:, None] + bottom * row_w[:, None]
+
+    def __idw(self, values, pixel_cols, pixel_rows, power=2, neighbours=8, chunk_size=2 ** 24):
+        """
+        Inverse distance weighted interpolation of lattice values to the target grid
+        - Every pixel is interpolated from its closest lattice nodes only, found with a KD-tree over the nodes, so the
+          cost grows with the number of pixels and not with the size of the lattice
+        - Distances are measured in pixel coordinates and rows are processed in chunks to bound memory
+        - Lattice nodes without data are ignored
+        :param values: Lattice values (np array (lattice rows, lattice cols))
+        :param pixel_cols: Pixel center positions of the output columns (np array)
+        :param pixel_rows: Pixel center positions of the output rows (np array)
+        :param power: Power applied to the inverse distance (int)
+        :param neighbours: Number of closest lattice nodes every pixel is interpolated from (int)
+        :param chunk_size: Maximum number of pixel to node distances held in memory at once (int)
+        :return: Interpolated raster (np array (rows, cols))
+        """
+        node_cols, node_rows = np.meshgrid(self.lattice_cols, self.lattice_rows)
+        valid = ~np.isnan(values)
+        node_values = values[valid]
+
+        output = np.full((len(pixel_rows), len(pixel_cols)), np.nan)
+        if len(node_values) == 0:
+            return output
+        tree = cKDTree(np.column_stack((node_cols[valid], node_rows[valid])))
+        neighbours = min(neighbours, len(node_values))
+        chunk_rows = max(1, chunk_size // (len(pixel_cols) * neighbours))
+        for start in range(0, len(pixel_rows), chunk_rows):
+            stop = min(start + chunk_rows, len(pixel_rows))
+            cols, rows = np.meshgrid(pixel_cols, pixel_rows[start:stop])
+            dist, nodes = tree.query(np.column_stack((cols.ravel(), rows.ravel())), k=np.arange(1, neighbours + 1))
+            # A pixel sitting on a node takes that node's value
+            weights = 1 / np.maximum(dist, 1e-12) ** power
+            chunk = (weights * node_values[nodes]).sum(axis=-1) / weights.sum(axis=-1)
+            output[start:stop] = chunk.reshape(cols.shape)
+        return output
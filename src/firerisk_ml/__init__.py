@@ -1 +1,16 @@
-from .risk_ml import RiskAssesmentML
+import importlib
+
+# Re-exports are imported on first use, so fire_history and spatial_index can be used without GDAL
+_EXPORTS = {
+    "RiskAssesmentML": ".risk_ml",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
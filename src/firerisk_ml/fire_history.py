@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+from src.data import RasterCache
+
+FIRE_COLUMNS = ['X', 'Y', 'FireCause', 'FireDiscoveryDateTime', 'DailyAcres', 'CalculatedAcres', 'IncidentTypeCategory']
+CATEGORY_COLUMNS = ['FireCause', 'IncidentTypeCategory']
+CSV_DTYPES = {'X': 'float64', 'Y': 'float64', 'DailyAcres': 'float64', 'CalculatedAcres': 'float64',
+              'FireCause': 'category', 'IncidentTypeCategory': 'category', 'FireDiscoveryDateTime': 'str'}
+# WFIGS dates look like 2020/06/19 20:15:00+00, the UTC offset is dropped
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+class FireHistory:
+    def __init__(self, csv_path, store=None, stage="fire_history", bucket_size=1.0, chunk_size=200000):
+        """
+        Loads the rows of the WFIGS fire history csv inside a bounding box
+        - The csv is streamed in chunks of chunk_size rows with typed columns, the bounding box and incident category
+          are applied to every chunk and dates are parsed for a whole chunk at once
+        - With a store, the first load writes every row with coordinates to a typed columnar stage (text columns as
+          category codes, dates as datetime64) sorted by a spatial bucket of bucket_size degrees. Later loads for any
+          box binary search the memory-mapped bucket column and only read the rows of the buckets the box touches
+        - The stage is rebuilt when the csv changes (path, size or modification time)
+
+        :param csv_path: Path to the fire history data csv (str)
+        :param store: [OPTIONAL] Columnar store for the cache (ColumnStore)
+        :param stage: Name of the cache stage (str)
+        :param bucket_size: Size of the square spatial buckets in degrees (float)
+        :param chunk_size: Number of csv rows parsed at once (int)
+        """
+        self.csv_path = csv_path
+        self.store = store
+        self.stage = stage
+        self.bucket_size = bucket_size
+        self.chunk_size = chunk_size
+        self.bucket_columns = int(np.ceil(360 / bucket_size))
+        self.bucket_rows = int(np.ceil(180 / bucket_size))
+
+    def load(self, bbox, category='WF'):
+        """
+        Loads the fires inside a bounding box
+        :param bbox: min longitude, min latitude, max longitude, max latitude, borders included (tuple)
+        :param category: Only keep this IncidentTypeCategory, None to keep all (str)
+        :return: Fire history with the columns in FIRE_COLUMNS, FireDiscoveryDateTime parsed (df)
+        """
+        if self.store is None:
+            return self.__scan(bbox, category)
+        if not self.is_cached():
+            self.build()
+        return self.__query(bbox, category)
+
+    def is_cached(self):
+        """
+        Checks whether the cache stage was built from the current csv
+        :return: Whether the cache is valid (bool)
+        """
+        if self.store is None or not self.store.exists(self.stage):
+            return False
+        attrs = self.store.read_attrs(self.stage)
+        return attrs.get("source") == RasterCache.file_identity(self.csv_path) and \
+            attrs.get("bucket_size") == self.bucket_size
+
+    def build(self):
+        """
+        Streams the whole csv into the cache stage, sorted by spatial bucket
+        - Every chunk is converted to numpy columns as it is read, category codes are mapped to categories shared by
+          all chunks, so only the typed columns are held in memory
+        :return: Number of cached rows (int)
+        """
+        categories = {name: {} for name in CATEGORY_COLUMNS}
+        parts = {name: [] for name in FIRE_COLUMNS}
+        for chunk in self.__read_chunks():
+            for name in FIRE_COLUMNS:
+                values = chunk[name]
+                if name in CATEGORY_COLUMNS:
+                    codes = categories[name]
+                    chunk_codes = np.array([codes.setdefault(str(value), len(codes))
+                                            for value in values.cat.categories] + [-1], dtype=np.int32)
+                    # Code -1 (missing) indexes the -1 appended last
+                    parts[name].append(chunk_codes[values.cat.codes.to_numpy()])
+                else:
+                    parts[name].append(values.to_numpy())
+        columns = {name: np.concatenate(values) if values else
+                   np.array([], dtype=np.int32 if name in CATEGORY_COLUMNS else
+                            "datetime64[ns]" if name == 'FireDiscoveryDateTime' else np.float64)
+                   for name, values in parts.items()}
+        categories = {name: list(codes) for name, codes in categories.items()}
+
+        buckets = self.bucket_ids(columns['X'], columns['Y'])
+        order = np.argsort(buckets, kind="stable")
+        data = {"bucket": buckets[order]}
+        data.update({name: values[order] for name, values in columns.items()})
+        attrs = {"source": RasterCache.file_identity(self.csv_path), "bucket_size": self.bucket_size,
+                 "categories": categories}
+        self.store.write(self.stage, data, attrs)
+        print(f"Cached {len(order)} fires from {self.csv_path}")
+        return len(order)
+
+    def bucket_ids(self, x_coords, y_coords):
+        """
+        Spatial bucket of every point, buckets are numbered row by row from the south west
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :return: Bucket of every point (np array, int64)
+        """
+        bucket_x = np.clip(np.floor((np.asarray(x_coords) + 180) / self.bucket_size), 0, self.bucket_columns - 1)
+        bucket_y = np.clip(np.floor((np.asarray(y_coords) + 90) / self.bucket_size), 0, self.bucket_rows - 1)
+        return bucket_y.astype(np.int64) * self.bucket_columns + bucket_x.astype(np.int64)
+
+    def __read_chunks(self, bbox=None, category=None):
+        """
+        Streams the csv with typed columns and parsed dates, filtering every chunk
+        :param bbox: [OPTIONAL] min longitude, min latitude, max longitude, max latitude (tuple)
+        :param category: [OPTIONAL] Only keep this IncidentTypeCategory (str)
+        :return: Generator of filtered chunks (df)
+        """
+        reader = pd.read_csv(self.csv_path, usecols=FIRE_COLUMNS, dtype=CSV_DTYPES, chunksize=self.chunk_size)
+        invalid_dates = 0
+        for chunk in reader:
+            keep = chunk['X'].notna().to_numpy() & chunk['Y'].notna().to_numpy()
+            if bbox is not None:
+                keep &= self.__in_bbox(chunk['X'].to_numpy(), chunk['Y'].to_numpy(), bbox)
+            if category is not None:
+                keep &= (chunk['IncidentTypeCategory'] == category).to_numpy()
+            chunk = chunk[keep].reset_index(drop=True)
+            dates = chunk['FireDiscoveryDateTime']
+            chunk['FireDiscoveryDateTime'] = pd.to_datetime(dates.str[:19], format=DATE_FORMAT, errors='coerce')
+            invalid_dates += int((chunk['FireDiscoveryDateTime'].isna() & dates.notna()).sum())
+            yield chunk[FIRE_COLUMNS]
+        if invalid_dates:
+            print(f"Warning: {invalid_dates} fire discovery dates in {self.csv_path} could not be parsed, "
+                  f"they are kept as NaT")
+
+    def __scan(self, bbox, category):
+        """
+        Loads the fires inside a bounding box by streaming the csv
+        :param bbox: min longitude, min latitude, max longitude, max latitude (tuple)
+        :param category: Only keep this IncidentTypeCategory, None to keep all (str)
+        :return: Fire history (df)
+        """
+        chunks = list(self.__read_chunks(bbox, category))
+        if not chunks:
+            return pd.DataFrame({name: [] for name in FIRE_COLUMNS})
+        data = pd.concat(chunks, ignore_index=True)
+        for name in CATEGORY_COLUMNS:
+            data[name] = data[name].astype(object)
+        return data
+
+    def __query(self, bbox, category):
+        """
+        Loads the fires inside a bounding box from the cache stage
+        :param bbox: min longitude, min latitude, max longitude, max latitude (tuple)
+        :param category: Only keep this IncidentTypeCategory, None to keep all (str)
+        :return: Fire history (df)
+        """
+        meta = self.store.read_meta(self.stage)
+        columns = self.store.read_columns(self.stage, mmap=True)
+        buckets = columns["bucket"]
+
+        # Buckets of one row are consecutive, so every bucket row of the box is one slice of the sorted rows
+        (first_x, last_x), (first_y, last_y) = [
+            np.clip(np.floor((np.array(coords) + offset) / self.bucket_size).astype(np.int64), 0, size - 1)
+            for coords, offset, size in [((bbox[0], bbox[2]), 180, self.bucket_columns),
+                                         ((bbox[1], bbox[3]), 90, self.bucket_rows)]]
+        bucket_row = np.arange(first_y, last_y + 1) * self.bucket_columns
+        starts = np.searchsorted(buckets, bucket_row + first_x, side="left")
+        stops = np.searchsorted(buckets, bucket_row + last_x, side="right")
+        rows = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)] or [np.array([], int)])
+
+        x_coords, y_coords = columns['X'][rows], columns['Y'][rows]
+        keep = self.__in_bbox(x_coords, y_coords, bbox)
+        if category is not None:
+            categories = meta["attrs"]["categories"]['IncidentTypeCategory']
+            code = categories.index(category) if category in categories else -2
+            keep &= columns['IncidentTypeCategory'][rows] == code
+        rows = rows[keep]
+
+        data = {}
+        for name in FIRE_COLUMNS:
+            values = np.asarray(columns[name][rows])
+            if name in CATEGORY_COLUMNS:
+                values = pd.Categorical.from_codes(values, meta["attrs"]["categories"][name]).astype(object)
+            data[name] = values
+        return pd.DataFrame(data)
+
+    @staticmethod
+    def __in_bbox(x_coords, y_coords, bbox):
+        """
+        Checks which points are inside a bounding box, borders included
+        :param x_coords: Longitude of every point (np array)
+        :param y_coords: Latitude of every point (np array)
+        :param bbox: min longitude, min latitude, max longitude, max latitude (tuple)
+        :return: Whether every point is inside (np array, bool)
+        """
+        return (x_coords >= bbox[0]) & (x_coords <= bbox[2]) & (y_coords >= bbox[1]) & (y_coords <= bbox[3])
@@ -1,18 +1,27 @@
+import json
 import time
 
-from src.data import MakeData, AmbeeData
+from rasterio.transform import Affine
+
+from src.data import MakeData, AmbeeData, RasterCache
+from src.data.risk_kernel import ND_BANDS
 import pandas as pd
-from datetime import datetime as dt
 import numpy as np
 import sklearn
 from sklearn.linear_model import SGDClassifier, RidgeClassifier, LogisticRegression
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.svm import LinearSVC
+from .spatial_index import GridIndex
+from .fire_history import FireHistory
+
+# Feature columns of the training data, in the order of the model coefficients
+FEATURE_COLUMNS = ['temp', 'vapr', 'wind', 'prec', 'slope', 'aspect', 'elevation', 'ndvi', 'ndmi', 'ndwi']
 
 
 class RiskAssesmentML:
     def __init__(self, fire_data, coordinate_file, data_path, rule_list, features={}, auto_download=False, classify=False,
-                 accurate_weather=False, model='svm', sample_frac=0.002):
+                 accurate_weather=False, model='svm', sample_frac=0.002, max_fire_distance=None, feature_store=None,
+                 random_state=None):
         """
         Creates Regression ML Models on feature data matched to fire history data for fire risk regression
 
@@ -24,6 +33,11 @@ class RiskAssesmentML:
                             (dict: name of feature -> tuple (path to raster, merged_file_name)
         :param auto_download: Whether to auto-download feature data from USGS (bool)
         :param classify: Whether or not to use classified data for the model
+        :param max_fire_distance: [OPTIONAL] Fires further than this from the closest feature point (in degrees) are
+                            dropped instead of being matched, fires outside the feature grid are always dropped (float)
+        :param feature_store: [OPTIONAL] Columnar store the feature data is memory-mapped from if an earlier run wrote it,
+                            and written to otherwise. The fire history csv is also cached in it (ColumnStore)
+        :param random_state: [OPTIONAL] Seed of the sample of points without a fire (int)
 
         NOTE:
         - This function does not currently support the classified data with accurate weather. To integrate this
@@ -31,11 +45,15 @@ class RiskAssesmentML:
         """
         self.ambee = AmbeeData()
 
-        self.feature_input = self.__make_feature_data(coordinate_file, data_path, rule_list, features, auto_download, classify)
-        self.fire_data = self.__make_fire_data(fire_data)
+        self.feature_input, feature_grid = self.__make_feature_data(coordinate_file, data_path, rule_list, features,
+                                                                     auto_download, classify, feature_store)
+        self.grid_index = GridIndex(self.feature_input['x'], self.feature_input['y'], *feature_grid)
+        self.max_fire_distance = max_fire_distance
+        self.fire_data = self.__make_fire_data(fire_data, feature_store)
         self.ml_data = None
         self.X, self.y = None, None
         self.sample_frac = sample_frac
+        self.rng = np.random.default_rng(random_state)
 
         self.accurate_weather = accurate_weather
 
@@ -64,21 +82,41 @@ class RiskAssesmentML:
         return score, reg.coef_, reg.intercept_
 
     @staticmethod
-    def __make_feature_data(coordinate_file, data_path, rule_list, features, auto_download, classify):
+    def __make_feature_data(coordinate_file, data_path, rule_list, features, auto_download, classify,
+                            feature_store=None):
         """
         Creates a Pandas Dataframe of input features assigned to longitude and latitude coordinates
         - The shape (and size) of the data is based on the coordinate file provided
         - To expand the size of the training data for the ml model, change the size of the shape in the coordinate file
         - To auto-download the data, set auto_download to be True - DEM, Landsat-8 will automatically be downloaded
+        - If feature_store holds the "reclassified_data" (classify) or "data" stage of an earlier run on the same
+          coordinate file with the same inputs (the same feature and rule files, unchanged since), it is loaded from
+          the store instead. A stage written from other inputs, e.g. Ambee weather by run_firerisk, is recomputed
         :param coordinate_file: Path to GeoJson or Shape file for cropping rasters to polygon shape (str)
         :param data_path: Path to all data files (str)
         :param rule_list: Rules mapping final feature data to classified data (dict: name of feature -> path to rule file)
         :param features: All features used for Risk Assessment Model
                         (dict: name of feature -> tuple (path to raster, merged_file_name)
         :param auto_download: Whether to auto-download all DEM and weather data (bool)
-        :return: Pandas Dataframe containing all feature data for the coordinate file range (df)
-        """
-        data = MakeData(coordinate_file, data_path, rule_list, feature_set=features, download_files=auto_download)
+        :param classify: Whether or not to use classified data (bool)
+        :param feature_store: [OPTIONAL] Columnar store of the feature data (ColumnStore)
+        :return: Pandas Dataframe containing all feature data for the coordinate file range (df) and the
+                 transform, width and height of the feature grid (tuple)
+        """
+        stage = "reclassified_data" if classify else "data"
+        if feature_store and feature_store.exists(stage):
+            meta = feature_store.read_meta(stage)
+            attrs = meta["attrs"]
+            # Round trip through json so tuples compare equal to the stored lists
+            input_versions = json.loads(json.dumps(RasterCache.input_versions(features, rule_list,
+                                                                              weather=len(features) == 0)))
+            if attrs.get("coordinate_file") == coordinate_file and attrs.get("inputs") == input_versions and \
+                    all(nd_name in meta["columns"] for nd_name in ND_BANDS):
+                return feature_store.read(stage), (Affine(*attrs["transform"]), attrs["width"], attrs["height"])
+            print(f"Stage {stage} in the feature store was made from other inputs, recomputing the feature data")
+
+        data = MakeData(coordinate_file, data_path, rule_list, feature_set=features, download_files=auto_download,
+                        store=feature_store)
         data.clip_files()
         data.resample_data()
         data.create_clip_pd()
@@ -86,32 +124,28 @@ class RiskAssesmentML:
         if classify:
             data.classify_data()
         pd_data = data.get_pd_dataframe()
-        return pd_data
+        return pd_data, (data.transform, data.width, data.height)
 
-    def __make_fire_data(self, fire_data_path):
+    def __make_fire_data(self, fire_data_path, fire_store=None):
         """
         Creates a pandas dataframe of the output data with various output labels - input data can be used to predict
         different outputs if needed
 
-        - Currently the only columns used are defined in cols below
-        - Crops data to the area defined in the coordinate input file and keeps only WildFire data
+        - Currently the only columns used are defined in FIRE_COLUMNS (fire_history.py)
+        - Crops data to the area defined in the coordinate input file and keeps only WildFire data, both while the csv
+          is streamed. With fire_store, the csv is cached on the first run and later runs only read the fires in the area
 
         data link can be found here:
         https://data-nifc.opendata.arcgis.com/datasets/nifc::wfigs-wildland-fire-locations-full-history/explore?location=37.759441%2C-118.096584%2C6.29
 
         :param fire_data_path: Path to the fire history data csv (str)
+        :param fire_store: [OPTIONAL] Columnar store for the fire history cache (ColumnStore)
         :return: Pandas dataframe of the label data (df)
         """
-        cols = ['X', 'Y', 'FireCause', 'FireDiscoveryDateTime', 'DailyAcres', 'CalculatedAcres', 'IncidentTypeCategory']
-        fire_history_data = pd.read_csv(fire_data_path, usecols=cols)
-        fire_history_data[['DailyAcres']] = fire_history_data[['DailyAcres']].fillna(value=0.001)
-
         x_clip, y_clip = self.__get_min_max_coords()
-        filtered_data = fire_history_data[fire_history_data['X'] <= x_clip[0]]
-        filtered_data = filtered_data[filtered_data['X'] >= x_clip[1]]
-        filtered_data = filtered_data[filtered_data['Y'] <= y_clip[0]]
-        filtered_data = filtered_data[filtered_data['Y'] >= y_clip[1]]
-        filtered_data = filtered_data[filtered_data['IncidentTypeCategory'] == 'WF']
+        fire_history = FireHistory(fire_data_path, store=fire_store)
+        filtered_data = fire_history.load((x_clip[1], y_clip[1], x_clip[0], y_clip[0]), category='WF')
+        filtered_data[['DailyAcres']] = filtered_data[['DailyAcres']].fillna(value=0.001)
 
         return filtered_data
 
@@ -119,33 +153,29 @@ class RiskAssesmentML:
         """
         Combines the Feature input data and the Fire Data Labels to create one pandas df for ML training and testing
         Note:
-        - The cleaned data will drop the columns defined in cols_to_drop, feel free to change this to learn different models
-        - The cleaned data will drop any invalid numbers
+        - Every fire matched to a feature point is a positive row (fire = 1), negatives (fire = 0) are a random sample
+          of sample_frac of the grid drawn by position from the points without a fire, only the chosen rows are copied
+        - Rows with an invalid number (nodata -9999, 99999 or NaN) in any numeric column are dropped with one mask
 
         :return: Pandas df for ml modeling with features matched to fire labels (df)
         """
-        xy_coords = self.fire_data[["X", "Y"]].apply(tuple, axis=1).tolist()
-        closest_idxs = self.__find_closest_coord_idx(xy_coords)
-        closest_input_data = self.feature_input.iloc[closest_idxs]
+        closest_idxs = self.__find_closest_coord_idx(self.fire_data['X'].to_numpy(), self.fire_data['Y'].to_numpy())
+        positive_idxs = closest_idxs[closest_idxs >= 0]
 
-        sample_data = self.feature_input.copy()
-        sample_data.drop(closest_idxs)
-        sample_data = sample_data.sample(frac=self.sample_frac)
-        closest_input_data['fire'] = 1
-        sample_data['fire'] = 0
-        ml_data = pd.concat([closest_input_data, sample_data], axis=0, ignore_index=True)
-        """
-        new_fire_data = self.fire_data.copy()
-        cols_to_drop = ['X', 'Y', 'CalculatedAcres', 'IncidentTypeCategory', 'FireCause']
-        new_fire_data.drop(columns=cols_to_drop, inplace=True)
-        ml_data = pd.concat([closest_input_data.reset_index(drop=True), new_fire_data.reset_index(drop=True)], axis=1)
-        """
+        has_fire = np.zeros(len(self.feature_input), dtype=bool)
+        has_fire[positive_idxs] = True
+        negative_pool = np.flatnonzero(~has_fire)
+        sample_size = min(int(round(self.sample_frac * len(self.feature_input))), len(negative_pool))
+        negative_idxs = self.rng.choice(negative_pool, size=sample_size, replace=False)
 
-        for column in ml_data:
-            if ml_data[column].dtypes == 'float64':
-                ml_data = ml_data.drop(ml_data[ml_data[column] <= -9999].index)
-                ml_data = ml_data.drop(ml_data[ml_data[column] >= 99999].index)
-        return ml_data
+        rows = np.concatenate([positive_idxs, np.sort(negative_idxs)])
+        ml_data = self.feature_input.iloc[rows].reset_index(drop=True)
+        ml_data['fire'] = np.concatenate([np.ones(len(positive_idxs), dtype=np.int8),
+                                          np.zeros(len(negative_idxs), dtype=np.int8)])
+
+        numeric = ml_data.select_dtypes(include='number').to_numpy(dtype=np.float64)
+        valid = np.all(np.isfinite(numeric) & (numeric > -9999) & (numeric < 99999), axis=1)
+        return ml_data[valid].reset_index(drop=True)
 
     def __get_min_max_coords(self):
         """
@@ -157,19 +187,15 @@ class RiskAssesmentML:
         max_y, min_y = max(self.feature_input['y']), min(self.feature_input['y'])
         return (max_x, min_x), (max_y, min_y)
 
-    def __find_closest_coord_idx(self, xy_coords):
+    def __find_closest_coord_idx(self, x_coords, y_coords):
         """
         Finds and matches the closest coordinates from the fire history data to the feature input data
-        :param xy_coords: longitude and latitude coordinates of all the fires that were in coordinate_file (list)
-        :return: List of the indexes of the closest coordinates (list)
+        - Uses self.grid_index, fires outside the grid or further than self.max_fire_distance are rejected
+        :param x_coords: longitude coordinates of all the fires that were in coordinate_file (np array)
+        :param y_coords: latitude coordinates of all the fires that were in coordinate_file (np array)
+        :return: Positional indexes of the closest coordinates, -1 for rejected fires (np array)
         """
-        closest_idxs = []
-        for x_coord, y_coord in xy_coords:
-            find_xy = self.feature_input[['x', 'y']].sub([x_coord, y_coord], axis='columns').abs()
-            find_xy["z"] = find_xy['x'] ** 2 + find_xy['y'] ** 2
-            closest_idx = find_xy['z'].idxmin()
-            closest_idxs.append(closest_idx)
-        return closest_idxs
+        return self.grid_index.query(x_coords, y_coords, max_distance=self.max_fire_distance)
 
     def __clean_data_for_ml(self):
         """
@@ -179,8 +205,8 @@ class RiskAssesmentML:
         self.ml_data = self.__combine_and_clean_data()
         if self.accurate_weather:
             self.ml_data = self.__get_weather_from_date()
-        X = self.ml_data[['temp', 'vapr', 'wind', 'prec', 'slope', 'aspect', 'elevation', 'ndvi', 'ndmi', 'ndwi']].to_numpy()
-        y = self.ml_data['fire'].to_numpy()
+        X = self.ml_data[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+        y = self.ml_data['fire'].to_numpy(dtype=np.float32)
 
         # y = self.ml_data['DailyAcres'].to_numpy()
         # y = y.reshape(-1, 1)
@@ -189,24 +215,27 @@ class RiskAssesmentML:
 
         scaler = sklearn.preprocessing.MinMaxScaler()
         X = scaler.fit_transform(X)
-        self.X, self.y = X, y
+        self.X, self.y = np.ascontiguousarray(X, dtype=np.float32), y
 
     def __get_weather_from_date(self):
         """
         Uses the Ambee API to get historical weather data for when the fire took place
+        - Fires in the same weather cell on the same day share one request, requests run concurrently
+          (see AmbeeData.get_weather_history_bulk)
+        - Rows whose weather could not be fetched are dropped
         :return: Pandas Dataframe with updated weather data
         """
-        def weather_helper(df):
-            weather_hist = self.ambee.get_weather_history(df['y'], df['x'], df['FireDiscoveryDateTime'])
-            return weather_hist
-
+        if 'FireDiscoveryDateTime' not in self.ml_data:
+            # Training rows are feature points, the points without a fire have no date to get the weather of
+            raise ValueError("accurate_weather needs a FireDiscoveryDateTime for every training row")
         ml_data = self.ml_data.copy()
-        ml_data['FireDiscoveryDateTime'] = ml_data['FireDiscoveryDateTime'].apply(lambda x: x[:-3])
-        ml_data['FireDiscoveryDateTime'] = ml_data['FireDiscoveryDateTime'].apply(lambda x: dt.strptime(x, '%Y/%m/%d %H:%M:%S').strftime('%Y-%m-%d'))
-        new_weather = ml_data.apply(weather_helper, axis=1)
-        new_weather = list(new_weather.to_numpy())
-        ml_data['temp'] = [row['temp'] for row in new_weather]
-        ml_data['vapr'] = [row['vapr'] for row in new_weather]
-        ml_data['wind'] = [row['wind'] for row in new_weather]
-        ml_data['prec'] = [row['prec'] for row in new_weather]
-        return ml_data
+        # Dates are parsed by FireHistory, only formatted here
+        dates = pd.to_datetime(ml_data['FireDiscoveryDateTime']).dt.strftime('%Y-%m-%d')
+        new_weather = self.ambee.get_weather_history_bulk(ml_data['y'].to_numpy(), ml_data['x'].to_numpy(),
+                                                          dates.to_numpy(dtype=object))
+        for feature in ['temp', 'vapr', 'wind', 'prec']:
+            ml_data[feature] = new_weather[feature].to_numpy()
+        missing = new_weather.isna().any(axis=1).to_numpy()
+        if missing.any():
+            print(f"Warning: dropping {missing.sum()} rows without historical weather")
+        return ml_data[~missing].reset_index(drop=True)
@@ -0,0 +1,73 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class GridIndex:
+    def __init__(self, x_coords, y_coords, transform=None, width=None, height=None):
+        """
+        Spatial index over the feature grid, built once and queried for all points in one vectorized call
+        - With the raster transform, the grid is regular and a point is matched to its pixel with the affine inverse
+          in O(1), assuming the data is flattened row-major (as MakeData.create_clip_pd does)
+        - Without a transform (arbitrary point sets), a KD-tree is built over the x and y coordinates
+
+        :param x_coords: Longitude of every feature point (np array)
+        :param y_coords: Latitude of every feature point (np array)
+        :param transform: [OPTIONAL] Affine transform of the feature grid (Rasterio transformation object)
+        :param width: [OPTIONAL] Number of columns in the feature grid, required with transform (int)
+        :param height: [OPTIONAL] Number of rows in the feature grid, required with transform (int)
+        """
+        self.x_coords = np.asarray(x_coords, dtype=np.float64)
+        self.y_coords = np.asarray(y_coords, dtype=np.float64)
+        self.transform, self.width, self.height = transform, width, height
+        self.tree = None
+        if transform is None or width is None or height is None or width * height != len(self.x_coords):
+            self.transform = None
+            self.tree = cKDTree(np.column_stack((self.x_coords, self.y_coords)))
+
+    def query(self, x_coords, y_coords, max_distance=None):
+        """
+        Finds the closest feature point for every input point
+        - With a transform, points outside the grid are always rejected instead of being snapped to the edge
+        :param x_coords: Longitude of points to match (array like)
+        :param y_coords: Latitude of points to match (array like)
+        :param max_distance: [OPTIONAL] Reject matches further than this distance, in coordinate units (float)
+        :return: Positional index of the closest feature point, -1 where rejected (np array)
+        """
+        x_coords = np.asarray(x_coords, dtype=np.float64)
+        y_coords = np.asarray(y_coords, dtype=np.float64)
+        if self.tree is not None:
+            return self.__query_tree(x_coords, y_coords, max_distance)
+        return self.__query_grid(x_coords, y_coords, max_distance)
+
+    def __query_tree(self, x_coords, y_coords, max_distance):
+        """
+        Nearest neighbour lookup with the KD-tree
+        :param x_coords: Longitude of points to match (np array)
+        :param y_coords: Latitude of points to match (np array)
+        :param max_distance: Reject matches further than this distance (float)
+        :return: Positional index of the closest feature point, -1 where rejected (np array)
+        """
+        upper_bound = np.inf if max_distance is None else max_distance
+        dist, idxs = self.tree.query(np.column_stack((x_coords, y_coords)), distance_upper_bound=upper_bound)
+        idxs = idxs.astype(np.int64)
+        idxs[~np.isfinite(dist)] = -1
+        return idxs
+
+    def __query_grid(self, x_coords, y_coords, max_distance):
+        """
+        Pixel lookup with the affine inverse of the grid transform
+        :param x_coords: Longitude of points to match (np array)
+        :param y_coords: Latitude of points to match (np array)
+        :param max_distance: Reject matches further than this distance from the pixel center (float)
+        :return: Positional index of the closest feature point, -1 where rejected (np array)
+        """
+        inverse = ~self.transform
+        cols = np.floor(inverse.a * x_coords + inverse.b * y_coords + inverse.c).astype(np.int64)
+        rows = np.floor(inverse.d * x_coords + inverse.e * y_coords + inverse.f).astype(np.int64)
+        valid = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        idxs = np.where(valid, rows * self.width + cols, -1)
+        if max_distance is not None:
+            matched = idxs[valid]
+            dist = np.hypot(self.x_coords[matched] - x_coords[valid], self.y_coords[matched] - y_coords[valid])
+            idxs[np.flatnonzero(valid)[dist > max_distance]] = -1
+        return idxs
@@ -0,0 +1,13 @@
+# Rule file of every classified feature, mapping feature values to risk classes
+RULE_LIST = {
+    "temp": "rules/temp_rules.txt",
+    "vapr": "rules/vapr_rules.txt",
+    "wind": "rules/wind_rules.txt",
+    "prec": "rules/prec_rules.txt",
+    "aspect": "rules/aspect_rules.txt",
+    "slope": "rules/slope_rules.txt",
+    "elevation": "rules/elevation_rules.txt",
+    "ndmi": "rules/ndmi_rules.txt",
+    "ndvi": "rules/ndvi_rules.txt",
+    "ndwi": "rules/ndwi_rules.txt"
+}
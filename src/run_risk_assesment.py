@@ -1,4 +1,6 @@
-from . import MakeData
+from . import MakeData, RasterCache, ColumnStore, HexAggregator
+from .rules import RULE_LIST
+
 
 
 def run_firerisk(coordinate_file):
@@ -21,20 +23,16 @@ def run_firerisk(coordinate_file):
    #     "prec": ("data/wc2.1_30s_prec_06.tif", None),
    # }
     
-    rule_list = {
-        "temp": "rules/temp_rules.txt",
-        "vapr": "rules/vapr_rules.txt",
-        "wind": "rules/wind_rules.txt",
-        "prec": "rules/prec_rules.txt",
-        "aspect": "rules/aspect_rules.txt",
-        "slope": "rules/slope_rules.txt",
-        "elevation": "rules/elevation_rules.txt",
-        "ndmi": "rules/ndmi_rules.txt",
-        "ndvi": "rules/ndvi_rules.txt",
-        "ndwi": "rules/ndwi_rules.txt"
-    }
-
-    data = MakeData(coordinate_file, data_path, rule_list, feature_set=features)
+    rule_list = RULE_LIST
+
+    # Derived rasters (merged DEM, slope, aspect, reprojected and clipped files) are reused across runs
+    raster_cache = RasterCache(data_path + "/cache/")
+
+    # Intermediate data of every stage, loaded by the ML and H3 tools without re-parsing csv files
+    store = ColumnStore(data_path + "/store/")
+
+    data = MakeData(coordinate_file, data_path, rule_list, feature_set=features, raster_cache=raster_cache,
+                    store=store, create_csv=False)
 
     # Processing data - calculates fire risk given input data
     data.process_data()
@@ -42,10 +40,14 @@ def run_firerisk(coordinate_file):
     # Shows fire risk map
     data.show_fire_risk()
 
-    # Create fire risk tif file
-    data.create_fire_risk_tif()
+    # Create fire risk tif file, as a Cloud-Optimized GeoTiff so viewers can read single blocks and overviews
+    data.create_fire_risk_tif(cog=True)
     data.create_fire_risk_geojson()
 
+    # Publish the fire risk of every H3 cell, the server reloads it without restarting
+    fire_risk = store.read_columns("fire_risk")
+    HexAggregator().aggregate(fire_risk["x"], fire_risk["y"], fire_risk["fire_risk"]).save(store, "hexagons")
+
     # Deletes all temp data
     data.del_temp_files()
 
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import rasterio
+from rasterio.features import bounds, geometry_mask
+from rasterio.merge import merge
+
+from .data import MakeData, DownloadData, RasterCache, GeoJsonWriter, CogWriter
+from .run_risk_assesment import RULE_LIST
+
+
+def split_aoi(shapes, n_x=3, n_y=3, overlap=0.01):
+    """
+    Splits the bounding box of an area into n_x by n_y rectangular tiles
+    - Tiles are grown by overlap on every side so neighbouring tiles share a strip of pixels for a seamless mosaic
+    :param shapes: List of shape geometry of the area (GeoJson)
+    :param n_x: Number of tiles along the longitude (int)
+    :param n_y: Number of tiles along the latitude (int)
+    :param overlap: Overlap between neighbouring tiles in degrees (float)
+    :return: List of tile polygons (list of GeoJson)
+    """
+    shape_bounds = np.array([bounds(shape) for shape in shapes])
+    min_x, min_y = shape_bounds[:, 0].min(), shape_bounds[:, 1].min()
+    max_x, max_y = shape_bounds[:, 2].max(), shape_bounds[:, 3].max()
+    x_edges = np.linspace(min_x, max_x, n_x + 1)
+    y_edges = np.linspace(min_y, max_y, n_y + 1)
+
+    tiles = []
+    for i in range(n_x):
+        for j in range(n_y):
+            left, right = max(x_edges[i] - overlap, min_x), min(x_edges[i + 1] + overlap, max_x)
+            bottom, top = max(y_edges[j] - overlap, min_y), min(y_edges[j + 1] + overlap, max_y)
+            tiles.append({"type": "Polygon",
+                          "coordinates": [[[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]]})
+    return tiles
+
+
+def run_tile(tile_shape, tile_path, features, rule_list, get_weather, block_size, raster_cache=None,
+             warp_threads=os.cpu_count()):
+    """
+    Runs the risk assessment for one tile in its own folder, used as the process pool task
+    :param tile_shape: Polygon of the tile (GeoJson)
+    :param tile_path: Folder for the tile coordinate file, temp files and output (str)
+    :param features: All features used for Risk Assessment Model
+                (dict: name of feature -> tuple (path to raster, merged_file_name)
+    :param rule_list: Rules mapping final feature data to classified data (dict: name of feature -> path to rule file)
+    :param get_weather: Whether to get the weather from the Ambee API (bool)
+    :param block_size: [OPTIONAL] Size of the windows if the tile is block processed (int)
+    :param raster_cache: [OPTIONAL] Cache of derived rasters shared by all tiles (RasterCache)
+    :param warp_threads: Number of threads used when reprojecting features (int)
+    :return: Path to the fire risk tif of the tile (str)
+    """
+    os.makedirs(tile_path, exist_ok=True)
+    coordinate_file = os.path.join(tile_path, "tile.json")
+    with open(coordinate_file, "w") as fp:
+        json.dump(tile_shape, fp)
+    output_name = os.path.join(tile_path, "fire_risk.tif")
+
+    data = MakeData(coordinate_file, tile_path, rule_list, feature_set=dict(features), download_files=False,
+                    create_csv=False, get_weather=get_weather, raster_cache=raster_cache, warp_threads=warp_threads,
+                    lazy=bool(block_size))
+    data.process_data(block_size=block_size, output_name=output_name)
+    if not block_size:
+        data.create_fire_risk_tif(output_name)
+    data.del_temp_files()
+    return output_name
+
+
+def run_tiles(tiles, tile_root, features, rule_list, get_weather=False, block_size=None, workers=None, retries=2,
+              raster_cache=None):
+    """
+    Runs the risk assessment of every tile on a process pool, retrying failed tiles
+    - If a worker process dies, the tiles of the pool fail and are retried on a new pool
+    - The CPUs are shared between the worker processes, every tile reprojects on its share of threads
+    :param tiles: List of tile polygons (list of GeoJson)
+    :param tile_root: Folder the per tile folders are created in (str)
+    :param features: All features used for Risk Assessment Model
+                (dict: name of feature -> tuple (path to raster, merged_file_name)
+    :param rule_list: Rules mapping final feature data to classified data (dict: name of feature -> path to rule file)
+    :param get_weather: Whether to get the weather from the Ambee API (bool)
+    :param block_size: [OPTIONAL] Size of the windows if tiles are block processed (int)
+    :param workers: Number of worker processes, defaults to the number of CPUs (int)
+    :param retries: Number of times a failed tile is retried (int)
+    :param raster_cache: [OPTIONAL] Cache of derived rasters shared by all tiles (RasterCache)
+    :return: Paths to the fire risk tifs of the tiles that succeeded (list) and indices of the tiles that failed after
+             all retries (list)
+    """
+    cpus = os.cpu_count() or 1
+    warp_threads = max(1, cpus // max(1, min(workers or cpus, len(tiles))))
+    attempts = [0] * len(tiles)
+    outputs, failed = {}, []
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(idx):
+        nonlocal executor
+        tile_path = os.path.join(tile_root, f"tile_{idx}")
+        args = (tiles[idx], tile_path, features, rule_list, get_weather, block_size, raster_cache, warp_threads)
+        try:
+            return executor.submit(run_tile, *args)
+        except BrokenProcessPool:
+            # A worker process died (e.g. killed for running out of memory), which fails every tile of the pool and
+            # stops it from taking new ones. Failed tiles are retried on a new pool
+            print("A worker process died, restarting the process pool")
+            executor.shutdown(wait=False)
+            executor = ProcessPoolExecutor(max_workers=workers)
+            return executor.submit(run_tile, *args)
+
+    try:
+        pending = {submit(idx): idx for idx in range(len(tiles))}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                try:
+                    outputs[idx] = future.result()
+                except Exception as e:
+                    attempts[idx] += 1
+                    if attempts[idx] > retries:
+                        print(f"Tile {idx} failed after {attempts[idx]} attempts: {e}")
+                        failed.append(idx)
+                    else:
+                        print(f"Tile {idx} failed, retrying: {e}")
+                        pending[submit(idx)] = idx
+    finally:
+        executor.shutdown()
+    return [outputs[idx] for idx in sorted(outputs)], sorted(failed)
+
+
+def mosaic_tiles(tile_files, shapes, output_name="fire_risk.tif", geojson_name="firerisk.geojson", nodata=-9999,
+                 cog=True):
+    """
+    Mosaics the per tile fire risk tifs into one raster, masked to the area shapes
+    - Overlapping pixels are taken from the first tile that covers them
+    :param tile_files: Paths to the fire risk tifs of the tiles (list)
+    :param shapes: List of shape geometry of the full area (GeoJson)
+    :param output_name: Name for fire risk output file (str)
+    :param geojson_name: [OPTIONAL] Name for the fire risk GeoJson output file (str)
+    :param nodata: Nodata value of the output (float)
+    :param cog: Whether to write the output as a Cloud-Optimized GeoTiff (bool)
+    :return: None
+    """
+    mosaic, transform = merge(tile_files, nodata=nodata)
+    fire_risk = mosaic[0].astype(np.float32)
+    inside = geometry_mask(shapes, out_shape=fire_risk.shape, transform=transform, invert=True)
+    fire_risk[~inside] = nodata
+
+    with rasterio.open(tile_files[0]) as src:
+        meta = src.meta.copy()
+    meta.update({"driver": "GTiff", "count": 1, "dtype": "float32", "nodata": nodata, "height": fire_risk.shape[0],
+                 "width": fire_risk.shape[1], "transform": transform})
+    if cog:
+        CogWriter(output_name, nodata=nodata).write(fire_risk, meta)
+    else:
+        with rasterio.open(output_name, "w", **meta) as dest:
+            dest.write(fire_risk, 1)
+
+    if geojson_name:
+        GeoJsonWriter(geojson_name).write_raster(fire_risk, transform, nodata=nodata)
+
+
+def run_firerisk_tiles(coordinate_file, features=None, data_path="data", n_x=3, n_y=3, overlap=0.01, workers=None,
+                       retries=2, block_size=None, download_files=True, output_name="fire_risk.tif",
+                       geojson_name="firerisk.geojson"):
+    """
+    Function to run the risk assessment model on a large area by splitting it into tiles processed in parallel
+    - Input data is downloaded once for the full area, each tile then runs MakeData in its own folder
+    - The tile outputs are mosaicked into one fire risk tif (and GeoJson) for the full area
+    :param coordinate_file: Path to GeoJson or Shape file for cropping rasters to polygon shape (str)
+    :param features: All features used for Risk Assessment Model, empty to use the Ambee API for the weather
+                (dict: name of feature -> tuple (path to raster, merged_file_name)
+    :param data_path: Path to all data files, tiles are processed in data_path/tiles (str)
+    :param n_x: Number of tiles along the longitude (int)
+    :param n_y: Number of tiles along the latitude (int)
+    :param overlap: Overlap between neighbouring tiles in degrees (float)
+    :param workers: Number of worker processes, defaults to the number of CPUs (int)
+    :param retries: Number of times a failed tile is retried (int)
+    :param block_size: [OPTIONAL] Size of the windows if tiles are block processed (int)
+    :param download_files: Whether to download the DEM and Landsat-8 data for the area (bool)
+    :param output_name: Name for fire risk output file (str)
+    :param geojson_name: [OPTIONAL] Name for the fire risk GeoJson output file (str)
+    :return: Exit status, 1 if a tile failed after all retries (int)
+    """
+    features = dict(features or {})
+    get_weather = len(features) == 0
+    shapes = MakeData.read_shapes(coordinate_file)
+    if download_files:
+        os.makedirs(data_path + "/temp/", exist_ok=True)
+        downloader = DownloadData(features, shapes, filepath=data_path + "/temp/")
+        downloader.download_data()
+
+    tile_root = os.path.join(data_path, "tiles")
+    tiles = split_aoi(shapes, n_x, n_y, overlap)
+    # Merged, DEM processed and reprojected rasters are shared by all tiles through the cache
+    raster_cache = RasterCache(data_path + "/cache/")
+    tile_files, failed = run_tiles(tiles, tile_root, features, RULE_LIST, get_weather=get_weather,
+                                   block_size=block_size, workers=workers, retries=retries, raster_cache=raster_cache)
+    if failed:
+        # A mosaic with missing tiles would replace the output with holes, the tile folders are kept to inspect
+        print(f"Error: tiles {failed} failed, {len(tile_files)} of {len(tiles)} tiles processed, no output written "
+              f"(tile folders kept in {tile_root})")
+        return 1
+    mosaic_tiles(tile_files, shapes, output_name=output_name, geojson_name=geojson_name)
+    shutil.rmtree(tile_root, ignore_errors=True)
+
+    print(f"Success! {len(tile_files)} of {len(tiles)} tiles processed")
+    return 0
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the src and server packages from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def server_module(tmp_path, monkeypatch):
+    """
+    The server module with its risk table and job queue in tmp_path
+    """
+    monkeypatch.setenv("RISK_STORE_PATH", str(tmp_path / "store"))
+    monkeypatch.setenv("RISK_JOBS_PATH", str(tmp_path / "jobs"))
+    from server import server
+    from server.jobs import JobQueue
+    from server.risk_table import RiskTable
+
+    monkeypatch.setattr(server, "risk_table", RiskTable(str(tmp_path / "store")))
+    monkeypatch.setattr(server, "job_queue", JobQueue(str(tmp_path / "jobs"), data_path=str(tmp_path)))
+    return server
@@ -0,0 +1,187 @@
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+import src.data.ambee_data as ambee_data
+from src.data.ambee_data import AmbeeCache, AmbeeData, RateLimiter
+
+
+class StubAmbee:
+    def __init__(self):
+        """
+        Local stand in for the Ambee history endpoint
+        - Answers with the latitude as the temperature, the longitude as the humidity
+        - Responses queued in replies are sent first, one per request, as (status, headers, body)
+        """
+        self.calls = []
+        self.replies = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                with stub.lock:
+                    stub.calls.append((query["lat"][0], query["lng"][0], query["from"][0]))
+                    reply = stub.replies.pop(0) if stub.replies else None
+                if reply is None:
+                    history = {"apparentTemperature": float(query["lat"][0]), "humidity": float(query["lng"][0]),
+                               "windSpeed": 2.0, "dewPoint": 3.0}
+                    reply = (200, {}, json.dumps({"data": {"history": [history]}}))
+                status, headers, body = reply
+                body = body.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    stub = StubAmbee()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def make_ambee(stub, tmp_path, **kwargs):
+    kwargs = {"rate_limit": None, "backoff": 0.01, "max_workers": 4, **kwargs}
+    return AmbeeData(cache_path=str(tmp_path / "ambee_cache.sqlite"), base_url=stub.url, api_key="test", **kwargs)
+
+
+def test_bulk_requests_every_cell_and_day_once(stub, tmp_path):
+    ambee = make_ambee(stub, tmp_path)
+    rng = np.random.default_rng(0)
+    # Points within a cache cell (2 decimals) share one request
+    lats = rng.choice([39.1, 39.2, 39.3], 200) + rng.uniform(0, 0.004, 200)
+    lons = rng.choice([-120.5, -120.6], 200)
+    dates = rng.choice(["2020-07-01", "2020-08-02", None], 200)
+    has_date = np.array([date is not None for date in dates])
+
+    weather = ambee.get_weather_history_bulk(lats, lons, dates)
+    expected = {(round(lat, 2), lon, date) for lat, lon, date in zip(lats, lons, dates) if date is not None}
+    assert len(stub.calls) == len(set(stub.calls)) == len(expected)
+    assert len(weather) == 200
+    assert weather["temp"].isna().to_numpy().tolist() == (~has_date).tolist()
+    assert np.allclose(weather["temp"][has_date], np.round(lats[has_date], 2))
+    assert np.allclose(weather["vapr"][has_date], lons[has_date])
+
+    # A second run is answered from the cache
+    stub.calls.clear()
+    assert ambee.get_weather_history_bulk(lats, lons, dates).equals(weather)
+    assert stub.calls == []
+
+
+def test_retries_rate_limited_and_server_errors(stub, tmp_path):
+    ambee = make_ambee(stub, tmp_path, retries=3)
+    stub.replies = [(429, {"Retry-After": "1"}, "{}"), (503, {}, "{}")]
+    start = time.monotonic()
+    weather = ambee.get_weather_history(39.5, -120.5, "2020-07-01")
+    assert weather["temp"] == 39.5
+    assert len(stub.calls) == 3
+    # Retry-After is honored over the much shorter backoff
+    assert time.monotonic() - start >= 1
+
+
+def test_non_json_body_after_last_retry(stub, tmp_path):
+    ambee = make_ambee(stub, tmp_path, retries=2)
+    stub.replies = [(503, {}, "<html>Service Unavailable</html>")] * 3
+    with pytest.raises(ValueError):
+        ambee.get_weather_history(39.5, -120.5, "2020-07-01")
+    assert len(stub.calls) == 3
+
+    # Bulk queries report the failure and give NaN weather, nothing is cached
+    stub.replies = [(503, {}, "<html>Service Unavailable</html>")] * 3
+    weather = ambee.get_weather_history_bulk([39.5], [-120.5], ["2020-07-01"])
+    assert weather.isna().all(axis=None)
+    assert ambee.get_weather_history(39.5, -120.5, "2020-07-01")["temp"] == 39.5
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(30):
+        limiter.acquire()
+    # The burst is sent at once, the other 25 requests at 50 per second
+    assert 0.45 <= time.monotonic() - start < 2
+
+
+def test_bulk_requests_are_rate_limited(stub, tmp_path):
+    ambee = make_ambee(stub, tmp_path, rate_limit=40, max_workers=4)
+    start = time.monotonic()
+    ambee.get_weather_history_bulk(np.arange(24) / 10, np.zeros(24), ["2020-07-01"] * 24)
+    assert len(stub.calls) == 24
+    # Burst of max_workers requests, then 40 per second
+    assert time.monotonic() - start >= 0.45
+
+
+def accessed_times(cache_path):
+    with sqlite3.connect(cache_path) as conn:
+        return dict(conn.execute("SELECT key, accessed FROM responses").fetchall())
+
+
+def test_cache_hits_are_written_in_batches(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(ambee_data, "time", lambda: float(next(clock)))
+    cache_path = str(tmp_path / "ambee_cache.sqlite")
+    cache = AmbeeCache(cache_path, access_batch=3)
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    for idx in range(3):
+        cache.set("weather_history", f"key{idx}", {"idx": idx})
+    assert cache.get("weather_history", "key0") == {"idx": 0}
+    assert cache.get("weather_history", "key1") == {"idx": 1}
+    # Hits are only counted until the batch is full
+    assert accessed_times(cache_path) == {"key0": 0.0, "key1": 1.0, "key2": 2.0}
+    assert not any(statement.startswith("UPDATE") for statement in statements)
+
+    # Repeated hits of a key are one pending access time
+    cache.get("weather_history", "key0")
+    assert accessed_times(cache_path) == {"key0": 0.0, "key1": 1.0, "key2": 2.0}
+    cache.get("weather_history", "key2")
+    assert accessed_times(cache_path) == {"key0": 5.0, "key1": 4.0, "key2": 6.0}
+    cache.get("weather_history", "key1")
+    cache.flush()
+    assert accessed_times(cache_path)["key1"] == 7.0
+    assert cache.get_stats()["hits"] == 5
+    # Inserts below max_entries never count the entries
+    assert not any("COUNT" in statement for statement in statements)
+
+
+def test_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(ambee_data, "time", lambda: float(next(clock)))
+    cache_path = str(tmp_path / "ambee_cache.sqlite")
+    cache = AmbeeCache(cache_path, max_entries=10)
+    for idx in range(10):
+        cache.set("weather_history", f"key{idx}", {"idx": idx})
+    # The pending hit on key0 is written before the insert evicts
+    cache.get("weather_history", "key0")
+    cache.set("weather_history", "key0", {"idx": 0})
+    cache.set("weather_history", "key10", {"idx": 10})
+    assert sorted(accessed_times(cache_path)) == sorted(["key0"] + [f"key{idx}" for idx in range(3, 11)])
+    assert cache.n_entries == 9
+
+    # A second cache on the same file counts the entries of the first
+    other = AmbeeCache(cache_path, max_entries=10)
+    assert other.n_entries == 9
+    other.set("weather_history", "key11", {"idx": 11})
+    other.set("weather_history", "key12", {"idx": 12})
+    assert other.n_entries == 9 and len(accessed_times(cache_path)) == 9
@@ -0,0 +1,107 @@
+import json
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.merge import merge
+from rasterio.transform import from_origin
+from rasterio.warp import transform as transform_coords
+
+import src.data.tif_data as tif_data
+from src.data.process_data import MakeData
+from src.data.tif_data import build_vrt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RULES = {name: os.path.join(ROOT, "rules", f"{name}_rules.txt") for name in ["elevation", "temp"]}
+WEIGHTS = {"elevation": 0.5, "temp": 0.5}
+# Web mercator origin of the sources, around Fort Collins
+(ORIGIN_X,), (ORIGIN_Y,) = transform_coords("EPSG:4326", "EPSG:3857", [-105.2], [40.7])
+RESOLUTION = 30.0
+SIZE = 1000
+
+
+def write_raster(path, data, col_off=0, crs="EPSG:3857"):
+    transform = from_origin(ORIGIN_X + col_off * RESOLUTION, ORIGIN_Y, RESOLUTION, RESOLUTION)
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs=crs, transform=transform, nodata=-9999) as dest:
+        dest.write(data, 1)
+    return str(path)
+
+
+def make_features(path):
+    """
+    Elevation as two side by side tiles to merge and temperature as one file, both in web mercator
+    """
+    rng = np.random.default_rng(0)
+    elevation = rng.uniform(0, 2500, (SIZE, 2 * SIZE)).astype(np.float32)
+    tiles = [write_raster(path / "elevation_0.tif", elevation[:, :SIZE]),
+             write_raster(path / "elevation_1.tif", elevation[:, SIZE:], col_off=SIZE)]
+    temp = write_raster(path / "temp.tif", rng.uniform(0, 35, (SIZE, 2 * SIZE)).astype(np.float32))
+
+    (left, right), (bottom, top) = transform_coords(
+        "EPSG:3857", "EPSG:4326", [ORIGIN_X + 100 * RESOLUTION, ORIGIN_X + (2 * SIZE - 100) * RESOLUTION],
+        [ORIGIN_Y - (SIZE - 100) * RESOLUTION, ORIGIN_Y - 100 * RESOLUTION])
+    coordinate_file = str(path / "aoi.json")
+    with open(coordinate_file, "w") as fp:
+        json.dump({"type": "Polygon", "coordinates": [[[left, bottom], [right, bottom], [right, top], [left, top],
+                                                       [left, bottom]]]}, fp)
+    return coordinate_file, {"elevation": (tiles, "elevation_merged"), "temp": (temp, None)}
+
+
+def test_build_vrt_matches_merge(tmp_path):
+    data = np.arange(40 * 60, dtype=np.float32).reshape(40, 60)
+    data[5:10, 5:10] = -9999
+    files = [write_raster(tmp_path / "a.tif", data[:, :35]), write_raster(tmp_path / "b.tif", data[:, 25:], 25)]
+    merged, transform = merge(files)
+    with rasterio.open(build_vrt(files, str(tmp_path / "merged.vrt"))) as vrt:
+        assert vrt.transform.almost_equals(transform)
+        assert np.array_equal(vrt.read(), merged)
+
+
+def test_block_mode_never_loads_the_full_extent(tmp_path, monkeypatch):
+    coordinate_file, features = make_features(tmp_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("block mode merged or reprojected a full array")
+
+    monkeypatch.setattr(tif_data, "merge", fail)
+    monkeypatch.setattr(tif_data, "reproject", fail)
+    output_name = str(tmp_path / "fire_risk.tif")
+
+    tracemalloc.start()
+    try:
+        data = MakeData(coordinate_file, str(tmp_path), RULES, feature_set=features, download_files=False,
+                        weights=WEIGHTS, lazy=True)
+        data.process_data(block_size=128, output_name=output_name)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    with rasterio.open(output_name) as src:
+        fire_risk = src.read(1)
+        assert src.crs == rasterio.crs.CRS.from_epsg(4326)
+    # The output and one source are 8 MB each as float32 arrays
+    assert fire_risk.nbytes > 4 * 1024 ** 2
+    assert peak < fire_risk.nbytes / 4
+    inside = fire_risk != -9999
+    assert inside.mean() > 0.5
+    # Half of the elevation and temperature classes, which go up to 10
+    assert fire_risk[inside].min() >= 0 and fire_risk[inside].max() <= 10
+
+
+def test_lazy_features_have_the_same_grid(tmp_path):
+    coordinate_file, features = make_features(tmp_path)
+    grids = []
+    for lazy in [True, False]:
+        data = MakeData(coordinate_file, str(tmp_path), RULES, feature_set=features, download_files=False,
+                        weights=WEIGHTS, lazy=lazy)
+        data.make_target_grid()
+        elevation = data.input_data["elevation"]
+        assert elevation.data.crs == rasterio.crs.CRS.from_epsg(4326)
+        assert elevation.source.crs == rasterio.crs.CRS.from_epsg(3857 if lazy else 4326)
+        grids.append((data.width, data.height, data.transform))
+    (lazy_width, lazy_height, lazy_transform), (width, height, transform) = grids
+    assert abs(lazy_width - width) <= 1 and abs(lazy_height - height) <= 1
+    assert lazy_transform.almost_equals(transform, precision=1e-4)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.column_store import ColumnStore
+
+
+def make_stage(store):
+    rng = np.random.default_rng(0)
+    columns = {"x": rng.uniform(-121, -120, 1000), "y": rng.uniform(39, 40, 1000),
+               "elevation": rng.uniform(0, 2500, 1000).astype(np.float32), "slope": rng.integers(0, 9, 1000, np.int8)}
+    store.write("data", columns, attrs={"width": 40, "height": 25})
+    return columns
+
+
+def test_read_shares_memory_with_the_memory_maps(tmp_path, monkeypatch):
+    store = ColumnStore(str(tmp_path))
+    columns = make_stage(store)
+    mapped = store.read_columns("data")
+    monkeypatch.setattr(store, "read_columns", lambda *args, **kwargs: mapped)
+    data = store.read("data")
+
+    for name, values in columns.items():
+        assert isinstance(mapped[name], np.memmap)
+        column = data[name].to_numpy()
+        assert column.dtype == values.dtype and np.array_equal(column, values)
+        # Every column of the df is a view of its memory map, nothing was copied into RAM
+        assert np.shares_memory(column, mapped[name])
+    with pytest.raises(ValueError):
+        data.loc[0, "x"] = 0.0
+
+
+def test_write_columns_keeps_the_other_columns(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    columns = make_stage(store)
+    store.write_columns("data", {"ndvi": np.linspace(-1, 1, 1000)}, drop=["slope"])
+
+    data = store.read("data", mmap=False)
+    assert list(data.columns) == ["x", "y", "elevation", "ndvi"]
+    pd.testing.assert_series_equal(data["elevation"], pd.Series(columns["elevation"], name="elevation"))
+    assert store.read_attrs("data") == {"width": 40, "height": 25}
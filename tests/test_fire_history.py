@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.column_store import ColumnStore
+from src.firerisk_ml.fire_history import FIRE_COLUMNS, FireHistory
+
+
+def make_csv(path, n=3000):
+    """
+    Writes a WFIGS like fire history csv, with extra columns, missing coordinates and malformed dates
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 8 * 365 * 24 * 3600, n), unit="s")
+    data = pd.DataFrame({
+        "OBJECTID": np.arange(n),
+        "X": rng.uniform(-125, -100, n),
+        "Y": rng.uniform(30, 49, n),
+        "FireCause": rng.choice(["Human", "Natural", "Undetermined", None], n),
+        "FireDiscoveryDateTime": dates.strftime("%Y/%m/%d %H:%M:%S") + "+00",
+        "DailyAcres": rng.uniform(0, 1000, n).round(1),
+        "CalculatedAcres": rng.uniform(0, 1000, n).round(1),
+        "IncidentTypeCategory": rng.choice(["WF", "RX", "CX"], n, p=[0.8, 0.15, 0.05]),
+    })
+    data.loc[rng.choice(n, 50, replace=False), "X"] = np.nan
+    data.loc[rng.choice(n, 20, replace=False), "DailyAcres"] = np.nan
+    data.loc[rng.choice(n, 10, replace=False), "FireDiscoveryDateTime"] = "not a date"
+    # A category only in the last rows, so it is missing from the first chunks
+    data.loc[n - 5:, "FireCause"] = "Lightning"
+    data.to_csv(path, index=False)
+    return str(path)
+
+
+def sort_fires(data):
+    return data[FIRE_COLUMNS].sort_values(["X", "Y"], ignore_index=True)
+
+
+@pytest.mark.parametrize("bbox, category", [((-125, 30, -100, 49), None), ((-121.3, 35.2, -110.05, 41.7), "WF"),
+                                            ((-110, 40, -105, 45), "RX"), ((-121, 35, -110, 41), "missing")])
+def test_cache_matches_scan(tmp_path, bbox, category):
+    csv_path = make_csv(tmp_path / "fires.csv")
+    scan = FireHistory(csv_path, chunk_size=256).load(bbox, category)
+    cached = FireHistory(csv_path, store=ColumnStore(str(tmp_path / "store")), chunk_size=256).load(bbox, category)
+
+    assert len(scan) == len(cached)
+    if category == "missing":
+        assert len(scan) == 0
+        return
+    assert len(scan) > 0
+    pd.testing.assert_frame_equal(sort_fires(cached), sort_fires(scan), check_dtype=False)
+
+
+def test_cache_is_rebuilt_when_the_csv_changes(tmp_path):
+    csv_path = make_csv(tmp_path / "fires.csv")
+    history = FireHistory(csv_path, store=ColumnStore(str(tmp_path / "store")), chunk_size=256)
+    bbox = (-125, 30, -100, 49)
+    assert len(history.load(bbox, None)) == 3000 - 50
+    assert history.is_cached()
+
+    make_csv(tmp_path / "fires.csv", n=1000)
+    assert not history.is_cached()
+    assert len(history.load(bbox, None)) == 1000 - 50
+
+
+def test_unparsed_dates_are_reported(tmp_path, capsys):
+    csv_path = make_csv(tmp_path / "fires.csv")
+    fires = FireHistory(csv_path, store=ColumnStore(str(tmp_path / "store")), chunk_size=256).load(
+        (-125, 30, -100, 49), None)
+    assert "Warning: 10 fire discovery dates" in capsys.readouterr().out
+    assert fires['FireDiscoveryDateTime'].isna().sum() == 10
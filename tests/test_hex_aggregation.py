@@ -0,0 +1,84 @@
+import h3.api.numpy_int as h3_int
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.column_store import ColumnStore
+from src.data.hex_aggregation import AGGREGATIONS, HexAggregator, HexTable, cell_parents
+
+RESOLUTIONS = (7, 8, 10)
+
+
+def make_points(n=5000):
+    """
+    Random values around Fort Collins, with some nodata and NaN values
+    """
+    rng = np.random.default_rng(0)
+    x_coords, y_coords = rng.uniform(-105.12, -105.04, n), rng.uniform(40.54, 40.6, n)
+    values = rng.uniform(0, 9, n)
+    values[::97] = -9999
+    values[::89] = np.nan
+    return x_coords, y_coords, values
+
+
+def group_by_cell(cells, values):
+    """
+    Sum, mean, max and count of the values of every cell, one cell at a time
+    """
+    rows = {cell: (values[cells == cell].sum(), values[cells == cell].mean(), values[cells == cell].max(),
+                   (cells == cell).sum()) for cell in np.unique(cells).tolist()}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=list(AGGREGATIONS)).sort_index()
+
+
+def test_levels_roll_up_the_finest_cells():
+    x_coords, y_coords, values = make_points()
+    hex_table = HexAggregator(resolutions=RESOLUTIONS).aggregate(x_coords, y_coords, values)
+    assert hex_table.resolutions == list(RESOLUTIONS)
+    keep = np.isfinite(values) & (values != -9999)
+    finest_cells = np.array([h3_int.geo_to_h3(y, x, 10) for x, y in zip(x_coords[keep], y_coords[keep])],
+                            dtype=np.uint64)
+
+    for resolution in RESOLUTIONS:
+        # Every point is counted in the parent of its finest cell, never indexed again at the coarse resolution
+        parents = cell_parents(finest_cells, resolution)
+        expected = group_by_cell(parents, values[keep])
+        level = hex_table.level(resolution).sort_index()
+        assert np.array_equal(level.index.to_numpy(dtype=np.uint64), expected.index.to_numpy(dtype=np.uint64))
+        assert np.allclose(level.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64))
+        assert np.allclose(level["mean"], level["sum"] / level["count"])
+        assert level["count"].sum() == keep.sum()
+
+    # Coarse cells do not hold the points that lie in them but belong to a fine cell of another parent
+    coarse_cells = np.array([h3_int.geo_to_h3(y, x, 7) for x, y in zip(x_coords[keep], y_coords[keep])],
+                            dtype=np.uint64)
+    assert (coarse_cells != cell_parents(finest_cells, 7)).any()
+
+
+def test_levels_not_in_the_table_are_rolled_up():
+    x_coords, y_coords, values = make_points()
+    hex_table = HexAggregator(resolutions=RESOLUTIONS).aggregate(x_coords, y_coords, values)
+    finest = hex_table.level(10)
+    level_9 = hex_table.level(9)
+    parents = cell_parents(finest.index.to_numpy(dtype=np.uint64), 9)
+    grouped = finest.groupby(parents)
+    assert np.allclose(level_9["sum"], grouped["sum"].sum()) and np.allclose(level_9["max"], grouped["max"].max())
+    assert np.array_equal(level_9["count"], grouped["count"].sum())
+    with pytest.raises(ValueError):
+        hex_table.level(11)
+
+
+def test_lookup_and_store_round_trip(tmp_path):
+    x_coords, y_coords, values = make_points()
+    hex_table = HexAggregator(resolutions=RESOLUTIONS).aggregate(x_coords, y_coords, values)
+    store = ColumnStore(str(tmp_path / "store"))
+    hex_table.save(store)
+    loaded = HexTable.load(store)
+    pd.testing.assert_frame_equal(loaded.table, hex_table.table, check_dtype=False)
+
+    # Cells of every resolution are found in the one sorted table
+    cells = np.concatenate([hex_table.level(resolution).index.to_numpy(dtype=np.uint64)[:5]
+                            for resolution in RESOLUTIONS] + [np.array([0, 2 ** 64 - 1], dtype=np.uint64)])
+    positions = loaded.lookup(cells)
+    assert (positions[-2:] == -1).all()
+    assert np.array_equal(loaded.table["cell"].to_numpy(dtype=np.uint64)[positions[:-2]], cells[:-2])
+    assert store.read_meta("hexagons")["attrs"]["resolutions"] == list(RESOLUTIONS)
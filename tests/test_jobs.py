@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+from server.jobs import JobQueue, QueueFull, read_status, touch_heartbeat, write_status
+
+AOI = {"type": "Polygon", "coordinates": [[[-105.1, 40.55], [-105.05, 40.55], [-105.05, 40.6], [-105.1, 40.6],
+                                           [-105.1, 40.55]]]}
+
+
+def set_status(queue, aoi, status, heartbeat_age=0, **fields):
+    """
+    Writes the status of the job of an area as another server process would, without running it
+    """
+    job_id = queue.job_id(queue.read_aoi(aoi))
+    job_path = os.path.join(queue.jobs_path, job_id)
+    os.makedirs(job_path, exist_ok=True)
+    write_status(job_path, status, **fields)
+    touch_heartbeat(job_path)
+    heartbeat = time.time() - heartbeat_age
+    os.utime(os.path.join(job_path, "heartbeat"), (heartbeat, heartbeat))
+    return job_id
+
+
+def test_identical_submissions_return_the_existing_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs"), data_path=str(tmp_path))
+    feature = {"type": "Feature", "properties": {"name": "aoi"}, "geometry": AOI}
+    collection = {"type": "FeatureCollection", "features": [feature]}
+    job_id = queue.job_id(AOI)
+    assert queue.job_id(queue.read_aoi(feature)) == queue.job_id(queue.read_aoi(collection)) == job_id
+    other = dict(AOI, coordinates=[[[x + 0.01, y] for x, y in AOI["coordinates"][0]]])
+    assert queue.job_id(other) != job_id
+
+    for status in ["queued", "running", "done"]:
+        set_status(queue, AOI, status, outputs=["fire_risk.tif"])
+        for aoi in [AOI, feature, collection]:
+            submitted_id, submitted_status = queue.submit(aoi)
+            assert submitted_id == job_id and submitted_status["status"] == status
+    # Nothing was run, the existing jobs were returned
+    assert queue.executor is None and queue.futures == {}
+    assert queue.output_path(job_id, "fire_risk.tif") == os.path.join(queue.jobs_path, job_id, "fire_risk.tif")
+    assert queue.output_path(job_id, "firerisk.geojson") is None
+
+
+def test_lost_jobs_are_failed_and_submitted_again(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs"), data_path=str(tmp_path), workers=0, max_queued=0)
+    job_id = set_status(queue, AOI, "running", heartbeat_age=120, stage="risk")
+    status = queue.status(job_id)
+    assert status["status"] == "failed" and status["lost"]["stage"] == "risk"
+    assert read_status(os.path.join(queue.jobs_path, job_id))["status"] == "failed"
+    # A failed job is run again, which needs room in the queue
+    with pytest.raises(QueueFull):
+        queue.submit(AOI)
+    assert queue.status("../jobs") is None and queue.status("0" * 32) is None
+
+
+def test_full_queue_responds_503(server_module):
+    server_module.job_queue.workers = 0
+    server_module.job_queue.max_queued = 0
+    client = server_module.app.test_client()
+    response = client.post("/job", json={"aoi": AOI})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "60" and "error" in response.get_json()
+    assert client.post("/job", json={"aoi": {"type": "Point", "coordinates": [0, 0]}}).status_code == 400
+
+    # A finished identical job is returned even when the queue is full
+    job_id = set_status(server_module.job_queue, AOI, "done", outputs=["fire_risk.tif"])
+    response = client.post("/job", json={"aoi": AOI})
+    assert response.status_code == 200 and response.get_json()["id"] == job_id
+    assert client.get(f"/job/{job_id}").get_json()["status"]["status"] == "done"
+    assert client.get("/job/" + "0" * 32).status_code == 404
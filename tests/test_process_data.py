@@ -0,0 +1,82 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.merge import merge
+from rasterio.transform import Affine, from_origin, rowcol, xy
+
+import src.data.tif_data as tif_data
+from src.data.process_data import MakeData
+from src.data.raster_cache import RasterCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RULES = {name: os.path.join(ROOT, "rules", f"{name}_rules.txt") for name in ["temp", "vapr", "prec", "elevation"]}
+
+
+@pytest.mark.parametrize("transform", [from_origin(-105.2, 40.7, 0.001, 0.0008),
+                                       Affine(0.001, 0.0002, -105.2, 0.0001, -0.0008, 40.7)])
+def test_coordinate_grid_is_pixel_centers(transform):
+    width, height = 70, 40
+    x_coords, y_coords = MakeData.make_coordinate_grid(transform, width, height)
+    rows, cols = np.divmod(np.arange(width * height), width)
+    # Row-major order, the center of every pixel as given by rasterio
+    expected_x, expected_y = xy(transform, rows, cols, offset="center")
+    assert np.allclose(x_coords, expected_x, rtol=0, atol=1e-12)
+    assert np.allclose(y_coords, expected_y, rtol=0, atol=1e-12)
+    assert np.array_equal(np.stack(rowcol(transform, x_coords, y_coords)), np.stack([rows, cols]))
+
+    # A window has the coordinates of the same pixels of the full grid
+    window_x, window_y = MakeData.make_coordinate_grid(transform, 20, 10, col_off=30, row_off=25)
+    assert np.array_equal(window_x, x_coords.reshape(height, width)[25:35, 30:50].ravel())
+    assert np.array_equal(window_y, y_coords.reshape(height, width)[25:35, 30:50].ravel())
+
+
+def write_raster(path, data, left, top=40.7, resolution=0.001):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs="EPSG:4326", transform=from_origin(left, top, resolution, resolution),
+                       nodata=-9999) as dest:
+        dest.write(data, 1)
+    return str(path)
+
+
+def make_features(path):
+    """
+    Two tiled merges shared by several features, and a single file feature
+    """
+    rng = np.random.default_rng(0)
+    weather = [write_raster(path / f"weather_{idx}.tif", rng.uniform(0, 30, (100, 100)).astype(np.float32),
+                            -105.2 + idx * 0.1) for idx in range(2)]
+    elevation = [write_raster(path / f"elevation_{idx}.tif", rng.uniform(0, 2500, (100, 100)).astype(np.float32),
+                              -105.2 + idx * 0.1) for idx in range(2)]
+    prec = write_raster(path / "prec.tif", rng.uniform(0, 100, (100, 200)).astype(np.float32), -105.2)
+    coordinate_file = str(path / "aoi.json")
+    with open(coordinate_file, "w") as fp:
+        json.dump({"type": "Polygon", "coordinates": [[[-105.18, 40.62], [-105.02, 40.62], [-105.02, 40.68],
+                                                       [-105.18, 40.68], [-105.18, 40.62]]]}, fp)
+    return coordinate_file, {"temp": (weather, "weather_merged"), "vapr": (weather, "weather_merged"),
+                             "elevation": (elevation, "elevation_merged"), "prec": (prec, None)}
+
+
+@pytest.mark.parametrize("in_memory, cache", [(True, False), (False, False), (True, True)])
+def test_every_merge_name_is_merged_once(tmp_path, monkeypatch, in_memory, cache):
+    coordinate_file, features = make_features(tmp_path)
+    merged = []
+
+    def counting_merge(datasets, *args, **kwargs):
+        merged.append(sorted(os.path.basename(dataset.name) for dataset in datasets))
+        return merge(datasets, *args, **kwargs)
+
+    monkeypatch.setattr(tif_data, "merge", counting_merge)
+    raster_cache = RasterCache(str(tmp_path / "cache")) if cache else None
+    data = MakeData(coordinate_file, str(tmp_path), RULES, feature_set=features, download_files=False,
+                    in_memory=in_memory, raster_cache=raster_cache)
+
+    assert sorted(merged) == [["elevation_0.tif", "elevation_1.tif"], ["weather_0.tif", "weather_1.tif"]]
+    # Features of one merge read the same merged raster
+    temp, vapr = data.input_data["temp"].data, data.input_data["vapr"].data
+    assert temp.shape == vapr.shape == (100, 200)
+    assert np.array_equal(temp.read(1), vapr.read(1))
+    if in_memory and not cache:
+        assert not os.path.exists(tmp_path / "temp" / "weather_merged.tif")
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from src.data.raster_cache import RasterCache
+
+META = {"driver": "GTiff", "width": 64, "height": 64, "count": 1, "dtype": "float32", "crs": "EPSG:4326",
+        "transform": from_origin(-105.2, 40.7, 0.001, 0.001)}
+
+
+def put(cache, key, value):
+    return cache.put_raster(key, np.full((1, 64, 64), value, dtype=np.float32), META, {"operation": "test"})
+
+
+def set_last_used(path, seconds):
+    os.utime(path, ns=(seconds * 10 ** 9, os.stat(path).st_mtime_ns))
+
+
+def test_key_changes_with_inputs_and_params(tmp_path):
+    cache = RasterCache(str(tmp_path / "cache"))
+    source = tmp_path / "dem.tif"
+    source.write_bytes(b"dem")
+    key = cache.make_key("merge", str(source), {"resolution": 30})
+    assert key == cache.make_key("merge", [str(source)], {"resolution": 30})
+    assert key != cache.make_key("merge", str(source), {"resolution": 10})
+    assert key != cache.make_key("reproject", str(source), {"resolution": 30})
+    put(cache, key, 1.0)
+    assert cache.get(key) == cache.get_path(key)
+
+    # A rewritten input file (new size or modification time) never hits the old entry
+    source.write_bytes(b"new dem")
+    new_key = cache.make_key("merge", str(source), {"resolution": 30})
+    assert new_key != key and cache.get(new_key) is None
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.make_key("merge", str(source), {"resolution": 30}) != new_key
+
+
+def test_get_keeps_the_modification_time(tmp_path):
+    cache = RasterCache(str(tmp_path / "cache"))
+    path = put(cache, "a", 1.0)
+    set_last_used(path, 1000)
+    mtime = os.stat(path).st_mtime_ns
+    # Rasters derived from a cached raster use its modification time in their key
+    derived_key = cache.make_key("clip", path)
+    assert cache.get("a") == path
+    assert os.stat(path).st_mtime_ns == mtime and os.stat(path).st_atime > 1000
+    assert cache.make_key("clip", path) == derived_key
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = RasterCache(str(tmp_path / "cache"))
+    paths = {key: put(cache, key, value) for value, key in enumerate(["a", "b", "c"])}
+    for seconds, key in enumerate(["a", "b", "c"]):
+        set_last_used(paths[key], 1000 + seconds)
+    entry_size = os.path.getsize(paths["a"])
+    cache.max_bytes = int(3.5 * entry_size)
+
+    # a is used again, so b is the least recently used entry when d is added
+    cache.get("a")
+    put(cache, "d", 3.0)
+    assert [entry["key"] for entry in cache.entries()] == ["d", "a", "c"]
+    assert not os.path.exists(paths["b"]) and not os.path.exists(paths["b"][:-len(".tif")] + ".json")
+    assert cache.get("b") is None
+    with rasterio.open(cache.get("a")) as src:
+        assert (src.read(1) == 0.0).all()
+    assert cache.entries()[0]["description"]["operation"] == "test"
+
+    # The entry being added is kept even if it alone is larger than the cache
+    cache.max_bytes = 0
+    put(cache, "e", 4.0)
+    assert [entry["key"] for entry in cache.entries()] == ["e"]
+    assert cache.prune() == 1 and cache.size() == 0
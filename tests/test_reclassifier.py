@@ -0,0 +1,56 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from src.data.reclassifier import Reclassifier
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules")
+RULE_FILES = sorted(glob.glob(os.path.join(RULES_PATH, "*_rules.txt")))
+
+
+def legacy_rules(rule_file):
+    """
+    Bins and classes of a rule file as read by MakeData before the Reclassifier
+    """
+    with open(rule_file, 'r') as fp:
+        classifier_rules = [line.strip().replace(" ", "") for line in fp.readlines()]
+    classifier_rules = [line.split("=") for line in classifier_rules if line]
+    classifier = {i + 1: float(rule[1]) for i, rule in enumerate(classifier_rules)}
+    classifier_rules = [line[0].split("to") for line in classifier_rules]
+    bins = [float(classifier_rules[0][0])] + [float(line[1]) for line in classifier_rules]
+    return bins, classifier
+
+
+def legacy_classify(data, bins, classifier):
+    """
+    np.digitize binning of MakeData.classify_data, with every bin mapped to its class once. The old in place loop
+    truncated fractional classes and re-mapped classes equal to later bin numbers, which is not reproduced
+    """
+    codes = np.digitize(data, bins, right=False)
+    return np.array([classifier.get(code, np.nan) for code in codes.tolist()])
+
+
+@pytest.mark.parametrize("rule_file", RULE_FILES, ids=os.path.basename)
+def test_matches_legacy_rules(rule_file):
+    bins, classifier = legacy_rules(rule_file)
+    reclassifier = Reclassifier.from_rule_file(rule_file)
+    low, high = bins[0], bins[-1]
+    margin = (high - low) * 0.1
+    data = np.concatenate([np.random.default_rng(0).uniform(low - margin, high + margin, 20000), bins])
+
+    classified = reclassifier.apply(data)
+    legacy = legacy_classify(data, bins, classifier)
+    inside = (data >= low) & (data < high)
+    assert np.array_equal(classified[inside].astype(np.float64), legacy[inside])
+    # Out of range data was left as the bin number, it is now classified as nodata
+    assert (classified[~inside & (data != high)] == 0).all()
+    # The upper edge of the last rule is included, e.g. an aspect of 360 degrees
+    assert classified[data == high][0] == classifier[max(k for k in classifier if bins[k] > bins[k - 1])]
+
+
+def test_nodata_and_nan():
+    reclassifier = Reclassifier.from_rule_file(os.path.join(RULES_PATH, "elevation_rules.txt"))
+    classified = reclassifier.apply(np.array([-9999.0, np.nan, 250.0]))
+    assert classified.tolist() == [0, 0, 2]
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.region_reduction import RegionReducer
+
+
+def make_points(n=5000):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-121, -120, n)
+    y = rng.uniform(39, 39.5, n)
+    values = rng.uniform(0, 9, n)
+    # The corners of the extent are high risk, so a threshold does not change the extent
+    x[:2], y[:2], values[:2] = [-121.0, -120.0], [39.0, 39.5], [9.0, 9.0]
+    values[2:12] = -9999
+    values[12:14] = np.nan
+    return x, y, values
+
+
+def brute_force(x, y, values, columns, rows, top_k, threshold):
+    """
+    Filters the points of every region one by one
+    """
+    valid = np.isfinite(values) & (values != -9999)
+    left, bottom, right, top = x[valid].min(), y[valid].min(), x[valid].max(), y[valid].max()
+    width, height = (right - left) / columns, (top - bottom) / rows
+    regions, points = [], []
+    for cell_x in range(columns):
+        for cell_y in range(rows):
+            in_x = (x >= left + cell_x * width) & ((x < left + (cell_x + 1) * width) | (cell_x == columns - 1))
+            in_y = (y >= bottom + cell_y * height) & ((y < bottom + (cell_y + 1) * height) | (cell_y == rows - 1))
+            keep = valid & in_x & in_y
+            if threshold is not None:
+                keep &= values > threshold
+            if not keep.any():
+                continue
+            region = values[keep]
+            regions.append((cell_x, cell_y, region.sum(), len(region), region.mean(), region.max()))
+            order = np.argsort(-region, kind="stable")[:top_k]
+            points.extend((x[keep][idx], y[keep][idx], region[idx], cell_x, cell_y, rank, region.sum())
+                          for rank, idx in enumerate(order))
+    return (pd.DataFrame(regions, columns=["cell_x", "cell_y", "sum", "count", "mean", "max"]),
+            pd.DataFrame(points, columns=["x", "y", "fire_risk", "cell_x", "cell_y", "rank", "subSum"]))
+
+
+@pytest.mark.parametrize("cells, top_k, threshold", [(10, 10, 4.9), ((7, 3), None, None), (1, 5, 8.0)])
+def test_matches_brute_force(cells, top_k, threshold):
+    x, y, values = make_points()
+    regions, points = RegionReducer(cells=cells, top_k=top_k, threshold=threshold).reduce(x, y, values)
+    columns, rows = (cells, cells) if np.isscalar(cells) else cells
+    expected_regions, expected_points = brute_force(x, y, values, columns, rows, top_k, threshold)
+
+    regions = regions.sort_values(["cell_x", "cell_y"], ignore_index=True)
+    pd.testing.assert_frame_equal(regions, expected_regions, check_dtype=False)
+    sort_columns = ["cell_x", "cell_y", "rank"]
+    pd.testing.assert_frame_equal(points.sort_values(sort_columns, ignore_index=True),
+                                  expected_points.sort_values(sort_columns, ignore_index=True), check_dtype=False)
+
+
+def test_matches_reducepoints_inside_the_grid():
+    """
+    The old reducepoints.py skipped the last row and column of regions and points on region borders (the corner
+    point of the first region), the other points have the same region sums
+    """
+    x, y, values = make_points()
+    data = pd.DataFrame({"x": x, "y": y, "fire_risk": values})
+    # RegionReducer drops nodata points, reducepoints.py is run without them
+    data = data[np.isfinite(values) & (values != -9999)]
+    degree = 10
+    incx = abs(abs(data["x"].min()) - abs(data["x"].max())) / degree
+    incy = abs(abs(data["y"].max()) - abs(data["y"].min())) / degree
+    data = data[data["fire_risk"] > 4.9]
+    final = []
+    for cell_x in range(degree - 1):
+        for cell_y in range(degree - 1):
+            temp = data[data["x"] > (data["x"].min() + incx * cell_x)]
+            temp = temp[temp["x"] < (data["x"].min() + incx * (cell_x + 1))]
+            temp = temp[temp["y"] > (data["y"].min() + incy * cell_y)]
+            temp = temp[temp["y"] < (data["y"].min() + incy * (cell_y + 1))]
+            if cell_x or cell_y:
+                final.append(temp.assign(subSum=temp["fire_risk"].sum()))
+    final = pd.concat(final).sort_values(["x", "y"], ignore_index=True)
+
+    _, points = RegionReducer(cells=degree, top_k=None, threshold=4.9).reduce(x, y, values)
+    points = points[(points["cell_x"] < degree - 1) & (points["cell_y"] < degree - 1) &
+                    ((points["cell_x"] > 0) | (points["cell_y"] > 0))]
+    points = points.sort_values(["x", "y"], ignore_index=True)
+    assert len(points) == len(final) > 0
+    assert np.allclose(points["fire_risk"], final["fire_risk"])
+    assert np.allclose(points["subSum"], final["subSum"])
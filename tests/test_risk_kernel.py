@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data.reclassifier import Reclassifier
+from src.data.risk_kernel import ND_BANDS, RiskKernel
+from src.rules import RULE_LIST
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_FEATURES = ["temp", "vapr", "wind", "prec", "aspect", "slope", "elevation"]
+LANDSAT_BANDS = ["B3", "B4", "B5", "B6"]
+
+
+def make_reclassifiers():
+    return {name: Reclassifier.from_rule_file(os.path.join(ROOT, rule_file), name=name)
+            for name, rule_file in RULE_LIST.items()}
+
+
+def make_stack(reclassifiers, height=300, width=200):
+    """
+    Raw feature rasters spanning the rule ranges and a little beyond, with nodata, NaN and zero Landsat pixels
+    """
+    rng = np.random.default_rng(0)
+    stack = []
+    for name in RAW_FEATURES:
+        edges = reclassifiers[name].edges
+        margin = (edges[-1] - edges[0]) * 0.05
+        stack.append(rng.uniform(edges[0] - margin, edges[-1] + margin, (height, width)))
+    for _ in LANDSAT_BANDS:
+        stack.append(rng.uniform(0, 1, (height, width)))
+    stack = np.stack(stack).astype(np.float32)
+    stack[0, :10] = -9999
+    stack[1, 10:20] = np.nan
+    stack[-4:, 20:30, :50] = 0
+    return stack
+
+
+def legacy_risk(stack, reclassifiers):
+    """
+    Fire risk of the pandas path MakeData used before RiskKernel: ND features and classification on a DataFrame, then
+    the hardcoded weighted sum
+    """
+    pd_data = pd.DataFrame({name: stack[idx].ravel().astype(np.float64)
+                            for idx, name in enumerate(RAW_FEATURES + LANDSAT_BANDS)})
+    pd_data.fillna(-9999, inplace=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pd_data["ndvi"] = (pd_data["B5"] - pd_data["B4"]) / (pd_data["B5"] + pd_data["B4"])
+        pd_data["ndmi"] = (pd_data["B5"] - pd_data["B6"]) / (pd_data["B5"] + pd_data["B6"])
+        pd_data["ndwi"] = (pd_data["B3"] - pd_data["B6"]) / (pd_data["B3"] + pd_data["B6"])
+    pd_data.drop(columns=LANDSAT_BANDS, inplace=True)
+    pd_data.fillna(-9999, inplace=True)
+    features = pd_data.copy()
+    for name, reclassifier in reclassifiers.items():
+        pd_data[name] = reclassifier.apply(pd_data[name].to_numpy())
+    fire_risk = 0.12 * pd_data['aspect'] + 0.0751 * pd_data['elevation'] + \
+        0.03 * pd_data['vapr'] + 0.251 * pd_data['ndvi'] + \
+        0.125 * pd_data['ndmi'] + 0.125 * pd_data['ndwi'] + \
+        0.024 * pd_data['prec'] + 0.0749 * pd_data['slope'] + \
+        0.154 * pd_data['temp'] + 0.021 * pd_data['wind']
+    return fire_risk.to_numpy().reshape(stack.shape[1:]), features
+
+
+def test_matches_legacy_pandas_risk():
+    reclassifiers = make_reclassifiers()
+    stack = make_stack(reclassifiers)
+    legacy, features = legacy_risk(stack, reclassifiers)
+    risk = RiskKernel(reclassifiers).compute(stack, RAW_FEATURES + LANDSAT_BANDS, chunk_rows=64)
+
+    assert risk.dtype == np.float32
+    # ND features are computed in float32 by the kernel, pixels within rounding of a bin edge can change class
+    near_edge = np.zeros(stack.shape[1:], dtype=bool)
+    for name in ND_BANDS:
+        values = features[name].to_numpy().reshape(stack.shape[1:])
+        distance = np.abs(values[..., None] - reclassifiers[name].edges).min(axis=-1)
+        near_edge |= distance < 1e-6
+    assert near_edge.mean() < 0.001
+    assert np.allclose(risk[~near_edge], legacy[~near_edge], rtol=0, atol=1e-5)
+
+
+def test_chunking_does_not_change_risk():
+    reclassifiers = make_reclassifiers()
+    stack = make_stack(reclassifiers, height=100, width=50)
+    kernel = RiskKernel(reclassifiers)
+    names = RAW_FEATURES + LANDSAT_BANDS
+    assert np.array_equal(kernel.compute(stack, names, chunk_rows=7), kernel.compute(stack, names, chunk_rows=100))
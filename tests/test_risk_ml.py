@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rasterio.transform import from_origin
+
+from src.data.column_store import ColumnStore
+from src.data.raster_cache import RasterCache
+from src.firerisk_ml.risk_ml import FEATURE_COLUMNS, RiskAssesmentML
+
+TRANSFORM = from_origin(-105.2, 40.7, 0.001, 0.001)
+WIDTH, HEIGHT = 200, 100
+
+
+def make_store(path):
+    """
+    Writes a "data" stage of a 200 x 100 feature grid with -9999 and 99999 sentinels, as MakeData does
+    """
+    rng = np.random.default_rng(0)
+    cols, rows = np.meshgrid(np.arange(WIDTH), np.arange(HEIGHT))
+    x, y = TRANSFORM * (cols.ravel() + 0.5, rows.ravel() + 0.5)
+    data = {"x": x, "y": y}
+    for name in FEATURE_COLUMNS:
+        values = rng.uniform(0, 100, WIDTH * HEIGHT)
+        values[rng.choice(len(values), 300, replace=False)] = -9999
+        values[rng.choice(len(values), 50, replace=False)] = 99999
+        data[name] = values
+    store = ColumnStore(str(path / "store"))
+    inputs = RasterCache.input_versions({}, {}, weather=True)
+    store.write("data", data, attrs={"coordinate_file": "aoi.json", "inputs": inputs, "transform": list(TRANSFORM),
+                                     "width": WIDTH, "height": HEIGHT})
+    return store, pd.DataFrame(data)
+
+
+def make_fires(path, n=4000):
+    """
+    Writes a fire history csv with fires on the grid, several on some pixels, and fires outside the grid
+    """
+    rng = np.random.default_rng(1)
+    x = rng.uniform(-105.2, -105.2 + WIDTH * 0.001, n)
+    y = rng.uniform(40.7 - HEIGHT * 0.001, 40.7, n)
+    x[:100] += 1.0
+    fires = pd.DataFrame({"X": x, "Y": y, "FireCause": "Human", "FireDiscoveryDateTime": "2020/07/01 12:00:00+00",
+                          "DailyAcres": 1.0, "CalculatedAcres": 1.0, "IncidentTypeCategory": "WF"})
+    fires.to_csv(path / "fires.csv", index=False)
+    return str(path / "fires.csv")
+
+
+def make_ml(path, sample_frac, random_state=0):
+    store, feature_input = make_store(path)
+    ml = RiskAssesmentML(make_fires(path), "aoi.json", str(path), {}, sample_frac=sample_frac, feature_store=store,
+                         random_state=random_state)
+    return ml, feature_input
+
+
+def legacy_clean(ml_data):
+    """
+    Sentinel removal of the old column by column loop
+    """
+    for column in ml_data:
+        if ml_data[column].dtypes == 'float64':
+            ml_data = ml_data.drop(ml_data[ml_data[column] <= -9999].index)
+            ml_data = ml_data.drop(ml_data[ml_data[column] >= 99999].index)
+    return ml_data
+
+
+@pytest.fixture(autouse=True)
+def ambee_cache_in_tmp(tmp_path, monkeypatch):
+    # RiskAssesmentML opens the Ambee cache in data/ of the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+
+@pytest.mark.parametrize("random_state", [0, 1, 2])
+def test_negatives_never_include_positives(tmp_path, random_state):
+    ml, feature_input = make_ml(tmp_path, sample_frac=0.5, random_state=random_state)
+    ml_data = ml._RiskAssesmentML__combine_and_clean_data()
+
+    positive_idxs = ml.grid_index.query(ml.fire_data["X"], ml.fire_data["Y"])
+    positive_idxs = np.unique(positive_idxs[positive_idxs >= 0])
+    # Most of the grid has a fire, so a sample that ignored them would draw many
+    assert len(positive_idxs) > 0.1 * len(feature_input)
+    # Grid positions of the training rows, found from their coordinates
+    index = pd.Series(np.arange(len(feature_input)), index=pd.MultiIndex.from_frame(feature_input[["x", "y"]]))
+    rows = index.loc[list(zip(ml_data["x"], ml_data["y"]))].to_numpy()
+    fire = ml_data["fire"].to_numpy()
+    assert (fire == 0).any() and np.isin(rows[fire == 1], positive_idxs).all()
+    assert not np.isin(rows[fire == 0], positive_idxs).any()
+    assert len(np.unique(rows[fire == 0])) == (fire == 0).sum()
+
+
+def test_validity_mask_drops_the_same_rows_as_before(tmp_path):
+    # With sample_frac 1 every point without a fire is a negative, the rows before cleaning do not depend on the seed
+    ml, feature_input = make_ml(tmp_path, sample_frac=1.0)
+    ml_data = ml._RiskAssesmentML__combine_and_clean_data()
+
+    positive_idxs = ml.grid_index.query(ml.fire_data["X"], ml.fire_data["Y"])
+    positive_idxs = positive_idxs[positive_idxs >= 0]
+    negative_idxs = np.setdiff1d(np.arange(len(feature_input)), positive_idxs)
+    expected = pd.concat([feature_input.iloc[positive_idxs].assign(fire=1),
+                          feature_input.iloc[negative_idxs].assign(fire=0)], ignore_index=True)
+    expected = legacy_clean(expected).reset_index(drop=True)
+
+    assert len(ml_data) < len(feature_input) + len(positive_idxs)
+    pd.testing.assert_frame_equal(ml_data[expected.columns], expected, check_dtype=False)
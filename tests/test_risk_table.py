@@ -0,0 +1,72 @@
+import os
+
+import h3
+import numpy as np
+
+from server.risk_table import RiskTable
+from src.data.column_store import ColumnStore
+from src.data.hex_aggregation import HexAggregator
+
+
+def publish(store_path, values, resolutions=(7, 9)):
+    """
+    Aggregates points around Fort Collins with the given values and writes the hexagons stage
+    """
+    rng = np.random.default_rng(0)
+    longitude, latitude = rng.uniform(-105.1, -105.05, len(values)), rng.uniform(40.55, 40.6, len(values))
+    hex_table = HexAggregator(resolutions=resolutions).aggregate(longitude, latitude, values)
+    hex_table.save(ColumnStore(store_path))
+    return hex_table
+
+
+def test_parent_fallback(tmp_path):
+    store_path = str(tmp_path / "store")
+    hex_table = publish(store_path, np.random.default_rng(1).uniform(0, 9, 2000))
+    table = RiskTable(store_path, check_interval=0)
+    fine, coarse = hex_table.level(9), hex_table.level(7)
+
+    cell = int(fine.index[0])
+    parent = h3.string_to_h3(h3.h3_to_parent(h3.h3_to_string(cell), 7))
+    # A res 9 cell without points falls back to its res 7 parent
+    sibling = next(child for child in h3.h3_to_children(h3.h3_to_string(parent), 9)
+                   if h3.string_to_h3(child) not in fine.index)
+    grandchild = h3.string_to_h3(h3.h3_to_children(h3.h3_to_string(cell), 11).pop())
+    outside = h3.string_to_h3(h3.geo_to_h3(0.0, 0.0, 9))
+    cells = np.array([cell, grandchild, h3.string_to_h3(sibling), parent, outside, 0], dtype=np.uint64)
+
+    risk, found = table.lookup(cells)
+    expected = [fine["mean"][cell], fine["mean"][cell], coarse["mean"][parent], coarse["mean"][parent]]
+    assert np.allclose(risk[:4], expected) and np.isnan(risk[4:]).all()
+    assert found.tolist() == [9, 9, 7, 7, -1, -1]
+    for idx, lookup_cell in enumerate(cells[:5].tolist()):
+        value, resolution = table.lookup_cell(lookup_cell)
+        assert resolution == found[idx]
+        assert (value is None) if resolution == -1 else np.isclose(value, risk[idx])
+    assert table.parse_cells([h3.h3_to_string(cell), str(cell), "zzz", None, 1234]).tolist() == [cell, 0, 0, 0, 0]
+
+
+def test_hot_reload(tmp_path):
+    store_path = str(tmp_path / "store")
+    # No table is published yet
+    table = RiskTable(store_path, check_interval=0)
+    assert table.lookup_cell(h3.string_to_h3(h3.geo_to_h3(40.57, -105.07, 9))) == (None, -1)
+
+    hex_table = publish(store_path, np.full(2000, 2.0))
+    cells = hex_table.level(9).index.to_numpy(dtype=np.uint64)
+    assert np.allclose(table.lookup(cells)[0], 2.0)
+
+    # A new run is published, the sidecar is the version of the stage
+    publish(store_path, np.full(2000, 5.0))
+    meta_file = os.path.join(store_path, "hexagons.json")
+    stat = os.stat(meta_file)
+    os.utime(meta_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert np.allclose(table.lookup(cells)[0], 5.0)
+    assert not table.reload()
+
+    # Reloads are checked at most every check_interval seconds
+    slow_table = RiskTable(store_path, check_interval=3600)
+    publish(store_path, np.full(2000, 7.0))
+    os.utime(meta_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert np.allclose(slow_table.lookup(cells)[0], 5.0)
+    assert slow_table.reload()
+    assert np.allclose(slow_table.lookup(cells)[0], 7.0)
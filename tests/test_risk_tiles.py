@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.features import bounds
+from rasterio.transform import from_origin
+
+import src.run_risk_tiles as run_risk_tiles
+from src.run_risk_tiles import mosaic_tiles, run_tiles, split_aoi
+
+AOI = {"type": "Polygon", "coordinates": [[[-105.2, 40.5], [-104.9, 40.5], [-104.9, 40.7], [-105.2, 40.7],
+                                          [-105.2, 40.5]]]}
+
+
+def count_attempt(tile_path):
+    os.makedirs(tile_path, exist_ok=True)
+    with open(os.path.join(tile_path, "attempts"), "a") as fp:
+        fp.write("x")
+    return os.path.getsize(os.path.join(tile_path, "attempts"))
+
+
+def failing_run_tile(tile_shape, tile_path, *args):
+    """
+    Stands in for run_tile in the worker processes, tile_1 always fails
+    """
+    count_attempt(tile_path)
+    if os.path.basename(tile_path) == "tile_1":
+        raise RuntimeError("tile 1 always fails")
+    return os.path.join(tile_path, "fire_risk.tif")
+
+
+def crashing_run_tile(tile_shape, tile_path, *args):
+    """
+    Stands in for run_tile in the worker processes, tile_2 kills its worker process on the first attempt
+    """
+    if count_attempt(tile_path) == 1 and os.path.basename(tile_path) == "tile_2":
+        os._exit(1)
+    return os.path.join(tile_path, "fire_risk.tif")
+
+
+def attempts(tile_root, idx):
+    return os.path.getsize(os.path.join(tile_root, f"tile_{idx}", "attempts"))
+
+
+@pytest.mark.parametrize("n_x, n_y, overlap", [(3, 3, 0.01), (4, 1, 0.0), (2, 5, 0.015)])
+def test_split_aoi_covers_the_area_with_overlap(n_x, n_y, overlap):
+    tiles = split_aoi([AOI], n_x, n_y, overlap)
+    assert len(tiles) == n_x * n_y
+    tile_bounds = np.array([bounds(tile) for tile in tiles])
+    # Tiles never reach outside the bounding box of the area, and cover all of it
+    assert (tile_bounds[:, :2] >= [-105.2, 40.5]).all() and (tile_bounds[:, 2:] <= [-104.9, 40.7]).all()
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-105.2, -104.9, 2000), rng.uniform(40.5, 40.7, 2000)
+    covered = (x[:, None] >= tile_bounds[:, 0]) & (y[:, None] >= tile_bounds[:, 1]) & \
+        (x[:, None] <= tile_bounds[:, 2]) & (y[:, None] <= tile_bounds[:, 3])
+    assert covered.any(axis=1).all()
+
+    # Neighbouring tiles share a strip of 2 * overlap around their common edge
+    x_edges, y_edges = np.linspace(-105.2, -104.9, n_x + 1), np.linspace(40.5, 40.7, n_y + 1)
+    for i in range(n_x):
+        for j in range(n_y):
+            left, bottom, right, top = tile_bounds[i * n_y + j]
+            assert left == pytest.approx(max(x_edges[i] - overlap, -105.2))
+            assert right == pytest.approx(min(x_edges[i + 1] + overlap, -104.9))
+            assert bottom == pytest.approx(max(y_edges[j] - overlap, 40.5))
+            assert top == pytest.approx(min(y_edges[j + 1] + overlap, 40.7))
+            if i + 1 < n_x:
+                assert right - tile_bounds[(i + 1) * n_y + j][0] == pytest.approx(2 * overlap)
+            if j + 1 < n_y:
+                assert top - tile_bounds[i * n_y + j + 1][1] == pytest.approx(2 * overlap)
+
+
+def test_tile_failing_every_retry(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_risk_tiles, "run_tile", failing_run_tile)
+    tile_root = str(tmp_path / "tiles")
+    outputs, failed = run_tiles(split_aoi([AOI], 2, 2), tile_root, {}, {}, workers=2, retries=2)
+
+    assert failed == [1]
+    assert attempts(tile_root, 1) == 3
+    assert outputs == [os.path.join(tile_root, f"tile_{idx}", "fire_risk.tif") for idx in [0, 2, 3]]
+
+
+def test_dead_worker_restarts_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_risk_tiles, "run_tile", crashing_run_tile)
+    tile_root = str(tmp_path / "tiles")
+    outputs, failed = run_tiles(split_aoi([AOI], 2, 2), tile_root, {}, {}, workers=2, retries=1)
+
+    # The dead worker broke the pool, its tiles and tiles submitted after it are run again on a new pool
+    assert failed == []
+    assert attempts(tile_root, 2) == 2
+    assert outputs == [os.path.join(tile_root, f"tile_{idx}", "fire_risk.tif") for idx in range(4)]
+
+
+def write_tile(path, data, left, top, resolution=0.001):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs="EPSG:4326", transform=from_origin(left, top, resolution, resolution),
+                       nodata=-9999) as dest:
+        dest.write(data, 1)
+    return str(path)
+
+
+@pytest.mark.parametrize("cog", [True, False])
+def test_mosaic_tiles_keeps_float32_and_nodata(tmp_path, cog):
+    # Two tiles with fractional risks overlapping on columns 120 to 180, the first has nodata in half of the overlap
+    west = np.full((200, 180), 2.25, dtype=np.float32)
+    west[:, 150:] = -9999
+    east = np.full((200, 180), 7.75, dtype=np.float32)
+    tile_files = [write_tile(tmp_path / "west.tif", west, -105.2, 40.7),
+                  write_tile(tmp_path / "east.tif", east, -105.08, 40.7)]
+    shapes = [{"type": "Polygon", "coordinates": [[[-105.15, 40.55], [-104.95, 40.55], [-104.95, 40.65],
+                                                   [-105.15, 40.65], [-105.15, 40.55]]]}]
+    output_name = str(tmp_path / "fire_risk.tif")
+    mosaic_tiles(tile_files, shapes, output_name=output_name, geojson_name=None, cog=cog)
+
+    with rasterio.open(output_name) as src:
+        assert src.dtypes[0] == "float32" and src.nodata == -9999
+        fire_risk = src.read(1)
+        assert src.transform.almost_equals(from_origin(-105.2, 40.7, 0.001, 0.001))
+    assert fire_risk.shape == (200, 300)
+    # Outside the area shape is nodata, inside the values of the tiles are kept with their fractions
+    assert (fire_risk[:50] == -9999).all() and (fire_risk[:, :50] == -9999).all()
+    inside = fire_risk[60:140]
+    assert set(np.unique(inside[:, 60:240]).tolist()) == {2.25, 7.75}
+    # The overlap comes from the first tile with data
+    assert (inside[:, 60:150] == 2.25).all() and (inside[:, 150:240] == 7.75).all()
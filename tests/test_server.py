@@ -0,0 +1,103 @@
+import h3
+import numpy as np
+import pytest
+
+from src.data.column_store import ColumnStore
+from src.data.hex_aggregation import HexAggregator
+
+# Latitude (x) and longitude (y) around Fort Collins, as in the /point and /id routes
+COORDS = [[40.58, -105.08], [40.59, -105.07], [40.6, -105.1]]
+INVALID_BODIES = [
+    {"x": [[1, 2]], "y": [[3, 4]], "res": 7},
+    {"x": [40.5, float("nan")], "y": [-105.0, -105.1], "res": 7},
+    {"x": [40.5, 40.6], "y": [-105.0], "res": 7},
+    {"x": [40.5], "y": ["-105.0"], "res": 7},
+    {"x": [None], "y": [-105.0], "res": 7},
+    {"coords": [[40.5, -105.0, 1.0]], "res": 7},
+    {"coords": [[40.5, -105.0], [40.6]], "res": 7},
+    {"coords": [[91.0, -105.0]], "res": 7},
+    {"coords": [[40.5, -181.0]], "res": 7},
+    {"coords": COORDS, "res": 16},
+    {"coords": COORDS, "res": 7.5},
+    {"coords": COORDS, "res": [7]},
+    {"coords": COORDS},
+    {"res": 7},
+    [COORDS],
+]
+
+
+@pytest.fixture
+def client(server_module):
+    return server_module.app.test_client()
+
+
+@pytest.mark.parametrize("route", ["/points", "/ids"])
+@pytest.mark.parametrize("body", [{"coords": COORDS, "res": 9},
+                                  {"x": [x for x, _ in COORDS], "y": [y for _, y in COORDS], "res": 9}])
+def test_batch_matches_single_routes(client, route, body):
+    response = client.post(route, json=body)
+    assert response.status_code == 200
+    ids = [h3.geo_to_h3(x, y, 9) for x, y in COORDS]
+    assert response.get_json()["ids"] == ids
+    assert [client.get(f"/id/{x}/{y}/9").get_data(as_text=True) for x, y in COORDS] == ids
+    if route == "/points":
+        boundaries = response.get_json()["boundaries"]
+        assert set(boundaries) == set(ids)
+        assert boundaries[ids[0]] == [list(vertex) for vertex in h3.h3_to_geo_boundary(ids[0], geo_json=True)]
+
+
+@pytest.mark.parametrize("route", ["/points", "/ids"])
+@pytest.mark.parametrize("body", INVALID_BODIES)
+def test_invalid_coordinates_are_refused(client, route, body):
+    response = client.post(route, json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_nan_coordinates_in_json_are_refused(client):
+    # Python's json module reads NaN, which Flask accepts in request bodies
+    response = client.post("/ids", data='{"x": [NaN], "y": [-105.0], "res": 7}', content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_empty_batches(client):
+    assert client.post("/ids", json={"coords": [], "res": 7}).get_json() == {"ids": []}
+    assert client.post("/points", json={"x": [], "y": [], "res": 7}).get_json() == {"ids": [], "boundaries": {}}
+
+
+def test_boundaries(client):
+    cell_ids = [h3.geo_to_h3(x, y, 8) for x, y in COORDS]
+    response = client.post("/boundaries", json={"ids": cell_ids + cell_ids[:1]})
+    assert response.status_code == 200
+    boundaries = response.get_json()["boundaries"]
+    assert set(boundaries) == set(cell_ids)
+    for cell_id, boundary in boundaries.items():
+        assert boundary[0] == boundary[-1]
+        assert boundary == [list(vertex) for vertex in h3.h3_to_geo_boundary(cell_id, geo_json=True)]
+
+    assert client.post("/boundaries", json={"ids": ["not a cell"]}).status_code == 400
+    assert client.post("/boundaries", json={"ids": [1234]}).status_code == 400
+    assert client.post("/boundaries", json=[cell_ids]).status_code == 400
+
+
+def test_values(client, server_module, tmp_path):
+    rng = np.random.default_rng(0)
+    longitude, latitude = rng.uniform(-105.1, -105.05, 2000), rng.uniform(40.55, 40.6, 2000)
+    hex_table = HexAggregator(resolutions=(7, 9)).aggregate(longitude, latitude, rng.uniform(0, 9, 2000))
+    hex_table.save(ColumnStore(str(tmp_path / "store")))
+    server_module.risk_table.reload()
+
+    level = hex_table.level(9)
+    cell = h3.h3_to_string(int(level.index[0]))
+    # A child of a table cell falls back to its parent, a cell far from the points has no risk
+    child = h3.h3_to_children(cell, 11).pop()
+    outside = h3.geo_to_h3(0.0, 0.0, 9)
+    response = client.post("/values", json={"ids": [cell, child, outside, "not a cell"]})
+    assert response.status_code == 200
+    risk = level["mean"].iloc[0]
+    values = response.get_json()["values"]
+    assert values[0] == pytest.approx(risk) and values[1] == pytest.approx(risk)
+    assert values[2] is None and values[3] is None
+    assert client.get(f"/value/{cell}").get_data(as_text=True) == str(float(risk))
+
+    assert client.post("/values", json={"ids": "not a list"}).status_code == 400
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+
+from src.data.process_data import MakeData
+from src.firerisk_ml.spatial_index import GridIndex
+
+TRANSFORM = from_origin(-105.2, 40.7, 0.001, 0.001)
+WIDTH, HEIGHT = 120, 80
+
+
+def brute_force(x_coords, y_coords, points_x, points_y, max_distance=None):
+    """
+    Closest feature point of every point by comparing all distances
+    """
+    dist = np.hypot(points_x[:, None] - x_coords, points_y[:, None] - y_coords)
+    idxs = dist.argmin(axis=1)
+    if max_distance is not None:
+        idxs[dist.min(axis=1) > max_distance] = -1
+    return idxs
+
+
+def make_points(n=3000):
+    rng = np.random.default_rng(0)
+    # Points inside the grid, away from pixel edges where the closest center is ambiguous
+    cols, rows = rng.integers(0, WIDTH, n), rng.integers(0, HEIGHT, n)
+    offsets = rng.uniform(0.05, 0.95, (2, n))
+    return TRANSFORM * (cols + offsets[0], rows + offsets[1])
+
+
+@pytest.mark.parametrize("use_transform", [True, False])
+@pytest.mark.parametrize("max_distance", [None, 0.0004])
+def test_matches_brute_force(use_transform, max_distance):
+    x_coords, y_coords = MakeData.make_coordinate_grid(TRANSFORM, WIDTH, HEIGHT)
+    index = GridIndex(x_coords, y_coords, *((TRANSFORM, WIDTH, HEIGHT) if use_transform else ()))
+    assert (index.tree is None) == use_transform
+    points_x, points_y = make_points()
+
+    idxs = index.query(points_x, points_y, max_distance=max_distance)
+    expected = brute_force(x_coords, y_coords, points_x, points_y, max_distance)
+    assert np.array_equal(idxs, expected)
+    if max_distance is not None:
+        # Corners of the pixels are further than 0.0004 degrees from the center, so some points are rejected
+        assert 0 < (idxs == -1).sum() < len(idxs)
+
+
+def test_max_distance_rejects_far_points():
+    x_coords, y_coords = MakeData.make_coordinate_grid(TRANSFORM, WIDTH, HEIGHT)
+    # On a pixel center, 0.3 pixels from it, and outside the grid
+    points_x = np.array([x_coords[0], x_coords[0] + 0.0003, -105.3])
+    points_y = np.array([y_coords[0], y_coords[0], 40.6504])
+    for index in [GridIndex(x_coords, y_coords, TRANSFORM, WIDTH, HEIGHT), GridIndex(x_coords, y_coords)]:
+        assert index.query(points_x, points_y, max_distance=0.0002).tolist() == [0, -1, -1]
+        assert index.query(points_x, points_y, max_distance=0.0005)[:2].tolist() == [0, 0]
+    # Without a transform the outside point is matched to the closest edge pixel unless it is too far
+    assert GridIndex(x_coords, y_coords).query(points_x, points_y)[2] == 49 * WIDTH
+    assert GridIndex(x_coords, y_coords, TRANSFORM, WIDTH, HEIGHT).query(points_x, points_y)[2] == -1
@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+from rasterio.transform import from_origin
+
+from server.tiles import TileRenderer
+from src.data.cog_writer import CogWriter
+
+
+def make_cog(path, dtype):
+    """
+    Writes a 512 x 512 fire risk COG around Fort Collins with a nodata border
+    """
+    risk = np.tile(np.linspace(0, 9, 512, dtype=np.float32), (512, 1))
+    risk[:16] = -9999
+    meta = {"crs": "EPSG:4326", "transform": from_origin(-105.2, 40.7, 0.0005, 0.0005)}
+    CogWriter(str(path), dtype=dtype, blocksize=256).write(risk, meta)
+    return str(path)
+
+
+def render(path):
+    # Zoom 12 tile over the raster
+    png, version = TileRenderer(path).get_tile(12, 852, 1541)
+    return np.asarray(Image.open(io.BytesIO(png))), version
+
+
+@pytest.mark.parametrize("dtype", ["float32", "uint8"])
+def test_render_cog(tmp_path, dtype):
+    rgba, version = render(make_cog(tmp_path / f"fire_risk_{dtype}.tif", dtype))
+    assert version is not None
+    assert rgba.shape == (256, 256, 4)
+    assert (rgba[..., 3] == 255).any()
+    # Low risk on the west side of the raster is lighter than high risk on the east side
+    opaque_cols = np.flatnonzero((rgba[..., 3] == 255).any(axis=0))
+    west, east = rgba[:, opaque_cols[0], :3], rgba[:, opaque_cols[-1], :3]
+    assert west[rgba[:, opaque_cols[0], 3] == 255].astype(int).sum() > \
+        east[rgba[:, opaque_cols[-1], 3] == 255].astype(int).sum()
+
+
+def test_float32_and_uint8_match(tmp_path):
+    float_rgba, _ = render(make_cog(tmp_path / "float32.tif", "float32"))
+    uint8_rgba, _ = render(make_cog(tmp_path / "uint8.tif", "uint8"))
+    np.testing.assert_array_equal(float_rgba[..., 3], uint8_rgba[..., 3])
+    # Quantization changes the risk by at most half a step of 9 / 254, a few colors of the 256 color table
+    assert np.abs(float_rgba.astype(int) - uint8_rgba.astype(int)).max() <= 8
+
+
+def test_tile_outside_raster_is_empty(tmp_path):
+    make_cog(tmp_path / "fire_risk.tif", "uint8")
+    png, _ = TileRenderer(str(tmp_path / "fire_risk.tif")).get_tile(12, 0, 0)
+    assert (np.asarray(Image.open(io.BytesIO(png)))[..., 3] == 0).all()
+
+
+def test_missing_raster_and_invalid_tile(tmp_path):
+    renderer = TileRenderer(str(tmp_path / "missing.tif"))
+    png, version = renderer.get_tile(0, 0, 0)
+    assert version is None and png == renderer.empty_tile
+    with pytest.raises(ValueError):
+        renderer.get_tile(1, 2, 0)
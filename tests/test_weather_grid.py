@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+
+from src.data.weather_grid import WeatherGrid
+
+
+def make_grid(width=300, height=200):
+    """
+    Weather grid with a sampled lattice of smooth temperatures, some nodes without data
+    """
+    grid = WeatherGrid(None, from_origin(-105.2, 40.7, 0.001, 0.001), width, height, resolution=0.02, method="idw")
+    node_cols, node_rows = np.meshgrid(grid.lattice_cols, grid.lattice_rows)
+    temp = 20 + 0.01 * node_cols - 0.02 * node_rows + np.sin(node_cols / 30)
+    temp[1, 2] = np.nan
+    grid.lattice_data = {"temp": temp}
+    return grid
+
+
+def brute_force_idw(grid, values, neighbours, power=2):
+    """
+    Inverse distance weighting over the neighbours closest nodes of every pixel, one pixel at a time
+    """
+    node_cols, node_rows = np.meshgrid(grid.lattice_cols, grid.lattice_rows)
+    valid = ~np.isnan(values)
+    node_cols, node_rows, node_values = node_cols[valid], node_rows[valid], values[valid]
+    output = np.empty((grid.height, grid.width))
+    for row in range(grid.height):
+        for col in range(grid.width):
+            dist = np.hypot(col + 0.5 - node_cols, row + 0.5 - node_rows)
+            closest = np.argsort(dist, kind="stable")[:neighbours]
+            weights = 1 / np.maximum(dist[closest], 1e-12) ** power
+            output[row, col] = (weights * node_values[closest]).sum() / weights.sum()
+    return output
+
+
+@pytest.mark.parametrize("neighbours", [1, 4, 8, 1000])
+def test_idw_matches_brute_force(neighbours):
+    grid = make_grid(width=60, height=40)
+    grid.lattice_data["temp"] = np.random.default_rng(0).uniform(0, 30, grid.lattice_data["temp"].shape)
+    idw = grid._WeatherGrid__idw(grid.lattice_data["temp"], np.arange(60) + 0.5, np.arange(40) + 0.5,
+                                 neighbours=neighbours, chunk_size=500)
+    assert np.allclose(idw, brute_force_idw(grid, grid.lattice_data["temp"], neighbours))
+
+
+def test_idw_windows_match_the_full_grid():
+    grid = make_grid()
+    full = grid.get_weather_data()["temp"]
+    assert full.shape == (200, 300) and np.isfinite(full).all()
+    window = grid.get_weather_data(col_off=70, row_off=30, width=100, height=50)["temp"]
+    assert np.allclose(window, full[30:80, 70:170])
+    # Pixels on a lattice node take its value, the interpolation stays within the lattice values
+    temp = grid.lattice_data["temp"]
+    assert np.nanmin(temp) <= full.min() and full.max() <= np.nanmax(temp)